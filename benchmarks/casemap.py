@@ -0,0 +1,54 @@
+"""Throughput of CASEMAPPING key folding
+
+Run with python -m benchmarks.casemap
+"""
+import random
+import string
+
+from seabird.irc import CaseMapping
+
+from .common import measure, report
+
+NICKS = 5000
+FOLDS = 100000
+
+
+def main():
+    rand = random.Random(1)
+    chars = string.ascii_letters + string.digits + "[]\\^{}|_-"
+    nicks = [
+        "".join(rand.choice(chars) for _ in range(rand.randint(3, 15)))
+        for _ in range(NICKS)
+    ]
+    # Traffic mostly comes from the same nicks over and over.
+    stream = [rand.choice(nicks) for _ in range(FOLDS)]
+
+    casemap = CaseMapping("rfc1459")
+    table = casemap.table
+
+    def lower():
+        for nick in stream:
+            nick.lower()
+
+    def translate():
+        for nick in stream:
+            nick.translate(table)
+
+    def fold():
+        for nick in stream:
+            casemap.fold(nick)
+
+    for name, func in (("str.lower", lower), ("str.translate", translate)):
+        elapsed = measure(func, number=1)
+        report(name, elapsed / FOLDS, "s")
+        report(name + " throughput", FOLDS / elapsed / 1e6, "M/s")
+
+    # Prime the cache so we measure the steady state
+    fold()
+    elapsed = measure(fold, number=1)
+    report("CaseMapping.fold (cached)", elapsed / FOLDS, "s")
+    report("CaseMapping.fold throughput", FOLDS / elapsed / 1e6, "M/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import asyncio
+import random
+import time
+import tracemalloc
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Message
+
+
+class FakeTransport:
+    """Transport which throws away everything written to it"""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def make_bot(plugins=(), **settings):
+    """Return a bot with the given plugins loaded and a fake connection"""
+    config = Config(
+        NICK="bench",
+        USER="bench",
+        NAME="Benchmark Bot",
+        HOST="127.0.0.1",
+        PORT=6667,
+        SSL=False,
+        PREFIX="!",
+        PLUGIN_CLASSES=list(plugins),
+    )
+    config.update(settings)
+
+    bot = Bot(config, loop=asyncio.new_event_loop())
+    for plugin in plugins:
+        bot.load_plugin(plugin)
+
+    bot._transport = FakeTransport()
+
+    return bot
+
+
+def feed(bot, lines):
+    for line in lines:
+        bot.dispatch(Message(line))
+
+
+def timed(func, *args):
+    """Run func once and return (result, seconds)"""
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+
+def measure(func, number=1000, repeat=5):
+    """Return the best time per call of func in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def traced_memory(func, *args):
+    """Run func and return (result, bytes allocated and still alive)"""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        ret = func(*args)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return ret, after - before
+
+
+def report(name, value, unit):
+    if unit == "s":
+        if value < 1e-3:
+            print("{:<40} {:>12.2f} us".format(name, value * 1e6))
+        elif value < 1:
+            print("{:<40} {:>12.2f} ms".format(name, value * 1e3))
+        else:
+            print("{:<40} {:>12.2f} s".format(name, value))
+    elif unit == "B":
+        print("{:<40} {:>12.2f} MiB".format(name, value / 1024 / 1024))
+    elif not unit:
+        print("{:<40} {:>12}".format(name, value))
+    else:
+        print("{:<40} {:>12.2f} {}".format(name, value, unit))
+
+
+def traffic(count, users=500, channels=50, seed=1):
+    """Return a list of lines which look roughly like a busy network"""
+    rand = random.Random(seed)
+    nicks = ["user{}".format(i) for i in range(users)]
+    chans = ["#channel{}".format(i) for i in range(channels)]
+    words = "the quick brown fox jumps over a lazy dog http://example.com/ !math".split()
+
+    lines = []
+    for i in range(count):
+        index = rand.randrange(users)
+        nick = nicks[index]
+        prefix = ":{0}!~{0}@host-{1}.example.com".format(nick, index)
+        kind = rand.random()
+        if kind < 0.75:
+            text = " ".join(rand.choice(words) for _ in range(rand.randint(1, 15)))
+            line = "@time=2020-01-01T00:00:{:02d}.000Z;account={} {} ".format(
+                i % 60, nick, prefix
+            )
+            line += "PRIVMSG {} :{}".format(rand.choice(chans), text)
+        elif kind < 0.85:
+            line = "{} JOIN {}".format(prefix, rand.choice(chans))
+        elif kind < 0.95:
+            line = "{} PART {} :Leaving".format(prefix, rand.choice(chans))
+        elif kind < 0.98:
+            line = "{} QUIT :Quit: bye".format(prefix)
+        else:
+            line = "PING :irc.example.com"
+        lines.append(line)
+
+    return lines
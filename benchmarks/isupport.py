@@ -0,0 +1,81 @@
+"""Replay a large netjoin NAMES/MODE burst through UserTrack
+
+Run with python -m benchmarks.isupport
+"""
+import random
+
+from seabird.modules.isupport import ISupportPlugin, mode_parse
+from seabird.modules.track import UserTrack
+
+from .common import feed, make_bot, measure, report, timed
+
+CHANNELS = 500
+USERS_PER_CHANNEL = 200
+NAMES_PER_LINE = 40
+MODES_PER_LINE = 6
+
+ISUPPORT = (
+    ":irc.example.com 005 bench CHANTYPES=# PREFIX=(qaohv)~&@%+ "
+    "CHANMODES=beIq,k,flj,CFLMPQScgimnprstuz :are supported by this server"
+)
+
+
+def burst_lines(rand):
+    names = []
+    modes = []
+    for i in range(CHANNELS):
+        channel = "#chan{}".format(i)
+        nicks = ["user{}".format(rand.randrange(50000)) for _ in range(USERS_PER_CHANNEL)]
+
+        for j in range(0, len(nicks), NAMES_PER_LINE):
+            names.append(
+                ":irc.example.com 353 bench = {} :{}".format(
+                    channel, " ".join(nicks[j : j + NAMES_PER_LINE])
+                )
+            )
+
+        # Netjoins come with the server re-applying everyone's status modes
+        # along with a few list and key modes mixed in.
+        opped = rand.sample(nicks, USERS_PER_CHANNEL // 4)
+        for j in range(0, len(opped), MODES_PER_LINE):
+            targets = opped[j : j + MODES_PER_LINE]
+            flags = "".join(rand.choice("qaohv") for _ in targets)
+            modes.append(
+                ":irc.example.com MODE {} +{}b {} *!*@spam".format(
+                    channel, flags, " ".join(targets)
+                )
+            )
+
+    return names, modes
+
+
+def main():
+    rand = random.Random(1)
+    names, modes = burst_lines(rand)
+
+    bot = make_bot([UserTrack])
+    bot.current_nick = "bench"
+    feed(bot, [ISUPPORT])
+
+    _, elapsed = timed(feed, bot, names)
+    report("NAMES lines", len(names), "")
+    report("NAMES burst", elapsed, "s")
+    report("NAMES lines/s", len(names) / elapsed, "lines/s")
+
+    _, elapsed = timed(feed, bot, modes)
+    report("MODE lines", len(modes), "")
+    report("MODE burst", elapsed, "s")
+    report("MODE lines/s", len(modes) / elapsed, "lines/s")
+
+    tables = bot.load_plugin(ISupportPlugin).tables
+    params = ["a", "b", "c", "d", "e", "f", "*!*@spam", "key"]
+
+    def parse():
+        for _ in mode_parse("+qaohvb-bk+imnt", params, tables):
+            pass
+
+    report("mode_parse", measure(parse, number=10000), "s")
+
+
+if __name__ == "__main__":
+    main()
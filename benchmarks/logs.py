@@ -0,0 +1,115 @@
+"""Event loop latency with DEBUG logging on and a slow stderr
+
+Run with python -m benchmarks.logs
+
+Heavy traffic is fed through Bot.data_received while a ticker measures how
+late the loop wakes it up. Log output goes to a stream which takes a while
+to accept every write, like a pipe into docker logs, either written
+directly from the loop (the old setup) or through the queue in seabird.log.
+"""
+import asyncio
+import logging
+import time
+
+from seabird.config import Config
+from seabird.log import configure_traffic, setup_logging
+
+from .common import make_bot, report, traffic
+
+LINES = 20000
+CHUNK_SIZE = 4096
+WRITE_DELAY = 0.00005
+TICK = 0.001
+
+
+class SlowStream:
+    """Stream which takes WRITE_DELAY to accept each write"""
+
+    def write(self, data):
+        time.sleep(WRITE_DELAY)
+
+    def flush(self):
+        pass
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(data):
+    bot = make_bot()
+    chunks = [data[i : i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    lags = []
+
+    async def ticker(done):
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    async def feed():
+        done = asyncio.Event()
+        task = asyncio.ensure_future(ticker(done))
+
+        start = time.perf_counter()
+        for chunk in chunks:
+            bot.data_received(chunk)
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+
+        done.set()
+        await task
+        return elapsed
+
+    elapsed = bot.loop.run_until_complete(feed())
+    bot.loop.close()
+
+    return elapsed, lags
+
+
+def main():
+    data = "".join(line + "\r\n" for line in traffic(LINES)).encode("utf-8")
+    root_logger = logging.getLogger()
+
+    def direct():
+        handler = logging.StreamHandler(SlowStream())
+        handler.setFormatter(logging.Formatter("%(levelname)-8s %(message)s"))
+        root_logger.addHandler(handler)
+        root_logger.setLevel(logging.DEBUG)
+        return handler, None
+
+    def queued(sample):
+        def setup():
+            handler = logging.StreamHandler(SlowStream())
+            config = Config(LOG_LEVEL=logging.DEBUG, LOG_TRAFFIC_SAMPLE=sample)
+            listener = setup_logging(config, handler)
+            return root_logger.handlers[-1], listener
+
+        return setup
+
+    setups = [
+        ("direct", direct),
+        ("queue", queued(1)),
+        ("queue, 1 in 100 lines", queued(100)),
+    ]
+    for name, setup in setups:
+        handler, listener = setup()
+        try:
+            elapsed, lags = run(data)
+        finally:
+            if listener is not None:
+                listener.stop()
+            root_logger.removeHandler(handler)
+            configure_traffic(1)
+
+        report(name + " lines/s", LINES / elapsed / 1000, "k/s")
+        report(name + " loop lag p50", percentile(lags, 50), "s")
+        report(name + " loop lag p99", percentile(lags, 99), "s")
+        report(name + " loop lag max", max(lags), "s")
+        if listener is not None:
+            report(name + " dropped records", handler.dropped, "")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Memory cost of running another network in the same process
+
+Compares the memory of a whole process running one network to what each
+additional network adds when resources are shared.
+
+Run with python -m benchmarks.networks
+"""
+import asyncio
+import logging
+import subprocess
+import sys
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.shared import SharedResources
+
+from .common import report, traced_memory
+
+NETWORKS = 10
+
+# Enough settings for every plugin to load.
+SETTINGS = dict(
+    NICK="bench",
+    USER="bench",
+    NAME="Benchmark Bot",
+    HOST="127.0.0.1",
+    PORT=6667,
+    SSL=False,
+    PREFIX="!",
+    PLUGIN_MANIFEST=None,
+    DB_URI="sqlite://",
+    FORECAST_KEY="key",
+    GITHUB_USERNAME="bench",
+    GITHUB_TOKEN="token",
+)
+
+PROCESS = """
+import asyncio, logging, resource
+logging.disable(logging.CRITICAL)
+from benchmarks.networks import add_network
+from seabird.shared import SharedResources
+add_network(asyncio.new_event_loop(), SharedResources())
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+"""
+
+
+def add_network(loop, shared):
+    bot = Bot(Config(SETTINGS), loop=loop, shared=shared)
+    bot.load_plugins()
+    return bot
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+
+    # Max RSS of a fresh process running a single network. Note that
+    # ru_maxrss is in KiB on Linux.
+    process = int(subprocess.check_output([sys.executable, "-c", PROCESS]))
+    report("process with 1 network (max rss)", process, "B")
+
+    loop = asyncio.new_event_loop()
+    shared = SharedResources()
+    bots = [add_network(loop, shared)]
+
+    sizes = []
+    for _ in range(NETWORKS):
+        bot, size = traced_memory(add_network, loop, shared)
+        bots.append(bot)
+        sizes.append(size)
+
+    per_network = sum(sizes) / len(sizes)
+    report("each additional network", per_network, "B")
+    report("additional network / process", per_network / process * 100, "%")
+    report("plugins per network", len(bots[-1].plugins), "")
+    report("shared resources", len(shared.resources), "")
+
+    loop.run_until_complete(shared.close())
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Time spent discovering and importing plugins at startup
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+
+Run with python -m benchmarks.startup
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+from .common import report
+
+RUNS = 5
+
+WALK = """
+import time
+start = time.perf_counter()
+from importlib import import_module
+from pkgutil import walk_packages
+from seabird import modules
+for _, name, _ in walk_packages(modules.__path__, "seabird.modules."):
+    try:
+        import_module(name)
+    except ImportError:
+        pass
+print(time.perf_counter() - start)
+"""
+
+MANIFEST = """
+import sys, time
+start = time.perf_counter()
+from importlib import import_module
+from seabird import modules
+from seabird.manifest import load_manifest, missing_dependencies, plugin_classes
+manifest = load_manifest(modules.__path__[0], "seabird.modules.", sys.argv[1])
+for module in plugin_classes(manifest):
+    if not missing_dependencies(manifest[module]):
+        import_module(module)
+print(time.perf_counter() - start)
+"""
+
+
+def run(code, *args):
+    out = subprocess.check_output(
+        [sys.executable, "-c", code] + list(args),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return float(out)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, "manifest.json")
+
+        report("walk_packages + import all", min(run(WALK) for _ in range(RUNS)), "s")
+        report("manifest (cold)", run(MANIFEST, cache), "s")
+        report("manifest (cached)", min(run(MANIFEST, cache) for _ in range(RUNS)), "s")
+
+
+if __name__ == "__main__":
+    main()
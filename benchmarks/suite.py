@@ -0,0 +1,502 @@
+"""Micro-benchmarks for the parser, dispatch and plugin hot paths
+
+Run with python -m benchmarks run --output results.json, then compare two
+runs with python -m benchmarks compare old.json new.json.
+
+Every benchmark is a setup function which returns (func, ops), where func
+does ops operations. The runner calls func enough times for each sample to
+take at least min_time, takes repeat samples with the garbage collector
+off, and records the time per operation. Comparisons use the fastest
+sample, which is the least affected by whatever else the machine is doing.
+"""
+import argparse
+from collections import OrderedDict
+import datetime
+import fnmatch
+import gc
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from seabird.irc import Identity, Message, Protocol, _decode_tag
+
+from .common import FakeTransport, make_bot, report, traffic
+
+RESULTS_VERSION = 1
+
+CORPUS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "irc-parser-tests",
+    "tests",
+)
+
+BENCHMARKS = OrderedDict()
+
+
+class Skip(Exception):
+    """Raised by a setup function when its benchmark can't run here"""
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def load_corpus(name):
+    try:
+        import yaml
+    except ImportError:
+        raise Skip("PyYAML is not installed")
+
+    path = os.path.join(CORPUS_DIR, "{}.yaml".format(name))
+    if not os.path.exists(path):
+        raise Skip("irc-parser-tests is not checked out")
+
+    with open(path) as f:
+        return yaml.safe_load(f)["tests"]
+
+
+def trace():
+    return traffic(10000)
+
+
+@benchmark("parse.corpus")
+def parse_corpus():
+    lines = [test["input"] for test in load_corpus("msg-split")]
+
+    def func():
+        for line in lines:
+            Message(line)
+
+    return func, len(lines)
+
+
+@benchmark("parse.trace")
+def parse_trace():
+    lines = trace()
+
+    def func():
+        for line in lines:
+            Message(line)
+
+    return func, len(lines)
+
+
+@benchmark("identity.corpus")
+def identity_corpus():
+    sources = [test["source"] for test in load_corpus("userhost-split")]
+
+    def func():
+        for source in sources:
+            Identity(source)
+
+    return func, len(sources)
+
+
+@benchmark("identity.trace")
+def identity_trace():
+    sources = [Message(line).hostmask for line in trace()]
+    sources = [source for source in sources if source is not None]
+
+    def func():
+        for source in sources:
+            Identity(source)
+
+    return func, len(sources)
+
+
+@benchmark("decode_tag")
+def decode_tag():
+    values = [
+        "2020-01-01T00:00:00.000Z",
+        "someaccount",
+        "a\\sreply\\swith\\sspaces",
+        "\\:\\s\\\\\\r\\n",
+        "a" * 64,
+    ]
+
+    def func():
+        for value in values:
+            _decode_tag(value)
+
+    return func, len(values)
+
+
+class FramingProtocol(Protocol):
+    def dispatch(self, msg):
+        pass
+
+
+@benchmark("data_received")
+def data_received():
+    lines = trace()
+    data = "".join(line + "\r\n" for line in lines).encode("utf-8")
+    chunks = [data[i : i + 4096] for i in range(0, len(data), 4096)]
+
+    protocol = FramingProtocol()
+    protocol.connection_made(FakeTransport())
+
+    def func():
+        for chunk in chunks:
+            protocol.data_received(chunk)
+
+    return func, len(lines)
+
+
+def handler_plugins(count):
+    from seabird.plugin import Plugin
+
+    classes = []
+    for i in range(count):
+
+        def irc_privmsg(self, msg):
+            pass
+
+        classes.append(type("Handler{}".format(i), (Plugin,), {"irc_privmsg": irc_privmsg}))
+
+    return classes
+
+
+@benchmark("dispatch.fanout")
+def dispatch_fanout():
+    bot = make_bot(handler_plugins(10))
+    messages = [Message(line) for line in trace()]
+
+    def func():
+        for msg in messages:
+            bot.dispatch(msg)
+
+    return func, len(messages)
+
+
+@benchmark("dispatch.fanout.metrics")
+def dispatch_fanout_metrics():
+    bot = make_bot(handler_plugins(10), METRICS_PORT=0)
+    messages = [Message(line) for line in trace()]
+
+    def func():
+        for msg in messages:
+            bot.dispatch(msg)
+
+    return func, len(messages)
+
+
+@benchmark("dispatch.fanout.routed")
+def dispatch_fanout_routed():
+    # Half the handlers are only allowed in one channel, so the other 49
+    # channels only pay for the other half.
+    plugins = handler_plugins(10)
+    bot = make_bot(
+        plugins,
+        PLUGIN_DENY=[cls.__name__ for cls in plugins[:5]],
+        CHANNEL_RULES={"#channel0": {"plugin_allow": [cls.__name__ for cls in plugins]}},
+    )
+    for i in range(50):
+        bot.dispatch(Message(":bench!bench@example.com JOIN #channel{}".format(i)))
+    messages = [Message(line) for line in trace()]
+
+    def func():
+        for msg in messages:
+            bot.dispatch(msg)
+
+    return func, len(messages)
+
+
+@benchmark("mode_parse")
+def mode_parse():
+    from seabird.modules.isupport import ISupportPlugin, build_tables
+    from seabird.modules.isupport import mode_parse as parse
+
+    tables = build_tables(ISupportPlugin.defaults)
+    changes = [
+        ("+o", ["alice"]),
+        ("+ov-v", ["alice", "bob", "carol"]),
+        ("+bl-k", ["*!*@host", "10", "key"]),
+        ("-ooo+vvv", ["a", "b", "c", "d", "e", "f"]),
+        ("+imnst", []),
+    ]
+
+    def func():
+        for modes, params in changes:
+            for _ in parse(modes, params, tables):
+                pass
+
+    return func, len(changes)
+
+
+def trailing(lines):
+    return [Message(line).trailing for line in lines if " PRIVMSG " in line]
+
+
+@benchmark("regex.karma")
+def regex_karma():
+    try:
+        from seabird.modules.karma import KarmaPlugin
+    except ImportError as exc:
+        raise Skip(str(exc))
+
+    texts = trailing(trace()) + ["seabird++", "c++ is fine", "bugs-- ok"]
+    regex = KarmaPlugin.regex
+
+    def func():
+        for text in texts:
+            for _ in regex.finditer(text):
+                pass
+
+    return func, len(texts)
+
+
+@benchmark("regex.dice")
+def regex_dice():
+    from seabird.modules.fun import DicePlugin
+
+    texts = trailing(trace()) + ["roll 2d6 and 1d20", "d8"]
+    regex = DicePlugin.dice_re
+
+    def func():
+        for text in texts:
+            for _ in regex.finditer(text):
+                pass
+
+    return func, len(texts)
+
+
+@benchmark("regex.url")
+def regex_url():
+    try:
+        from seabird.modules.url import URLPlugin
+    except ImportError as exc:
+        raise Skip(str(exc))
+
+    texts = trailing(trace())
+    regex = URLPlugin.url_regex
+
+    def func():
+        for text in texts:
+            for _ in regex.finditer(text):
+                pass
+
+    return func, len(texts)
+
+
+@benchmark("regex.bleep")
+def regex_bleep():
+    try:
+        import seabird.modules.bleep  # noqa: F401
+    except ImportError as exc:
+        raise Skip(str(exc))
+
+    # BleepPlugin builds one of these per stored word on every message, so
+    # the compile is part of what's measured.
+    words = ["darn", "heck", "fox", "gosh"]
+    texts = [text.lower().strip().split(" ") for text in trailing(trace())]
+
+    def func():
+        for text in texts:
+            for word in words:
+                regex = re.compile(r"\b{}\b".format(word))
+                for item in text:
+                    regex.match(item)
+
+    return func, len(texts)
+
+
+@benchmark("math.eval")
+def math_eval():
+    from seabird.modules.math import MathPlugin
+
+    plugin = make_bot([MathPlugin]).plugins[0]
+    exprs = ["1+1", "2**10 - 3*4", "sin(PI/2) + cos(0)", "(1+2)*(3+4)/5 % 3", "-5^3"]
+
+    def func():
+        for expr in exprs:
+            plugin.eval(expr)
+
+    return func, len(exprs)
+
+
+def calibrate(func, min_time):
+    """Return how many calls of func make a sample of at least min_time"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return loops
+        loops *= 2
+
+
+def run_benchmark(setup, repeat=7, min_time=0.05):
+    func, ops = setup()
+
+    # Warm up caches before measuring anything
+    func()
+    loops = calibrate(func, min_time)
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            samples.append((time.perf_counter() - start) / loops / ops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return {
+        "ops": ops,
+        "loops": loops,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(patterns=None, repeat=7, min_time=0.05):
+    results = OrderedDict()
+    skipped = OrderedDict()
+
+    for name, setup in BENCHMARKS.items():
+        if patterns and not any(fnmatch.fnmatchcase(name, p) for p in patterns):
+            continue
+
+        try:
+            results[name] = run_benchmark(setup, repeat, min_time)
+        except Skip as exc:
+            skipped[name] = str(exc)
+            print("{:<40} {:>12}".format(name, "skipped"), "({})".format(exc))
+            continue
+
+        report(name, results[name]["min"], "s")
+
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "commit": git_commit(),
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(old, new, threshold=0.1):
+    """Compare two sets of results
+
+    Returns a list of (name, old seconds, new seconds, change, status)
+    where change is the relative difference and status is "regression",
+    "improvement" or "" depending on threshold.
+    """
+    ret = []
+    for name, result in new["results"].items():
+        previous = old["results"].get(name)
+        if previous is None:
+            continue
+
+        change = result["min"] / previous["min"] - 1
+        status = ""
+        if change > threshold:
+            status = "regression"
+        elif change < -threshold:
+            status = "improvement"
+
+        ret.append((name, previous["min"], result["min"], change, status))
+
+    return ret
+
+
+def load_results(path):
+    with open(path) as f:
+        data = json.load(f)
+
+    if data.get("version") != RESULTS_VERSION:
+        raise SystemExit("{}: unsupported results version".format(path))
+
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("patterns", nargs="*", help="only run matching benchmarks")
+    run_parser.add_argument("--output", "-o", help="file to save the results to")
+    run_parser.add_argument("--repeat", type=int, default=7)
+    run_parser.add_argument("--min-time", type=float, default=0.05)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="percent slowdown to flag as a regression (10)",
+    )
+
+    subparsers.add_parser("list", help="list the benchmarks")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name in BENCHMARKS:
+            print(name)
+        return 0
+
+    if args.command == "run":
+        data = run(args.patterns, args.repeat, args.min_time)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(data, f, indent=2)
+                f.write("\n")
+        return 0
+
+    old, new = load_results(args.old), load_results(args.new)
+    rows = compare(old, new, args.threshold / 100)
+    regressions = 0
+    for name, before, after, change, status in rows:
+        print(
+            "{:<24} {:>10.3f}us {:>10.3f}us {:>+8.1f}% {}".format(
+                name, before * 1e6, after * 1e6, change * 100, status
+            )
+        )
+        if status == "regression":
+            regressions += 1
+
+    if regressions:
+        print("{} regression(s) above {}%".format(regressions, args.threshold))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
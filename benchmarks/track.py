@@ -0,0 +1,108 @@
+"""Memory and latency of UserTrack with 100k users across 2k channels
+
+Run with python -m benchmarks.track
+"""
+import random
+
+from seabird.modules.track import UserTrack
+
+from .common import feed, make_bot, measure, report, timed, traced_memory
+
+USERS = 100000
+CHANNELS = 2000
+CHANNELS_PER_USER = 3
+NAMES_PER_LINE = 40
+
+
+def names_lines(rand):
+    """Return NAMES replies putting every user in a few random channels"""
+    members = {"#chan{}".format(i): ["bench"] for i in range(CHANNELS)}
+    channels = list(members)
+    for i in range(USERS):
+        for channel in rand.sample(channels, CHANNELS_PER_USER):
+            prefix = rand.choice(("", "", "", "+", "@"))
+            members[channel].append("{}user{}".format(prefix, i))
+
+    lines = []
+    for channel, nicks in members.items():
+        for i in range(0, len(nicks), NAMES_PER_LINE):
+            lines.append(
+                ":irc.example.com 353 bench = {} :{}".format(
+                    channel, " ".join(nicks[i : i + NAMES_PER_LINE])
+                )
+            )
+
+    return lines
+
+
+def main():
+    rand = random.Random(1)
+    bot = make_bot([UserTrack])
+    bot.current_nick = "bench"
+    track = bot.load_plugin(UserTrack)
+
+    lines = names_lines(rand)
+    (_, elapsed), memory = traced_memory(timed, feed, bot, lines)
+
+    memberships = sum(len(u.channels) for u in track.users.values())
+    report("users", len(track.users), "")
+    report("channels", len(track.channels), "")
+    report("memberships", memberships, "")
+    report("build from NAMES", elapsed, "s")
+    report("index memory", memory, "B")
+    report("memory per membership", memory / memberships, "bytes")
+
+    def members():
+        track.members("#chan{}".format(rand.randrange(CHANNELS)))
+
+    report("members lookup", measure(members, number=1000), "s")
+
+    def mode_change():
+        channel = "#chan{}".format(rand.randrange(CHANNELS))
+        nick = rand.choice(track.members(channel))
+        feed(bot, [":op!op@host MODE {} +v {}".format(channel, nick)])
+
+    report("MODE +v", measure(mode_change, number=1000), "s")
+
+    def part():
+        nick = "user{}".format(rand.randrange(USERS))
+        user = track.get_user(nick)
+        if user is None or not user.channels:
+            return
+        channel = next(iter(user.channels))
+        feed(bot, [":{0}!{0}@host PART {1} :bye".format(nick, channel)])
+
+    report("PART", measure(part, number=1000), "s")
+
+    quitters = iter(rand.sample(sorted(track.users), 1000))
+
+    def quit_():
+        nick = next(quitters)
+        if nick == "bench":
+            return
+        feed(bot, [":{0}!{0}@host QUIT :bye".format(nick)])
+
+    report("QUIT", measure(quit_, number=100), "s")
+
+    netsplit = [":irc.example.com BATCH +split netsplit irc.a.net irc.b.net"]
+    for nick in rand.sample(sorted(track.users), 5000):
+        if nick != "bench":
+            netsplit.append(
+                "@batch=split :{0}!{0}@host QUIT :irc.a.net irc.b.net".format(nick)
+            )
+    netsplit.append(":irc.example.com BATCH -split")
+
+    _, elapsed = timed(feed, bot, netsplit)
+    report("netsplit batch (5000 users)", elapsed, "s")
+
+    channels = iter(rand.sample(sorted(track.channels), 100))
+
+    def self_part():
+        channel = next(channels)
+        feed(bot, [":bench!bench@host PART {} :bye".format(channel)])
+
+    report("self PART", measure(self_part, number=100, repeat=1), "s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Size and speed of the wire format compared to raw lines and JSON
+
+Run with python -m benchmarks.wire
+"""
+import json
+
+from seabird.irc import CaseMapping, Message
+from seabird.wire import Decoder, Encoder
+
+from .common import measure, report, traffic
+
+MESSAGES = 50000
+
+
+def main():
+    casemap = CaseMapping()
+    lines = traffic(MESSAGES)
+    messages = [Message(line, current_nick="bench", casemap=casemap) for line in lines]
+    items = [(1600000000.0 + i / 100, msg) for i, msg in enumerate(messages)]
+
+    def encode_raw():
+        return b"".join(line.encode("utf-8") + b"\r\n" for line in lines)
+
+    def encode_json():
+        out = []
+        for timestamp, msg in items:
+            data = {
+                "time": timestamp,
+                "tags": msg.tags,
+                "source": msg.hostmask,
+                "verb": msg.event,
+                "params": msg.args,
+            }
+            out.append(json.dumps(data).encode("utf-8"))
+        return b"\n".join(out)
+
+    def encode_wire():
+        return Encoder().encode_many(items)
+
+    raw, json_data, wire = encode_raw(), encode_json(), encode_wire()
+
+    def decode_raw():
+        for line in raw.decode("utf-8").split("\r\n")[:-1]:
+            Message(line, current_nick="bench", casemap=casemap)
+
+    def decode_json():
+        for line in json_data.splitlines():
+            data = json.loads(line)
+            Message.from_parts(
+                data["verb"],
+                data["params"],
+                tags=data["tags"],
+                hostmask=data["source"],
+                current_nick="bench",
+                casemap=casemap,
+            )
+
+    def decode_wire():
+        for _ in Decoder(casemap).decode(wire):
+            pass
+
+    for name, data, encode, decode in (
+        ("raw", raw, encode_raw, decode_raw),
+        ("json", json_data, encode_json, decode_json),
+        ("wire", wire, encode_wire, decode_wire),
+    ):
+        report("{} size per message".format(name), len(data) / MESSAGES, "bytes")
+        report("{} encode".format(name), measure(encode, 1, 3) / MESSAGES, "s")
+        report("{} decode".format(name), measure(decode, 1, 3) / MESSAGES, "s")
+
+
+if __name__ == "__main__":
+    main()
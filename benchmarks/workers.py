@@ -0,0 +1,99 @@
+"""End to end throughput of plugins running in worker processes
+
+Every message goes through the full path: read from the socket buffer,
+dispatched, sent to a worker, handled by a CPU bound plugin and the reply
+written back to the transport.
+
+Run with python -m benchmarks.workers
+"""
+import asyncio
+import logging
+import os
+import time
+
+from seabird.plugin import Plugin
+
+from .common import FakeTransport, make_bot, report
+
+MESSAGES = 4000
+CHANNELS = 64
+
+
+class BusyPlugin(Plugin):
+    """Stands in for something CPU heavy, like parsing a page"""
+
+    def irc_privmsg(self, msg):
+        total = 0
+        for i in range(5000):
+            total += i * i
+        self.bot.reply(msg, str(total))
+
+
+class CountingTransport(FakeTransport):
+    def __init__(self):
+        super().__init__()
+        self.lines = 0
+
+    def write(self, data):
+        super().write(data)
+        self.lines += data.count(b"\n")
+
+
+def run(workers):
+    if workers:
+        bot = make_bot(
+            WORKER_PLUGINS=["benchmarks.workers.BusyPlugin"], WORKER_COUNT=workers
+        )
+        bot.load_plugins()
+        bot.loop.run_until_complete(bot.workers.wait_ready())
+    else:
+        bot = make_bot([BusyPlugin])
+
+    transport = CountingTransport()
+    bot.connection_made(transport)
+    bot.data_received(b":irc.example.com 001 bench :Welcome\r\n")
+    transport.lines = 0
+
+    data = b"".join(
+        ":user{0}!u@host PRIVMSG #chan{1} :message {0}\r\n".format(
+            i, i % CHANNELS
+        ).encode("utf-8")
+        for i in range(MESSAGES)
+    )
+
+    async def wait():
+        # Lines come in from the socket in chunks, so feed them that way.
+        for i in range(0, len(data), 16 * 1024):
+            bot.data_received(data[i : i + 16 * 1024])
+            await asyncio.sleep(0)
+
+        while transport.lines < MESSAGES:
+            await asyncio.sleep(0.001)
+
+    start = time.perf_counter()
+    try:
+        bot.loop.run_until_complete(wait())
+    finally:
+        elapsed = time.perf_counter() - start
+        bot.close()
+        bot.loop.close()
+
+    return elapsed
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+
+    counts = [0, 1, 2, 4]
+    cpus = os.cpu_count() or 1
+    if cpus > 4:
+        counts.append(cpus)
+
+    for workers in counts:
+        elapsed = run(workers)
+        name = "{} workers".format(workers) if workers else "in process"
+        report(name, MESSAGES / elapsed, "msg/s")
+
+
+if __name__ == "__main__":
+    main()
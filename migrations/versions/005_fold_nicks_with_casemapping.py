@@ -0,0 +1,116 @@
+"""Fold stored nicks with the default casemapping
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 14:02:11.508274
+
+Karma items, weather location nicks and mention groups are now looked up by
+their casemapped form, so "Foo[]" and "foo{}" are the same key. Rows stored
+before that are re-keyed with rfc1459, which is what servers default to.
+Rows which end up with the same key are merged: karma scores are added up,
+the weather location which was already folded wins, and duplicate mentions
+are dropped.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+from seabird.irc import CaseMapping
+
+
+karma = sa.table(
+    'karma',
+    sa.column('name', sa.String),
+    sa.column('score', sa.Integer),
+)
+
+weather_locations = sa.table(
+    'weather_locations',
+    sa.column('nick', sa.String),
+    sa.column('address', sa.String),
+    sa.column('lat', sa.Float),
+    sa.column('lon', sa.Float),
+)
+
+multimention = sa.table(
+    'multimention',
+    sa.column('mmention_id', sa.Integer),
+    sa.column('group_name', sa.String),
+    sa.column('nick', sa.String),
+)
+
+
+def upgrade():
+    conn = op.get_bind()
+    casemap = CaseMapping()
+
+    # Karma items and mentions were lowercased before being folded, weather
+    # nicks were only folded.
+    groups = defaultdict(list)
+    for name, score in conn.execute(sa.select([karma.c.name, karma.c.score])).fetchall():
+        groups[casemap.fold(name.lower())].append((name, score))
+
+    for folded, rows in groups.items():
+        if [name for name, _ in rows] == [folded]:
+            continue
+
+        conn.execute(karma.delete().where(karma.c.name.in_([name for name, _ in rows])))
+        conn.execute(
+            karma.insert().values(name=folded, score=sum(score or 0 for _, score in rows))
+        )
+
+    groups = defaultdict(list)
+    for row in conn.execute(sa.select([weather_locations])).fetchall():
+        groups[casemap.fold(row.nick)].append(row)
+
+    for folded, rows in groups.items():
+        if [row.nick for row in rows] == [folded]:
+            continue
+
+        keep = next((row for row in rows if row.nick == folded), rows[0])
+        conn.execute(
+            weather_locations.delete().where(
+                weather_locations.c.nick.in_([row.nick for row in rows])
+            )
+        )
+        conn.execute(
+            weather_locations.insert().values(
+                nick=folded, address=keep.address, lat=keep.lat, lon=keep.lon
+            )
+        )
+
+    groups = defaultdict(list)
+    query = sa.select([multimention]).order_by(multimention.c.mmention_id)
+    for row in conn.execute(query).fetchall():
+        key = (casemap.fold(row.group_name.lower()), casemap.fold(row.nick.lower()))
+        groups[key].append(row)
+
+    for (group_name, nick), rows in groups.items():
+        keep = next(
+            (row for row in rows if (row.group_name, row.nick) == (group_name, nick)),
+            rows[0],
+        )
+        drop = [row.mmention_id for row in rows if row is not keep]
+        if drop:
+            conn.execute(multimention.delete().where(multimention.c.mmention_id.in_(drop)))
+
+        if keep.group_name != group_name or keep.nick != nick:
+            conn.execute(
+                multimention.update()
+                .where(multimention.c.mmention_id == keep.mmention_id)
+                .values(group_name=group_name, nick=nick)
+            )
+
+
+def downgrade():
+    # The original case of anything which was folded is gone.
+    pass
@@ -0,0 +1,194 @@
+"""Handle plugins from their own queue instead of inline
+
+Normally Bot.dispatch calls every plugin, one after another, so a plugin
+which takes a while holds up every plugin after it, and every line after
+that. Plugins listed in PLUGIN_QUEUES instead get an Inbox: dispatch only
+puts the message in a bounded queue, and a task belonging to the plugin
+works through it in order.
+
+Handlers of a queued plugin may return an awaitable (irc_* and cmd_* can be
+coroutines). The next message isn't handled until it's done, so a plugin
+waiting on the database or an HTTP request keeps its order without holding
+anyone else up. Blocking code in a handler still blocks the loop; it just
+runs after every inline plugin has seen the rest of the data.
+
+Coroutines from inline plugins are started as background tasks instead (see
+Plugin.schedule), so they can finish out of order.
+
+When an inbox is full, its policy decides what happens:
+
+block
+    Stop reading from the server until the queue is half empty. Nothing is
+    lost, but everything waits on the slowest plugin. Messages from data
+    which was already read are still queued, so the queue can go a little
+    over its size.
+drop_oldest
+    Throw away the message which has been waiting longest.
+drop_newest
+    Throw away the message which was just received.
+
+Plugins which keep protocol state other plugins rely on (like ISupportPlugin
+and UserTrack) set synchronous and are never queued.
+"""
+
+import asyncio
+from collections import deque
+import inspect
+import logging
+import time
+
+from .irc import Batch
+from .tracing import use_trace
+
+LOG = logging.getLogger(__name__)
+
+POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class Inbox:
+    def __init__(self, bot, plugin, size=1000, policy="block"):
+        if policy not in POLICIES:
+            raise ValueError(
+                "Unknown queue policy {!r}. Options are: {}".format(
+                    policy, ", ".join(POLICIES)
+                )
+            )
+
+        self.bot = bot
+        self.plugin = plugin
+        self.size = size
+        self.policy = policy
+
+        self.queue = deque()
+        self.dropped = 0
+        self.blocked = False
+        self.waiter = None
+
+        # Awaitables returned by the handler for the current item
+        self.pending = []
+
+        # The plugin's own dispatch methods are swapped out for ones which
+        # queue, so nothing else needs to know the plugin is queued.
+        self.handle_event = plugin.dispatch_event
+        self.handle_batch = plugin.dispatch_batch
+        plugin.dispatch_event = self.dispatch_event
+        plugin.dispatch_batch = self.dispatch_batch
+
+        # The consumer shouldn't hold open the trace of whatever message
+        # happened to load the plugin.
+        with use_trace(None):
+            self.task = plugin.create_task(self.run())
+
+    @property
+    def name(self):
+        return type(self.plugin).__name__
+
+    def dispatch_event(self, msg):
+        self.put(msg)
+
+    def dispatch_batch(self, batch):
+        self.put(batch)
+
+    def collect(self, result):
+        if inspect.isawaitable(result):
+            self.pending.append(result)
+
+    def put(self, item):
+        if len(self.queue) >= self.size:
+            if self.policy == "drop_newest":
+                self.drop(item)
+                return
+
+            if self.policy == "drop_oldest":
+                self.drop(self.queue.popleft()[0])
+            elif not self.blocked:
+                self.blocked = True
+                self.bot.pause_reading(self)
+
+        trace = getattr(item, "trace", None)
+        if trace is not None:
+            trace.hold()
+
+        self.queue.append((item, time.perf_counter()))
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def drop(self, item):
+        if not self.dropped % 1000:
+            LOG.warning(
+                "Queue for %s is full, %d messages dropped", self.name, self.dropped + 1
+            )
+        self.dropped += 1
+
+        trace = getattr(item, "trace", None)
+        if trace is not None:
+            now = time.perf_counter()
+            trace.add_span("dropped", now, now, plugin=self.name)
+            trace.release()
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                if not self.queue:
+                    self.waiter = loop.create_future()
+                    await self.waiter
+                    self.waiter = None
+                    continue
+
+                item, queued_at = self.queue.popleft()
+                if self.blocked and len(self.queue) <= self.size // 2:
+                    self.blocked = False
+                    self.bot.resume_reading(self)
+
+                await self.handle(item, queued_at)
+        finally:
+            if self.blocked:
+                self.blocked = False
+                self.bot.resume_reading(self)
+
+            for item, _ in self.queue:
+                trace = getattr(item, "trace", None)
+                if trace is not None:
+                    trace.release()
+            self.queue.clear()
+
+    async def handle(self, item, queued_at):
+        trace = getattr(item, "trace", None)
+        start = time.perf_counter()
+        try:
+            if trace is None:
+                await self.call(item)
+            else:
+                with use_trace(trace):
+                    await self.call(item)
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("Error in %s while handling a queued message", self.name)
+        finally:
+            for result in self.pending:
+                if inspect.iscoroutine(result):
+                    result.close()
+            self.pending.clear()
+
+            if trace is not None:
+                trace.add_span("queued", queued_at, start, plugin=self.name)
+                trace.add_span("handler", start, time.perf_counter(), plugin=self.name)
+                trace.release()
+
+    def collect_event(self, msg):
+        self.collect(self.handle_event(msg))
+
+    async def call(self, item):
+        if isinstance(item, Batch):
+            # If the plugin works through the batch one message at a time,
+            # those go straight to it rather than back into the queue.
+            self.plugin.dispatch_event = self.collect_event
+            try:
+                self.collect(self.handle_batch(item))
+            finally:
+                self.plugin.dispatch_event = self.dispatch_event
+        else:
+            self.collect(self.handle_event(item))
+
+        while self.pending:
+            await self.pending.pop(0)
@@ -1,32 +1,222 @@
 import asyncio
+from collections import deque
+import contextvars
+import importlib
 from importlib import import_module
 import inspect
 import logging
-from pkgutil import walk_packages
+import os
+import random
 import ssl
+import sys
+import time
 
+from .actor import Inbox
+from .capabilities import Capabilities
+from .capture import Capture
+from .config import Config
 from .plugin import Plugin
-from .irc import Protocol
+from .irc import Batch, CaseMapping, Protocol
+from .manifest import load_manifest, missing_dependencies
+from .manifest import plugin_classes as plugin_classes_from
+from .metrics import Metrics, MetricsServer
+from .routing import Router
+from .shared import SharedResources
+from .tracing import Tracer, use_trace
 from . import modules
 
 LOG = logging.getLogger(__name__)
 
+# Batches of messages which were sent before now (history and bouncer
+# playback). Plugins still get them, but they don't change the bot's state.
+HISTORY_BATCHES = {"chathistory", "draft/chathistory", "znc.in/playback"}
+
+
+def class_path(cls):
+    return "{}.{}".format(cls.__module__, cls.__qualname__)
+
+
+def network_configs(config):
+    """Return a mapping of network name to the config for that network
+
+    Each section of NETWORKS is layered on top of the top level settings. If
+    there's no NETWORKS setting, there's a single network named after HOST.
+
+    A top level CAPTURE_FILE gets the network name added before the
+    extension, so networks don't write over each other's captures.
+    """
+    networks = config.get("NETWORKS")
+    if not networks:
+        return {config.get("HOST"): config}
+
+    ret = {}
+    for name, settings in networks.items():
+        network = Config(config)
+        network.pop("NETWORKS")
+        if network.get("CAPTURE_FILE") and "CAPTURE_FILE" not in settings:
+            root, ext = os.path.splitext(network["CAPTURE_FILE"])
+            network["CAPTURE_FILE"] = "{}.{}{}".format(root, name, ext)
+        network.update(settings)
+        ret[name] = network
+
+    return ret
+
+
+def run_networks(config, loop=None):
+    """Run a bot for every network in the config until they all stop
+
+    All the bots share a single SharedResources, so plugins which use it only
+    hold one database engine, HTTP pool and cache per process.
+    """
+    loop = loop or asyncio.get_event_loop()
+    shared = SharedResources(config.get("EXECUTOR_WORKERS"))
+
+    bots = []
+    for name, network in network_configs(config).items():
+        bot = Bot(network, loop=loop, shared=shared, name=name)
+        bot.connection.started_at = time.monotonic()
+        bot.load_plugins()
+        bots.append(bot)
+
+    try:
+        loop.run_until_complete(asyncio.gather(*(bot.connect() for bot in bots)))
+    finally:
+        for bot in bots:
+            bot.close()
+        loop.run_until_complete(shared.close())
+
+
+class ConnectionState:
+    """Where a Bot is in connecting, registering and reconnecting"""
+
+    def __init__(self):
+        # Startup timing information, used for the startup report.
+        self.started_at = None
+        self.connected_at = None
+        self.import_times = {}
+
+        # Reconnect state. disconnected is resolved by connection_lost so the
+        # connect loop knows when to try again.
+        self.stopping = False
+        self.disconnected = None
+        self.disconnected_at = None
+        self.registered = False
+        self.registrations = 0
+        self.reconnect_times = deque(maxlen=20)
+
+        # Batches which have started but not ended on this connection. This
+        # is reset in connection_made.
+        self.batches = {}
+
+    def startup_report(self, target=None):
+        """Log how long startup took and where the time went"""
+        now = time.monotonic()
+        total_imports = sum(self.import_times.values())
+
+        LOG.info(
+            "Startup: connected in %.3fs, registered in %.3fs, "
+            "%.3fs spent importing %d modules",
+            self.connected_at - self.started_at,
+            now - self.started_at,
+            total_imports,
+            len(self.import_times),
+        )
+
+        # This is similar to python -X importtime, but only for plugin
+        # modules and including everything they imported.
+        for module, elapsed in sorted(
+            self.import_times.items(), key=lambda item: item[1], reverse=True
+        ):
+            LOG.info("  %8.1fms %s", elapsed * 1000, module)
+
+        if target is not None and now - self.started_at > target:
+            LOG.warning(
+                "Startup took %.3fs, over the target of %.3fs",
+                now - self.started_at,
+                target,
+            )
+
+    def reconnect_report(self):
+        """Log how long we were disconnected for"""
+        if self.disconnected_at is None:
+            return
+
+        elapsed = time.monotonic() - self.disconnected_at
+        self.reconnect_times.append(elapsed)
+        LOG.info("Reconnected in %.3fs", elapsed)
+
 
 class Bot(Protocol):
-    def __init__(self, config, loop=None):
+    def __init__(self, config, loop=None, shared=None, name=None):
         # If there was no loop, default to grabbing one
         self.loop = loop or asyncio.get_event_loop()
         self.config = config
+        self.name = name or config.get("HOST")
+
+        # Resources which may be shared with bots on other networks.
+        self.shared = shared or SharedResources(config.get("EXECUTOR_WORKERS"))
 
         self.plugins = []
         self.current_nick = self.config["NICK"]
 
+        # This is updated in place by ISupportPlugin when the server tells us
+        # which CASEMAPPING it uses.
+        self.casemap = CaseMapping()
+
+        # IRCv3 capabilities wanted by plugins and enabled on this
+        # connection.
+        self.caps = Capabilities(self.write)
+
+        # Startup, registration and reconnect state.
+        self.connection = ConnectionState()
+
+        # Pool of worker processes for WORKER_PLUGINS, if there are any.
+        self.workers = None
+
+        # Compiled plugin and command rules for each channel, if there are
+        # any. See seabird.routing.
+        self.router = Router.from_config(self.config, self.casemap)
+
+        # Verb counts and timings, only kept if metrics are being served.
+        self.metrics = None
+        if "METRICS_PORT" in self.config or "METRICS_SOCKET" in self.config:
+            self.metrics = Metrics()
+
+        capture = None
+        capture_file = self.config.get("CAPTURE_FILE")
+        if capture_file is not None:
+            capture = Capture(
+                capture_file,
+                max_bytes=self.config.get("CAPTURE_MAX_BYTES", 64 * 1024 * 1024),
+                backups=self.config.get("CAPTURE_BACKUPS", 5),
+                scrub=self.config.get("CAPTURE_SCRUB", False),
+            )
+
+        # Every network writes to the same trace file, so there's only one
+        # Tracer.
+        tracer = None
+        if "TRACE_FILE" in self.config:
+            tracer = self.shared.get(
+                "tracer", lambda: Tracer.from_config(self.config), Tracer.close
+            )
+
         # Initialize the underlying protocol
-        super().__init__()
+        super().__init__(capture=capture, tracer=tracer)
 
     def connection_made(self, transport):
         super().connection_made(transport)
 
+        self.connection.connected_at = time.monotonic()
+
+        self.current_nick = self.config["NICK"]
+        self.connection.registered = False
+        self.connection.batches = {}
+        if self.router is not None:
+            self.router.clear()
+
+        # Start capability negotiation before registering.
+        self.caps.start()
+
         password = self.config.get("PASS")
         if password is not None:
             self.write("PASS", password)
@@ -40,36 +230,230 @@ class Bot(Protocol):
         for plugin in self.plugins:
             plugin.connection_made(self.transport)
 
+        if self.workers is not None:
+            self.workers.broadcast_event("connection_made")
+
     def connection_lost(self, exc):
         super().connection_lost(exc)
 
+        self.connection.disconnected_at = time.monotonic()
+
         # Dispatch this event
         for plugin in self.plugins:
             plugin.connection_lost(exc)
 
-        self.loop.stop()
+        if self.workers is not None:
+            self.workers.broadcast_event("connection_lost")
+
+        disconnected = self.connection.disconnected
+        if disconnected is not None and not disconnected.done():
+            disconnected.set_result(exc)
 
     def run(self):
         """Run the bot and wait for it to die"""
-        # Make sure to set the current nick
-        self.current_nick = self.config["NICK"]
+        self.connection.started_at = time.monotonic()
+
+        self.load_plugins()
+
+        try:
+            self.loop.run_until_complete(self.connect())
+        finally:
+            self.close()
+            self.loop.run_until_complete(self.shared.close())
+
+    def close(self):
+        """Clean up anything which doesn't belong to the shared resources"""
+        if self.workers is not None:
+            self.workers.stop()
+            self.workers = None
+
+        super().close()
+
+        if "metrics.server" in self.shared:
+            self.shared.resources["metrics.server"].remove(self)
+
+    def run_in_executor(self, func, *args):
+        """Run blocking code in the shared thread pool
+
+        Like asyncio.to_thread, the function runs in a copy of the current
+        context, so a database write from a traced message shows up in the
+        trace.
+        """
+        context = contextvars.copy_context()
+        return self.loop.run_in_executor(
+            self.shared.executor, context.run, func, *args
+        )
+
+    def stop(self):
+        """Disconnect and stop reconnecting"""
+        self.connection.stopping = True
+        if self._transport is not None:
+            self._transport.close()
+
+    def _servers(self):
+        """Return the settings for each server to try, in order
+
+        The main server comes from HOST, PORT, SSL and SSL_VERIFY. Fallbacks
+        can be listed in SERVERS as dicts with the same keys. Any missing keys
+        default to the main server's settings.
+        """
+        main = {
+            "HOST": self.config["HOST"],
+            "PORT": self.config["PORT"],
+            "SSL": self.config["SSL"],
+            "SSL_VERIFY": self.config.get("SSL_VERIFY", True),
+        }
+
+        ret = [main]
+        for server in self.config.get("SERVERS", []):
+            settings = dict(main)
+            settings.update(server)
+            ret.append(settings)
+
+        return ret
+
+    def _reconnect_delay(self, attempt):
+        """Return how long to wait before the given reconnect attempt
+
+        This is exponential backoff with full jitter so a netsplit doesn't
+        cause every bot on the network to come back at the same time.
+        """
+        delay = min(
+            self.config.get("RECONNECT_MAX_DELAY", 300),
+            self.config.get("RECONNECT_DELAY", 1) * 2 ** attempt,
+        )
+        return random.uniform(0, delay)
 
+    async def connect(self):
+        """Connect to the server, reconnecting until the bot is stopped
+
+        Plugins and everything they hold on to stay loaded between
+        connections. If we never made it through registration, the next
+        server in the list is tried.
+        """
+        servers = self._servers()
+        connection = self.connection
+        index = 0
+        attempt = 0
+
+        if self.metrics is not None:
+            await self._start_metrics()
+
+        while not connection.stopping:
+            server = servers[index % len(servers)]
+
+            # Create an SSL context if we asked for one
+            ssl_ctx = None
+            if server["SSL"]:
+                ssl_ctx = ssl.create_default_context()
+                if not server["SSL_VERIFY"]:
+                    ssl_ctx.check_hostname = False
+                    ssl_ctx.verify_mode = ssl.CERT_NONE
+
+            LOG.info(
+                "Connecting to %s (%s:%s)", self.name, server["HOST"], server["PORT"]
+            )
+
+            # This is set again once we register. If connecting fails,
+            # connection_made never runs, so it has to be reset here or a
+            # dead server would look like it had worked last time.
+            connection.registered = False
+            connection.disconnected = self.loop.create_future()
+            try:
+                await self.loop.create_connection(
+                    lambda: self, host=server["HOST"], port=server["PORT"], ssl=ssl_ctx
+                )
+            except OSError as exc:
+                LOG.warning(
+                    "Failed to connect to %s:%s: %s", server["HOST"], server["PORT"], exc
+                )
+            else:
+                exc = await connection.disconnected
+                LOG.warning("Disconnected from %s: %s", server["HOST"], exc)
+
+            if connection.stopping or not self.config.get("RECONNECT_ON_FAILURE", True):
+                break
+
+            # If we made it through registration, the server was fine, so we
+            # start the backoff over and try it again first.
+            if connection.registered:
+                attempt = 0
+            else:
+                index += 1
+                attempt += 1
+
+            delay = self._reconnect_delay(attempt)
+            LOG.info("Reconnecting in %.2fs", delay)
+            await asyncio.sleep(delay)
+
+        connection.disconnected = None
+
+    async def _start_metrics(self):
+        """Start serving metrics, if no other network already is"""
+        server = self.shared.get(
+            "metrics.server",
+            lambda: MetricsServer.from_config(self.config),
+            close=MetricsServer.close,
+        )
+        server.add(self)
+        await server.start()
+
+    def cap_req(self, *caps):
+        """Request the given capabilities from the server
+
+        This is meant to be called by plugins either in __init__ or in
+        connection_made. If capabilities have already been negotiated, any
+        supported caps will be requested immediately.
+        """
+        self.caps.wanted.update(caps)
+
+        if self._transport is not None and self.caps.available:
+            self.caps.request_wanted()
+
+    def cap_enabled(self, cap):
+        return cap in self.caps.enabled
+
+    def _handle_batch(self, msg):
+        ref = msg.args[0]
+        if ref.startswith("+"):
+            batch = Batch(ref[1:], msg.args[1], msg.args[2:], msg.tags.get("batch"))
+            self.connection.batches[batch.ref] = batch
+            return
+
+        batch = self.connection.batches.pop(ref[1:], None)
+        if batch is None:
+            LOG.warning("Got end of unknown batch %s", ref[1:])
+            return
+
+        # Nested batches are flattened into their parent so everything is
+        # delivered together when the outermost batch ends.
+        parent = self.connection.batches.get(batch.parent)
+        if parent is not None:
+            parent.messages.extend(batch.messages)
+            return
+
+        self.dispatch_batch(batch)
+
+    def load_plugins(self):
         plugin_classes = self.config.get("PLUGIN_CLASSES")
         plugin_modules = self.config.get("PLUGIN_MODULES")
+
+        # Plugins listed here run in worker processes rather than being
+        # loaded in this one.
+        worker_plugins = self.config.get("WORKER_PLUGINS", [])
+
+        # If nothing was specified, we load everything which isn't disabled.
+        # The manifest lets us find those without importing every module.
         if plugin_classes is None and plugin_modules is None:
-            plugin_modules = []
-            for _, name, _ in walk_packages(modules.__path__, "seabird.modules."):
-                plugin_modules.append(name)
+            plugin_classes = self._manifest_plugin_classes()
 
         # These are modules which contain multiple plugins. All
         # plugins which are found in these modules will be loaded.
         if plugin_modules is not None:
             for module in plugin_modules:
-                LOG.info("Loaded module %s", module)
-
-                mod = import_module(module)
+                mod = self._import_module(module)
 
-                for name, obj in inspect.getmembers(mod):
+                for _, obj in inspect.getmembers(mod):
                     # This is a simple check to filter out any classes which
                     # aren't from the current plugin module (such as imports)
                     if not inspect.isclass(obj) or obj.__module__ != module:
@@ -81,6 +465,9 @@ class Bot(Protocol):
                     if getattr(obj, "__disabled__", False):
                         continue
 
+                    if class_path(obj) in worker_plugins:
+                        continue
+
                     # We attempt to load all classes, but ignore the
                     # failures
                     try:
@@ -90,46 +477,136 @@ class Bot(Protocol):
 
         # These are all plugins which are explicitly loaded
         if plugin_classes is not None:
-            for class_name in self.config.get("PLUGIN_CLASSES", {}):
-                self.load_plugin(class_name)
-
-        # Create an SSL context if we asked for one
-        ssl_ctx = None
-        if self.config["SSL"]:
-            ssl_ctx = ssl.create_default_context()
-            if not self.config.get("SSL_VERIFY", True):
-                ssl_ctx.check_hostname = False
-                ssl_ctx.verify_mode = ssl.CERT_NONE
-
-        connector = self.loop.create_connection(
-            lambda: self,
-            host=self.config["HOST"],
-            port=self.config["PORT"],
-            ssl=ssl_ctx,
+            for class_name in plugin_classes:
+                if class_name not in worker_plugins:
+                    self.load_plugin(class_name)
+
+        if worker_plugins:
+            # Imported here because the worker module needs the Bot class.
+            from .workers import WorkerPool  # pylint: disable=import-outside-toplevel
+
+            self.workers = WorkerPool(
+                self, worker_plugins, self.config.get("WORKER_COUNT")
+            )
+            self.workers.start()
+
+    def _manifest_plugin_classes(self):
+        """Import every module with enabled plugins and return their paths"""
+        manifest = load_manifest(
+            modules.__path__[0],
+            "seabird.modules.",
+            self.config.get("PLUGIN_MANIFEST", ".seabird-manifest.json"),
         )
 
-        # Run until complete here will only run until the we are connected,
-        # not until the connection is finished.
-        self.loop.run_until_complete(connector)
+        plugin_classes = []
+        for module, class_names in plugin_classes_from(manifest).items():
+            missing = missing_dependencies(manifest[module])
+            if missing:
+                LOG.error(
+                    "Skipping module %s, missing dependencies: %s",
+                    module,
+                    ", ".join(missing),
+                )
+                continue
+
+            self._import_module(module)
+            for name in class_names:
+                plugin_classes.append("{}.{}".format(module, name))
+
+        return plugin_classes
 
-        # In this case, forever means until it's stopped. Specifically in
-        # connection_lost.
-        # TODO: This should be fixed so we actually only run until the
-        # connection is done.
-        self.loop.run_forever()
+    def _import_module(self, module):
+        """Import a module, keeping track of how long it took"""
+        # Modules which were already imported (usually as a dependency of
+        # another plugin) take no time, so there's no use in reporting them.
+        if module in sys.modules:
+            return sys.modules[module]
+
+        start = time.perf_counter()
+        mod = import_module(module)
+        elapsed = time.perf_counter() - start
+
+        self.connection.import_times[module] = elapsed
+        LOG.info("Loaded module %s in %.1fms", module, elapsed * 1000)
+
+        return mod
 
     def dispatch(self, msg):
+        if self.metrics is not None:
+            self.metrics.verbs[msg.event] += 1
+
+        if msg.event == "CAP":
+            self.caps.handle(msg)
+        elif msg.event == "BATCH":
+            self._handle_batch(msg)
+            return
+
+        # Messages which are part of a batch are held until the end of the
+        # batch.
+        if msg.tags and "batch" in msg.tags:
+            batch = self.connection.batches.get(msg.tags["batch"])
+            if batch is not None:
+                batch.messages.append(msg)
+                return
+
+        self._dispatch_message(msg)
+
+    def dispatch_batch(self, batch):
+        """Send a completed batch to all plugins as a single event"""
+        if batch.type.lower() in HISTORY_BATCHES:
+            for msg in batch.messages:
+                msg.current_nick = self.current_nick
+                msg.casemap = self.casemap
+        else:
+            for msg in batch.messages:
+                self._update_state(msg)
+
+        if self.router is None:
+            for plugin in self.plugins:
+                result = plugin.dispatch_batch(batch)
+                if result is not None:
+                    plugin.schedule(result)
+        else:
+            for plugin, routed in self.router.route_batch(batch):
+                result = plugin.dispatch_batch(routed)
+                if result is not None:
+                    plugin.schedule(result)
+
+        if self.workers is not None:
+            self.workers.dispatch_batch(batch)
+
+    def _update_state(self, msg):
         # Ensure current_nick is up to date
         if msg.event == "001":
             self.current_nick = msg.args[0]
-        elif msg.event == "NICK" and msg.identity.name == self.current_nick:
+        elif msg.event == "NICK" and self.casemap.equal(
+            msg.identity.name, self.current_nick
+        ):
             self.current_nick = msg.args[0]
         elif msg.event == "437" or msg.event == "433":
             self.current_nick += "_"
             self.write("NICK", self.current_nick)
 
-        # If we just connected, send all lines
+        # If we just connected, send all lines. Negotiation is definitely over
+        # at this point, even if the server never responded to CAP.
         if msg.event == "001":
+            self.caps.negotiating = False
+            self.connection.registered = True
+            self.connection.registrations += 1
+
+            if self.connection.started_at is not None:
+                self.connection.startup_report(self.config.get("STARTUP_TARGET"))
+                self.connection.started_at = None
+
+            if self.connection.registrations > 1:
+                self.connection.reconnect_report()
+
+                for plugin in self.plugins:
+                    plugin.reconnected()
+
+                if self.workers is not None:
+                    self.workers.broadcast_event("reconnected")
+
             for line in self.config.get("CMDS", []):
                 self.write_line(line)
 
@@ -137,12 +614,87 @@ class Bot(Protocol):
         if msg.event == "PING":
             self.write("PONG", *msg.args)
 
+        if self.router is not None and msg.args:
+            self._update_channel_routes(msg)
+
         # Attach the current nick to the message for callbacks
         msg.current_nick = self.current_nick
+        msg.casemap = self.casemap
+
+    def _update_channel_routes(self, msg):
+        """Keep a route for every channel we're in
+
+        Workers have their own router, so they're told about the change too.
+        """
+        if msg.event == "JOIN" and self.casemap.equal(msg.identity.name, self.current_nick):
+            change = "join"
+        elif msg.event == "PART" and self.casemap.equal(msg.identity.name, self.current_nick):
+            change = "part"
+        elif msg.event == "KICK" and len(msg.args) > 1:
+            if not self.casemap.equal(msg.args[1], self.current_nick):
+                return
+            change = "part"
+        else:
+            return
+
+        getattr(self.router, change)(msg.args[0])
+        if self.workers is not None:
+            self.workers.broadcast_route(change, msg.args[0])
+
+    def _dispatch_message(self, msg):
+        if self.metrics is not None or msg.trace is not None:
+            self._timed_dispatch_message(msg)
+            return
+
+        self._update_state(msg)
+
+        plugins = self.plugins
+        if self.router is not None:
+            plugins = self.router.route(msg).plugins
 
         # Dispatch all events
-        for plugin in self.plugins:
-            plugin.dispatch_event(msg)
+        for plugin in plugins:
+            result = plugin.dispatch_event(msg)
+            if result is not None:
+                plugin.schedule(result)
+
+        if self.workers is not None:
+            self.workers.dispatch(msg)
+
+    def _timed_dispatch_message(self, msg):
+        """_dispatch_message, but recording how long everything took
+
+        Timings go to the metrics, the message's trace, or both.
+        """
+        handlers = self.metrics.handlers if self.metrics is not None else None
+        trace = msg.trace
+        start = time.perf_counter()
+
+        self._update_state(msg)
+
+        plugins = self.plugins
+        if self.router is not None:
+            plugins = self.router.route(msg).plugins
+
+        now = time.perf_counter()
+        for plugin in plugins:
+            result = plugin.dispatch_event(msg)
+            if result is not None:
+                plugin.schedule(result)
+            last, now = now, time.perf_counter()
+            name = type(plugin).__name__
+            if handlers is not None:
+                handlers[name].observe(now - last)
+            if trace is not None:
+                trace.add_span("handler", last, now, plugin=name)
+
+        if self.workers is not None:
+            self.workers.dispatch(msg)
+            if trace is not None:
+                trace.add_span("workers", now, time.perf_counter())
+
+        if self.metrics is not None:
+            self.metrics.dispatch.observe(time.perf_counter() - start)
 
     def load_plugin(self, obj):
         """Load and return a given plugin
@@ -160,21 +712,160 @@ class Bot(Protocol):
             raise TypeError("Class {} is not a valid Plugin".format(obj))
 
         # If it's already loaded, we should just return the already loaded
-        # instance.
-        for plugin in self.plugins:
-            if isinstance(plugin, plugin_class):
-                return plugin
+        # instance. Classes are compared by name so plugins holding on to a
+        # class from before a reload still find the new instance.
+        plugin = self._find_loaded(plugin_class)
+        if plugin is not None:
+            return plugin
 
         # Initialize the plugin
-        plugin = plugin_class(self)
+        plugin = self._create_plugin(plugin_class)
 
         # Add the plugin to the list
         self.plugins.append(plugin)
+        self.update_routes()
 
         LOG.info("Loaded plugin %s", plugin_class)
 
         return plugin
 
+    def _create_plugin(self, plugin_class):
+        """Create a plugin, giving it an inbox if it's in PLUGIN_QUEUES"""
+        plugin = plugin_class(self)
+
+        queues = self.config.get("PLUGIN_QUEUES", [])
+        path = class_path(plugin_class)
+        if path not in queues:
+            return plugin
+
+        if plugin_class.synchronous:
+            LOG.warning("Plugin %s has to be dispatched inline, not queueing it", path)
+            return plugin
+
+        options = {
+            "size": self.config.get("PLUGIN_QUEUE_SIZE", 1000),
+            "policy": self.config.get("PLUGIN_QUEUE_POLICY", "block"),
+        }
+        if isinstance(queues, dict):
+            options.update(queues[path] or {})
+
+        plugin.inbox = Inbox(self, plugin, **options)
+
+        return plugin
+
+    def _find_loaded(self, plugin_class):
+        """Return the loaded instance of a plugin class or None"""
+        path = class_path(plugin_class)
+        for plugin in self.plugins:
+            for cls in inspect.getmro(type(plugin)):
+                if class_path(cls) == path:
+                    return plugin
+
+        return None
+
+    def find_plugin(self, name):
+        """Return the loaded plugin with the given class name or path"""
+        for plugin in self.plugins:
+            if name in (type(plugin).__name__, class_path(type(plugin))):
+                return plugin
+
+        return None
+
+    def unload_plugin(self, plugin):
+        """Remove a plugin, cancelling any tasks it started"""
+        plugin.unload()
+
+        for task in list(plugin.tasks):
+            task.cancel()
+
+        self.plugins.remove(plugin)
+        self.update_routes()
+
+        LOG.info("Unloaded plugin %s", type(plugin))
+
+    def reload_plugin(self, plugin):
+        """Re-import a plugin's module and replace it without reconnecting
+
+        Every loaded plugin from the same module is replaced, as they would
+        otherwise be left running old code. State is handed from each old
+        instance to its replacement with export_state and import_state, and
+        references other plugins hold to the old instances are updated.
+
+        Note that other modules which imported names from the reloaded module
+        keep the old versions until they're reloaded as well.
+
+        Returns the list of new plugin instances.
+        """
+        module_name = type(plugin).__module__
+
+        # If the module fails to import, nothing has been touched yet and the
+        # old plugins keep running.
+        module = importlib.reload(sys.modules[module_name])
+
+        old = [
+            (index, loaded)
+            for index, loaded in enumerate(self.plugins)
+            if type(loaded).__module__ == module_name
+        ]
+        states = {}
+        for _, old_plugin in old:
+            states[old_plugin] = old_plugin.export_state()
+            self.unload_plugin(old_plugin)
+
+        ret = []
+        for index, old_plugin in old:
+            plugin_class = getattr(module, type(old_plugin).__qualname__, None)
+            if plugin_class is None:
+                LOG.warning("Plugin %s no longer exists", type(old_plugin))
+                continue
+
+            # Plugins from the same module may depend on each other, so this
+            # may have already been loaded by another one.
+            new = self._find_loaded(plugin_class)
+            if new is None:
+                new = self._create_plugin(plugin_class)
+            else:
+                self.plugins.remove(new)
+
+            # Put the plugin back where it was so dispatch order doesn't change.
+            self.plugins.insert(min(index, len(self.plugins)), new)
+
+            if states[old_plugin] is not None:
+                new.import_state(states[old_plugin])
+
+            self._rebind_plugin(old_plugin, new)
+            ret.append(new)
+
+            LOG.info("Reloaded plugin %s", plugin_class)
+
+        self.update_routes()
+
+        return ret
+
+    def update_routes(self):
+        """Recompile the plugin rules, after plugins or the config change
+
+        Rules can only be changed at runtime if there were some to begin
+        with; otherwise there's no router and nothing is checked.
+        """
+        if self.router is not None:
+            self.router.configure(self.config)
+            self.router.rebuild(self.plugins)
+
+    def command_enabled(self, cmd):
+        """Return whether a command may be used where it was sent"""
+        if self.router is None:
+            return True
+
+        return self.router.route(cmd).command_enabled(cmd.event)
+
+    def _rebind_plugin(self, old, new):
+        """Point any references to the old plugin at the new one"""
+        for plugin in self.plugins:
+            for key, value in vars(plugin).items():
+                if value is old:
+                    setattr(plugin, key, new)
+
     # IRC helpers go here
 
     def mention_reply(self, event, msg):
@@ -191,6 +882,15 @@ class Bot(Protocol):
             raise ValueError("Invalid IRC event")
 
         if event.from_channel:
-            self.write("PRIVMSG", event.args[0], msg)
+            target = event.args[0]
         else:
-            self.write("PRIVMSG", event.identity.name, msg)
+            target = event.identity.name
+
+        if event.trace is None:
+            self.write("PRIVMSG", target, msg)
+            return
+
+        # Replies from callbacks, like call_later, don't run in the context
+        # the message was handled in, so the trace comes from the message.
+        with use_trace(event.trace):
+            self.write("PRIVMSG", target, msg)
@@ -0,0 +1,87 @@
+"""IRCv3 capability negotiation
+
+Plugins ask for capabilities with Bot.cap_req, usually in __init__. When the
+bot connects it asks the server what it supports, requests everything wanted
+which is available and ends negotiation once the server has answered all of
+them. Capabilities wanted after that are requested straight away.
+"""
+
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class Capabilities:
+    def __init__(self, write):
+        self.write = write
+
+        # Capabilities requested by plugins. batch is handled by the bot
+        # itself, so we always ask for it.
+        self.wanted = {"batch"}
+
+        # Per-connection state. This is reset by start.
+        self.available = {}
+        self.enabled = set()
+        self.pending = set()
+        self.negotiating = False
+
+    def start(self):
+        """Start negotiating on a new connection
+
+        Servers which don't support CAP will just ignore it and register us
+        as normal.
+        """
+        self.available = {}
+        self.enabled = set()
+        self.pending = set()
+        self.negotiating = True
+        self.write("CAP", "LS", "302")
+
+    def request_wanted(self):
+        request = self.wanted & self.available.keys()
+        request -= self.enabled | self.pending
+        if request:
+            self.pending.update(request)
+            self.write("CAP", "REQ", " ".join(sorted(request)))
+
+        self._maybe_end()
+
+    def _maybe_end(self):
+        if self.negotiating and not self.pending:
+            self.negotiating = False
+            self.write("CAP", "END")
+
+    def handle(self, msg):
+        # CAP <target> <subcommand> [*] :<caps>
+        subcommand = msg.args[1].upper()
+        caps = msg.args[-1].split()
+
+        if subcommand in ("LS", "NEW"):
+            for cap in caps:
+                name, _, value = cap.partition("=")
+                self.available[name] = value or None
+
+            # A * before the caps means there are more lines coming.
+            if len(msg.args) > 3 and msg.args[2] == "*":
+                return
+
+            self.request_wanted()
+        elif subcommand == "ACK":
+            for cap in caps:
+                if cap.startswith("-"):
+                    self.enabled.discard(cap[1:])
+                    self.pending.discard(cap[1:])
+                else:
+                    self.enabled.add(cap)
+                    self.pending.discard(cap)
+
+            LOG.info("Enabled capabilities: %s", ", ".join(sorted(self.enabled)))
+            self._maybe_end()
+        elif subcommand == "NAK":
+            LOG.warning("Capabilities rejected: %s", ", ".join(caps))
+            self.pending.difference_update(caps)
+            self._maybe_end()
+        elif subcommand == "DEL":
+            for cap in caps:
+                self.available.pop(cap, None)
+                self.enabled.discard(cap)
@@ -0,0 +1,146 @@
+"""Record incoming traffic so it can be replayed later
+
+Captures use the wire format and are rotated like logging's
+RotatingFileHandler: once the current file is bigger than max_bytes it's
+renamed to path.1 (and path.1 to path.2 and so on) and a new file is
+started. A capture left over from a previous run is rotated out the same way
+rather than overwritten.
+"""
+
+import hashlib
+import ipaddress
+import logging
+import os
+import re
+import time
+
+from .irc import Message
+from .wire import Writer
+
+LOG = logging.getLogger(__name__)
+
+IP_REGEX = re.compile(
+    r"(?<![\w:.])(?:\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:.]{2,})(?![\w:.])"
+)
+
+# The position of the host in replies which include one.
+HOST_PARAMS = {
+    "311": 3,  # WHOIS
+    "314": 3,  # WHOWAS
+    "352": 3,  # WHO
+    "354": 4,  # WHOX, with the fields used by UserTrack
+    "396": 1,  # Displayed host changed
+}
+
+
+class Scrubber:
+    """Replace hostnames and IP addresses with stable pseudonyms
+
+    The same host always maps to the same pseudonym within a capture, so
+    replays still see the same users, but the real hosts can't be recovered
+    without the salt, which is never written out.
+    """
+
+    def __init__(self, salt=None):
+        self.salt = salt if salt is not None else os.urandom(16)
+        self.cache = {}
+
+    def host(self, host):
+        ret = self.cache.get(host)
+        if ret is None:
+            digest = hashlib.blake2b(
+                host.encode("utf-8"), digest_size=6, key=self.salt
+            ).hexdigest()
+            ret = "{}.scrubbed".format(digest)
+            self.cache[host] = ret
+
+        return ret
+
+    def _ip(self, match):
+        try:
+            ipaddress.ip_address(match.group(0))
+        except ValueError:
+            return match.group(0)
+
+        return self.host(match.group(0))
+
+    def text(self, text):
+        return IP_REGEX.sub(self._ip, text)
+
+    def message(self, msg):
+        """Return a scrubbed copy of a message"""
+        hostmask = msg.hostmask
+        if hostmask is not None and "@" in hostmask:
+            name, _, host = hostmask.rpartition("@")
+            hostmask = "{}@{}".format(name, self.host(host))
+
+        args = [self.text(arg) for arg in msg.args]
+        index = HOST_PARAMS.get(msg.event)
+        if index is not None and index < len(args):
+            args[index] = self.host(msg.args[index])
+
+        tags = {
+            key: self.text(value) if value is not None else None
+            for key, value in msg.tags.items()
+        }
+
+        return Message.from_parts(
+            msg.event,
+            args,
+            tags=tags,
+            hostmask=hostmask,
+            current_nick=msg.current_nick,
+            casemap=msg.casemap,
+        )
+
+
+class Capture:
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=5, scrub=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.scrubber = Scrubber() if scrub else None
+
+        self.f = None
+        self.writer = None
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            self.shift()
+        self.open()
+
+    def open(self):
+        # The file stays open for every write until it's rotated or closed.
+        self.f = open(self.path, "wb")  # pylint: disable=consider-using-with
+        self.writer = Writer(self.f)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def shift(self):
+        """Move the current file and its backups along by one"""
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                src = "{}.{}".format(self.path, index)
+                if os.path.exists(src):
+                    os.replace(src, "{}.{}".format(self.path, index + 1))
+            os.replace(self.path, self.path + ".1")
+
+        LOG.info("Rotated capture %s", self.path)
+
+    def rotate(self):
+        self.close()
+        self.shift()
+        self.open()
+
+    def write(self, msg, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        if self.scrubber is not None:
+            msg = self.scrubber.message(msg)
+
+        self.writer.write(msg, timestamp)
+
+        if self.max_bytes and self.f.tell() >= self.max_bytes:
+            self.rotate()
@@ -1,8 +1,27 @@
 import asyncio
 import logging
+from string import ascii_lowercase, ascii_uppercase
+from sys import intern
+import time
+
+from .tracing import current_trace, use_trace
 
 LOG = logging.getLogger(__name__)
 
+# Every raw line sent or received is logged here at DEBUG. This is kept
+# separate so it can be sampled or turned off (see seabird.log).
+TRAFFIC_LOG = logging.getLogger("seabird.traffic")
+
+
+# https://modern.ircdocs.horse/#casemapping-parameter
+CASEMAPPINGS = {
+    "ascii": str.maketrans(ascii_uppercase, ascii_lowercase),
+    "rfc1459": str.maketrans(ascii_uppercase + "[]\\~", ascii_lowercase + "{}|^"),
+    "strict-rfc1459": str.maketrans(
+        ascii_uppercase + "[]\\", ascii_lowercase + "{}|"
+    ),
+}
+
 
 # https://github.com/ircv3/ircv3-specifications/blob/master/core/message-tags-3.2.md#escaping-values
 TAG_UNMAPPING_VALUES = {
@@ -31,6 +50,90 @@ def _decode_tag(data):
     return ret
 
 
+TAG_MAPPING_VALUES = {
+    '\\': '\\\\',
+    ';': '\\:',
+    ' ': '\\s',
+    '\r': '\\r',
+    '\n': '\\n',
+}
+
+
+def _encode_tag(data):
+    return ''.join(TAG_MAPPING_VALUES.get(char, char) for char in data)
+
+
+def format_line(tags, hostmask, event, args):
+    """Build a raw line from the parts of a message"""
+    parts = []
+    if tags:
+        parts.append("@" + ";".join(
+            key if value is None else "{}={}".format(key, _encode_tag(value))
+            for key, value in tags.items()
+        ))
+
+    if hostmask is not None:
+        parts.append(":" + hostmask)
+
+    parts.append(event)
+
+    if args:
+        parts.extend(args[:-1])
+
+        last = args[-1]
+        if not last or " " in last or last[0] == ":":
+            last = ":" + last
+        parts.append(last)
+
+    return " ".join(parts)
+
+
+class CaseMapping:
+    """Fold nicks and channels into keys using the server's CASEMAPPING
+
+    The translate tables are built once and folded keys are cached (and
+    interned) because the same handful of nicks and channels are folded over
+    and over again. Consumers should hold on to this object rather than
+    copying the mapping so they pick up changes when ISUPPORT arrives.
+    """
+
+    cache_size = 8192
+
+    def __init__(self, name="rfc1459"):
+        self.name = None
+        self.table = None
+        self.cache = {}
+
+        self.set_mapping(name)
+
+    def set_mapping(self, name):
+        table = CASEMAPPINGS.get(name.lower())
+        if table is None:
+            LOG.warning("Unknown CASEMAPPING %s, falling back to rfc1459", name)
+            name, table = "rfc1459", CASEMAPPINGS["rfc1459"]
+
+        self.name = name.lower()
+        self.table = table
+        self.cache.clear()
+
+    def fold(self, name):
+        folded = self.cache.get(name)
+        if folded is None:
+            folded = intern(name.translate(self.table))
+
+            # This is a really simple way of bounding the cache, but it's
+            # cheap and the working set is quickly rebuilt.
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+
+            self.cache[name] = folded
+
+        return folded
+
+    def equal(self, first, second):
+        return self.fold(first) == self.fold(second)
+
+
 class Identity:
     # name!user@host
     def __init__(self, raw):
@@ -49,9 +152,15 @@ class Identity:
 
 
 class Message:
-    def __init__(self, line, current_nick=None):
-        self.line = line
+    # The seabird.tracing.Trace following this message, if it was sampled.
+    # This is only set on the few messages which are traced, so it's left as
+    # a class attribute rather than costing every message an assignment.
+    trace = None
+
+    def __init__(self, line, current_nick=None, casemap=None):
+        self._line = line
         self.current_nick = current_nick
+        self.casemap = casemap
 
         # IRCv3 message tags
         self.tags = {}
@@ -95,6 +204,34 @@ class Message:
         if trailing is not None:
             self.args.append(trailing)
 
+    # Each argument is one of the parsed fields of a message.
+    @classmethod
+    def from_parts(  # pylint: disable=too-many-arguments
+        cls, event, args, *, tags=None, hostmask=None, current_nick=None, casemap=None
+    ):
+        """Build a message which was already parsed, like one read from a
+        capture, without going through the raw line
+
+        The line is only rebuilt if someone asks for it.
+        """
+        msg = cls.__new__(cls)
+        msg._line = None
+        msg.current_nick = current_nick
+        msg.casemap = casemap
+        msg.tags = tags if tags is not None else {}
+        msg.hostmask = hostmask
+        msg._identity = Identity(hostmask) if hostmask is not None else None
+        msg.event = event
+        msg.args = args
+        return msg
+
+    @property
+    def line(self):
+        if self._line is None:
+            self._line = format_line(self.tags, self.hostmask, self.event, self.args)
+
+        return self._line
+
     @property
     def identity(self):
         if self._identity is None:
@@ -117,11 +254,29 @@ class Message:
         # If the location is the current nick, we know it's a private message.
         # This saves on mucking about with ISupport and other such nonsense and
         # lets us keep this as simple as possible.
+        if self.casemap is not None:
+            return not self.casemap.equal(self.args[0], self.current_nick)
+
         return self.args[0] != self.current_nick
 
 
+class Batch:
+    """A group of messages delivered together with IRCv3 BATCH
+
+    The messages are held until the batch is closed so they can be handled in
+    bulk.
+    """
+
+    def __init__(self, ref, batch_type, params, parent=None):
+        self.ref = ref
+        self.type = batch_type
+        self.params = params
+        self.parent = parent
+        self.messages = []
+
+
 class Protocol(asyncio.Protocol):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, capture=None, tracer=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         # These are actually initialized in connection_made, but we put it here
@@ -129,6 +284,22 @@ class Protocol(asyncio.Protocol):
         self._transport = None
         self.buf = ""
 
+        # If set, every incoming message is written to this (usually a
+        # seabird.capture.Capture) before it's dispatched.
+        self.capture = capture
+
+        # Cheap counters for seabird.metrics
+        self.lines_received = 0
+        self.lines_sent = 0
+
+        # If set, a sample of messages are followed through the bot with
+        # this seabird.tracing.Tracer.
+        self.tracer = tracer
+
+        # Whatever is backed up and has stopped us reading, like a full
+        # plugin queue or the pipe to a worker.
+        self.paused_by = set()
+
     @property
     def transport(self):
         if self._transport is None:
@@ -140,7 +311,44 @@ class Protocol(asyncio.Protocol):
         self._transport = transport
         self.buf = ""
 
+        # Anything which filled up on the last connection is still draining.
+        if self.paused_by:
+            transport.pause_reading()
+
+    def connection_lost(self, exc):
+        self._transport = None
+
+    def pause_reading(self, source):
+        """Stop reading from the server until source catches up
+
+        source is whatever is backed up, like a plugin's Inbox or the pipe to
+        a worker.
+        """
+        if not self.paused_by and self._transport is not None:
+            LOG.warning("Pausing reading until %s catches up", source.name)
+            self._transport.pause_reading()
+        self.paused_by.add(source)
+
+    def resume_reading(self, source):
+        if source not in self.paused_by:
+            return
+
+        self.paused_by.discard(source)
+        if not self.paused_by and self._transport is not None:
+            LOG.info("Resuming reading")
+            self._transport.resume_reading()
+
+    def close(self):
+        """Stop writing to the capture, if there is one"""
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
     def data_received(self, data):
+        if self.tracer is not None:
+            self.traced_data_received(data)
+            return
+
         self.buf += data.decode()
 
         while "\n" in self.buf:
@@ -150,14 +358,53 @@ class Protocol(asyncio.Protocol):
             # Because we're only looking for \n in the sake of
             # compatibility, we strip any trailing \r characters.
             line = line.rstrip("\r")
+            self.lines_received += 1
 
             # We got a line!
-            LOG.debug("<-- %s", line)
+            TRAFFIC_LOG.debug("<-- %s", line)
 
             # Parse and dispatch the message
             msg = Message(line)
+            if self.capture is not None:
+                self.capture.write(msg)
             self.dispatch(msg)
 
+    def traced_data_received(self, data):
+        """data_received, but following a sample of messages with the tracer"""
+        start = time.perf_counter()
+        self.buf += data.decode()
+
+        while "\n" in self.buf:
+            line, self.buf = self.buf.split("\n", 1)
+            line = line.rstrip("\r")
+            self.lines_received += 1
+
+            TRAFFIC_LOG.debug("<-- %s", line)
+
+            trace = self.tracer.maybe_trace(start)
+            framed = time.perf_counter()
+            msg = Message(line)
+            if self.capture is not None:
+                self.capture.write(msg)
+
+            if trace is None:
+                self.dispatch(msg)
+            else:
+                trace.add_span("frame", start, framed, bytes=len(line))
+                trace.add_span("parse", framed, time.perf_counter())
+                trace.event = msg.event
+                if msg.args:
+                    trace.target = msg.args[0]
+
+                msg.trace = trace
+                try:
+                    with use_trace(trace):
+                        self.dispatch(msg)
+                finally:
+                    trace.dispatch_done()
+
+            start = time.perf_counter()
+
     def write(self, *args):
         # If the final argument contains a space, it needs to be encoded as a
         # trailing argument.
@@ -181,11 +428,19 @@ class Protocol(asyncio.Protocol):
         self.write_line(line)
 
     def write_line(self, line):
-        LOG.debug("--> %s", line)
+        TRAFFIC_LOG.debug("--> %s", line)
 
         # Add in the \r\n and send it
-        line += "\r\n"
-        self.transport.write(line.encode("utf-8"))
+        self.lines_sent += 1
+        if self.tracer is None:
+            self.transport.write((line + "\r\n").encode("utf-8"))
+            return
+
+        trace = current_trace.get()
+        start = time.perf_counter()
+        self.transport.write((line + "\r\n").encode("utf-8"))
+        if trace is not None:
+            trace.add_span("send", start, time.perf_counter(), line=line)
 
     def dispatch(self, msg):
         raise NotImplementedError
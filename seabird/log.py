@@ -0,0 +1,134 @@
+"""Logging which never blocks the event loop
+
+Records are put on a bounded queue by a QueueHandler and formatted and
+written out by a QueueListener on a background thread. If whatever is
+reading the output falls behind far enough for the queue to fill up,
+records are dropped and counted rather than stalling the bot.
+
+Every raw line sent or received is logged at DEBUG to the seabird.traffic
+logger, which can be sampled so only one in every N lines is kept.
+"""
+
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+
+from .irc import TRAFFIC_LOG
+
+LOG_FORMAT = "%(levelname)-8s %(message)s"
+COLOR_LOG_FORMAT = "%(log_color)s%(levelname)-8s%(reset)s %(message)s"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler which drops records rather than waiting for room
+
+    The number of dropped records is kept in dropped. Once there's room in
+    the queue again, a warning with the count is logged.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+
+        self.dropped = 0
+        self.reported = 0
+
+    def prepare(self, record):
+        # The default prepare formats the message here, which is the work we
+        # want off the loop. Records are only read by the listener in this
+        # process, so they can be passed along as they are.
+        return record
+
+    def enqueue(self, record):
+        if self.dropped != self.reported:
+            missed = self.dropped - self.reported
+            warning = logging.makeLogRecord(
+                {
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "Dropped %d log records",
+                    "args": (missed,),
+                }
+            )
+            try:
+                self.queue.put_nowait(warning)
+                self.reported += missed
+            except queue.Full:
+                pass
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SampleFilter(logging.Filter):
+    """Keep one in every rate records"""
+
+    def __init__(self, rate):
+        super().__init__()
+
+        self.rate = rate
+        self.count = 0
+
+    def filter(self, record):
+        self.count += 1
+        if self.count >= self.rate:
+            self.count = 0
+            return True
+
+        return False
+
+
+def configure_traffic(sample):
+    """Set how much of the raw traffic is logged
+
+    A sample of 1 logs every line, N logs one in every N lines and 0 turns
+    traffic logging off entirely.
+    """
+    for old in list(TRAFFIC_LOG.filters):
+        if isinstance(old, SampleFilter):
+            TRAFFIC_LOG.removeFilter(old)
+
+    if not sample:
+        TRAFFIC_LOG.setLevel(logging.INFO)
+        return
+
+    TRAFFIC_LOG.setLevel(logging.NOTSET)
+    if sample > 1:
+        TRAFFIC_LOG.addFilter(SampleFilter(sample))
+
+
+def make_formatter():
+    # colorlog is optional.
+    try:
+        from colorlog import ColoredFormatter  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return logging.Formatter(LOG_FORMAT)
+
+    return ColoredFormatter(COLOR_LOG_FORMAT)
+
+
+def setup_logging(config, handler=None):
+    """Send everything logged through a queue to handler on another thread
+
+    handler defaults to a colored StreamHandler on stderr. The listener is
+    already started; call stop on it before exiting so nothing still in the
+    queue is lost.
+    """
+    if handler is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(make_formatter())
+
+    queue_handler = DroppingQueueHandler(config.get("LOG_QUEUE_SIZE", 10000))
+    listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(config.get("LOG_LEVEL", logging.DEBUG))
+
+    configure_traffic(config.get("LOG_TRAFFIC_SAMPLE", 1))
+
+    listener.start()
+
+    return listener
@@ -0,0 +1,246 @@
+"""Plugin discovery without importing every plugin module
+
+Modules are scanned with the ast module to find the plugin classes they
+define, whether those are disabled and what they import. The results are
+cached on disk keyed by each file's mtime and size, so after the first run
+discovery only needs to stat the files.
+"""
+
+import ast
+import importlib.util
+import json
+import logging
+import os
+
+LOG = logging.getLogger(__name__)
+
+# Bump this whenever the format of an entry changes.
+MANIFEST_VERSION = 1
+
+PLUGIN_BASE = "seabird.plugin.Plugin"
+
+
+def iter_modules(path, prefix):
+    """Yield (module name, file path) for every module under a package dir
+
+    Unlike pkgutil.walk_packages, this doesn't import the packages it finds.
+    """
+    for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+        if entry.is_dir():
+            init = os.path.join(entry.path, "__init__.py")
+            if os.path.exists(init):
+                yield prefix + entry.name, init
+                yield from iter_modules(entry.path, prefix + entry.name + ".")
+        elif entry.name.endswith(".py") and entry.name != "__init__.py":
+            yield prefix + entry.name[:-3], entry.path
+
+
+def _resolve_relative(module, is_package, level, name):
+    package = module if is_package else module.rpartition(".")[0]
+    for _ in range(level - 1):
+        package = package.rpartition(".")[0]
+
+    if name:
+        return "{}.{}".format(package, name)
+
+    return package
+
+
+def _dotted(node):
+    """Turn a Name or Attribute node into a dotted name"""
+    if isinstance(node, ast.Name):
+        return node.id
+
+    if isinstance(node, ast.Attribute):
+        value = _dotted(node.value)
+        if value is not None:
+            return "{}.{}".format(value, node.attr)
+
+    return None
+
+
+def _disabled(node):
+    """Return the literal __disabled__ set in a class body, if any"""
+    disabled = None
+    for stmt in node.body:
+        if not isinstance(stmt, ast.Assign) or len(stmt.targets) != 1:
+            continue
+
+        target = stmt.targets[0]
+        if not isinstance(target, ast.Name) or target.id != "__disabled__":
+            continue
+
+        # Only literal values can be checked without importing.
+        value = getattr(stmt.value, "value", None)
+        if isinstance(value, bool):
+            disabled = value
+
+    return disabled
+
+
+def _resolve_bases(bases, names):
+    """Turn base class nodes into fully qualified names"""
+    ret = []
+    for base in bases:
+        dotted = _dotted(base)
+        if dotted is None:
+            continue
+
+        head, _, rest = dotted.partition(".")
+        if head in names:
+            dotted = names[head] + ("." + rest if rest else "")
+        ret.append(dotted)
+
+    return ret
+
+
+def scan_module(module, path):
+    """Return the manifest entry for a single module"""
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), path)
+
+    is_package = os.path.basename(path) == "__init__.py"
+
+    # Mapping of local name to fully qualified name
+    names = {}
+    imports = set()
+    classes = []
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.add(alias.name)
+                names[alias.asname or alias.name.partition(".")[0]] = (
+                    alias.name if alias.asname else alias.name.partition(".")[0]
+                )
+        elif isinstance(node, ast.ImportFrom):
+            # Relative imports are part of the same package, so they're not
+            # something which can be missing.
+            source = node.module or ""
+            if node.level:
+                source = _resolve_relative(module, is_package, node.level, source)
+            else:
+                imports.add(source)
+
+            for alias in node.names:
+                names[alias.asname or alias.name] = "{}.{}".format(source, alias.name)
+        elif isinstance(node, ast.ClassDef):
+            names[node.name] = "{}.{}".format(module, node.name)
+            classes.append(
+                {"name": node.name, "bases": node.bases, "disabled": _disabled(node)}
+            )
+
+    # Now that all the names in the module are known, resolve the bases.
+    for cls in classes:
+        cls["bases"] = _resolve_bases(cls["bases"], names)
+
+    return {"classes": classes, "imports": sorted(imports)}
+
+
+def load_manifest(package_path, prefix, cache_path=None):
+    """Return a manifest of every module under a package
+
+    Only modules which changed since the cached manifest was written are
+    scanned again.
+    """
+    cached = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                cached = data["modules"]
+        except (OSError, ValueError, KeyError):
+            LOG.warning("Ignoring invalid plugin manifest %s", cache_path)
+
+    modules = {}
+    changed = False
+    for module, path in iter_modules(package_path, prefix):
+        stat = os.stat(path)
+        key = [path, stat.st_mtime, stat.st_size]
+        entry = cached.get(module)
+        if entry is None or entry["key"] != key:
+            LOG.debug("Scanning plugin module %s", module)
+            entry = scan_module(module, path)
+            entry["key"] = key
+            changed = True
+
+        modules[module] = entry
+
+    if cache_path is not None and (changed or modules.keys() != cached.keys()):
+        try:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"version": MANIFEST_VERSION, "modules": modules}, f)
+        except OSError:
+            LOG.warning("Failed to write plugin manifest %s", cache_path)
+
+    return modules
+
+
+def plugin_classes(manifest):
+    """Return an ordered mapping of module to the plugins it should load
+
+    This matches the old discovery rules: every class defined in a module
+    which inherits from Plugin (directly or through other classes in the
+    manifest) is loaded unless it, or a class it inherits from, sets
+    __disabled__.
+    """
+    classes = {}
+    for module, entry in manifest.items():
+        for cls in entry["classes"]:
+            classes["{}.{}".format(module, cls["name"])] = cls
+
+    plugins = {}
+    disabled = {}
+
+    def resolve(name, seen=()):
+        if name == PLUGIN_BASE:
+            return True, False
+
+        cls = classes.get(name)
+        if cls is None or name in seen:
+            return False, False
+
+        if name not in plugins:
+            is_plugin = False
+            is_disabled = False
+            for base in cls["bases"]:
+                base_plugin, base_disabled = resolve(base, seen + (name,))
+                if base_plugin:
+                    is_plugin = True
+                    is_disabled = is_disabled or base_disabled
+
+            if cls["disabled"] is not None:
+                is_disabled = cls["disabled"]
+
+            plugins[name] = is_plugin
+            disabled[name] = is_disabled
+
+        return plugins[name], disabled[name]
+
+    ret = {}
+    for module, entry in manifest.items():
+        names = []
+        for cls in entry["classes"]:
+            is_plugin, is_disabled = resolve("{}.{}".format(module, cls["name"]))
+            if is_plugin and not is_disabled:
+                names.append(cls["name"])
+
+        if names:
+            ret[module] = names
+
+    return ret
+
+
+def missing_dependencies(entry):
+    """Return the top level modules imported by a module which aren't installed"""
+    missing = []
+    for name in entry["imports"]:
+        top = name.partition(".")[0]
+        if top == "seabird":
+            continue
+
+        if importlib.util.find_spec(top) is None:
+            missing.append(top)
+
+    return sorted(set(missing))
@@ -0,0 +1,370 @@
+"""Metrics about the running bot in the Prometheus text format
+
+Metrics are turned on by setting METRICS_PORT (served on METRICS_HOST,
+127.0.0.1 by default) or METRICS_SOCKET (a Unix socket path). Every bot in
+the process registers with a single MetricsServer, so with NETWORKS there's
+still only one endpoint, with a network label on per-connection metrics.
+
+The hot paths only ever bump counters: Protocol counts lines in and out,
+and with metrics on, Bot.dispatch counts verbs and dispatch and each plugin's
+handlers are timed into fixed bucket histograms. Everything else is read
+when the endpoint is scraped, including how deep each plugin's queue is
+(see seabird.actor) and how many messages it dropped.
+"""
+
+import asyncio
+from bisect import bisect_left
+from collections import Counter, defaultdict
+import logging
+import os
+
+LOG = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds. Most handlers run in microseconds, but
+# anything near a second is worth seeing.
+BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """Yield the samples for this histogram with the given labels"""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield name + "_bucket", dict(labels, le=_number(bound)), total
+        total += self.counts[-1]
+        yield name + "_bucket", dict(labels, le="+Inf"), total
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, total
+
+
+class Metrics:
+    """Timings for a single bot
+
+    Bot keeps one of these in self.metrics when metrics are on.
+    """
+
+    def __init__(self):
+        self.verbs = Counter()
+        self.dispatch = Histogram()
+        self.handlers = defaultdict(Histogram)
+        self.db_sessions = Histogram()
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+
+    return "{{{}}}".format(
+        ",".join('{}="{}"'.format(key, _escape(value)) for key, value in labels.items())
+    )
+
+
+class Family:
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.samples = []
+
+    def add(self, labels, value, name=None):
+        self.samples.append((name or self.name, labels, value))
+
+    def add_histogram(self, histogram, labels):
+        self.samples.extend(histogram.samples(self.name, labels))
+
+    def render(self, out):
+        out.append("# HELP {} {}".format(self.name, self.help))
+        out.append("# TYPE {} {}".format(self.name, self.kind))
+        for name, labels, value in self.samples:
+            out.append("{}{} {}".format(name, _labels(labels), _number(value)))
+
+
+class MetricsServer:
+    """Serve metrics for every bot in the process
+
+    This is kept in SharedResources so every network uses the same one.
+    """
+
+    lag_interval = 0.5
+
+    def __init__(self, host="127.0.0.1", port=None, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+
+        self.bots = []
+        self.server = None
+        self.lag_task = None
+        self.loop_lag = Histogram()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get("METRICS_HOST", "127.0.0.1"),
+            config.get("METRICS_PORT"),
+            config.get("METRICS_SOCKET"),
+        )
+
+    def add(self, bot):
+        if bot not in self.bots:
+            self.bots.append(bot)
+
+    def remove(self, bot):
+        if bot in self.bots:
+            self.bots.remove(bot)
+
+    async def start(self):
+        if self.server is not None:
+            return
+
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = await asyncio.start_unix_server(self.handle, self.path)
+        else:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            if not self.port:
+                self.port = self.server.sockets[0].getsockname()[1]
+
+        LOG.info("Serving metrics on %s", self.path or "{}:{}".format(self.host, self.port))
+        self.lag_task = asyncio.ensure_future(self.measure_lag())
+
+    async def close(self):
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            self.lag_task = None
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def measure_lag(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag.observe(max(0.0, loop.time() - start - self.lag_interval))
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                status, body = "405 Method Not Allowed", b""
+            elif parts[1].split("?")[0] != "/metrics":
+                status, body = "404 Not Found", b""
+            else:
+                status, body = "200 OK", self.render().encode("utf-8")
+
+            header = (
+                "HTTP/1.0 {}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                "Content-Length: {}\r\n"
+                "\r\n".format(status, len(body))
+            )
+            writer.write(header.encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def render(self):
+        families = {}
+
+        def family(name, kind, help_text):
+            if name not in families:
+                families[name] = Family(name, kind, help_text)
+            return families[name]
+
+        for bot in self.bots:
+            self.collect_bot(bot, family)
+        if self.bots:
+            self.collect_shared(self.bots[0], family)
+        self.collect_caches(family)
+
+        family(
+            "seabird_loop_lag_seconds", "histogram", "How late the event loop runs timers"
+        ).add_histogram(self.loop_lag, {})
+
+        out = []
+        for fam in families.values():
+            fam.render(out)
+        out.append("")
+
+        return "\n".join(out)
+
+    def collect_bot(self, bot, family):
+        network = {"network": bot.name}
+
+        family(
+            "seabird_lines_received_total", "counter", "Lines received from the server"
+        ).add(network, bot.lines_received)
+        family("seabird_lines_sent_total", "counter", "Lines sent to the server").add(
+            network, bot.lines_sent
+        )
+
+        buffered = 0
+        if bot._transport is not None:
+            buffered = bot._transport.get_write_buffer_size()
+        family(
+            "seabird_write_buffer_bytes", "gauge", "Bytes waiting to be sent to the server"
+        ).add(network, buffered)
+
+        family(
+            "seabird_connected", "gauge", "Whether the bot is registered with the server"
+        ).add(network, int(bot.connection.registered))
+
+        tasks = family("seabird_plugin_tasks", "gauge", "Running tasks by plugin")
+        for plugin in bot.plugins:
+            tasks.add(dict(network, plugin=type(plugin).__name__), len(plugin.tasks))
+
+        self.collect_inboxes(bot, family, network)
+
+        metrics = bot.metrics
+        if metrics is None:
+            return
+
+        messages = family(
+            "seabird_messages_total", "counter", "Messages received by verb"
+        )
+        for verb, count in sorted(metrics.verbs.items()):
+            messages.add(dict(network, verb=verb), count)
+
+        family(
+            "seabird_dispatch_seconds", "histogram", "Time to dispatch a message"
+        ).add_histogram(metrics.dispatch, network)
+
+        handlers = family(
+            "seabird_handler_seconds", "histogram", "Time spent in each plugin's handlers"
+        )
+        for plugin, histogram in sorted(metrics.handlers.items()):
+            handlers.add_histogram(histogram, dict(network, plugin=plugin))
+
+        if metrics.db_sessions.count:
+            family(
+                "seabird_db_session_seconds", "histogram", "Time database sessions were open"
+            ).add_histogram(metrics.db_sessions, network)
+
+    @staticmethod
+    def collect_inboxes(bot, family, network):
+        inboxes = [plugin.inbox for plugin in bot.plugins if plugin.inbox is not None]
+        if inboxes:
+            depth = family(
+                "seabird_plugin_queue_depth", "gauge", "Messages waiting in a plugin's queue"
+            )
+            size = family(
+                "seabird_plugin_queue_size", "gauge", "Messages a plugin's queue can hold"
+            )
+            dropped = family(
+                "seabird_plugin_queue_dropped_total",
+                "counter",
+                "Messages dropped because a plugin's queue was full",
+            )
+            blocked = family(
+                "seabird_plugin_queue_blocked",
+                "gauge",
+                "Whether a full plugin queue has stopped reading from the server",
+            )
+            for inbox in inboxes:
+                labels = dict(network, plugin=inbox.name)
+                depth.add(labels, len(inbox.queue))
+                size.add(labels, inbox.size)
+                dropped.add(labels, inbox.dropped)
+                blocked.add(labels, int(inbox.blocked))
+
+    def collect_caches(self, family):
+        # Caches are usually shared between networks, so each one is only
+        # reported once.
+        caches = {}
+        for bot in self.bots:
+            for plugin in bot.plugins:
+                for name, stats in plugin.cache_stats().items():
+                    caches.setdefault(name, stats)
+
+        if not caches:
+            return
+
+        hits = family("seabird_cache_hits_total", "counter", "Cache hits")
+        misses = family("seabird_cache_misses_total", "counter", "Cache misses")
+        for name, (hit_count, miss_count) in sorted(caches.items()):
+            hits.add({"cache": name}, hit_count)
+            misses.add({"cache": name}, miss_count)
+
+    def collect_shared(self, bot, family):
+        upstreams = bot.shared.resources.get("upstreams")
+        if not upstreams:
+            return
+
+        requests = family("seabird_upstream_requests_total", "counter", "Upstream requests")
+        failures = family(
+            "seabird_upstream_failures_total", "counter", "Failed upstream requests"
+        )
+        breaker = family(
+            "seabird_upstream_breaker_open", "gauge", "Whether the circuit breaker is open"
+        )
+        latency = family(
+            "seabird_upstream_latency_seconds", "summary", "Recent upstream request latency"
+        )
+        for name, upstream in sorted(upstreams.items()):
+            labels = {"upstream": name}
+            stats = upstream.stats()
+
+            requests.add(labels, stats["requests"])
+            failures.add(labels, stats["failures"])
+            breaker.add(labels, int(stats["state"] != "closed"))
+
+            for pct in (50, 90, 99):
+                value = stats["p{}".format(pct)]
+                if value is not None:
+                    latency.add(dict(labels, quantile=str(pct / 100)), value)
+            latency.add(labels, upstream.latency_sum, "seabird_upstream_latency_seconds_sum")
+            latency.add(labels, stats["requests"], "seabird_upstream_latency_seconds_count")
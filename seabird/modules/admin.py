@@ -0,0 +1,265 @@
+from fnmatch import fnmatchcase
+import logging
+import math
+import os
+import time
+
+from seabird.plugin import Plugin, CommandMixin
+from seabird.profiling import PROFILERS, MemoryTracker, plugin_sizes
+
+LOG = logging.getLogger(__name__)
+
+
+class AdminPlugin(Plugin, CommandMixin):
+    """Commands for managing plugins without restarting the bot
+
+    Only users matching one of the nick!user@host masks in the ADMINS setting
+    can use these. This also has commands for profiling the bot while it's
+    running; see seabird.profiling.
+    """
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.admins = self.bot.config.get("ADMINS", [])
+        self.profile_dir = self.bot.config.get("PROFILE_DIR", ".")
+
+        # The running profiler and the handle for stopping it, if any
+        self.profiler = None
+        self.profile_handle = None
+
+        self.memory = MemoryTracker()
+
+        # Set while a memory snapshot is being taken or compared in a thread
+        self.memory_busy = False
+
+    def unload(self):
+        if self.profile_handle is not None:
+            self.profile_handle.cancel()
+            self.profile_handle = None
+            self.profiler.stop()
+            self.profiler = None
+
+        self.memory.stop()
+
+    def is_admin(self, msg):
+        fold = self.bot.casemap.fold
+        identity = fold(msg.identity.raw)
+        return any(fnmatchcase(identity, fold(mask)) for mask in self.admins)
+
+    def dispatch_command(self, cmd):
+        # Only check permissions for our own commands so we don't complain
+        # about every command handled by other plugins.
+        if not hasattr(self, "cmd_{}".format(cmd.event.lower())):
+            return None
+
+        if not self.is_admin(cmd):
+            self.bot.mention_reply(cmd, "Permission denied.")
+            return None
+
+        return super().dispatch_command(cmd)
+
+    def cmd_plugins(self, msg):
+        """List all loaded plugins"""
+        self.bot.mention_reply(
+            msg, ", ".join(type(plugin).__name__ for plugin in self.bot.plugins)
+        )
+
+    def cmd_load(self, msg):
+        """[module.Class]
+
+        Load a plugin.
+        """
+        try:
+            plugin = self.bot.load_plugin(msg.trailing.strip())
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.exception("Failed to load plugin %s", msg.trailing)
+            self.bot.mention_reply(msg, "Failed to load: {}".format(exc))
+            return
+
+        self.bot.mention_reply(msg, "Loaded {}.".format(type(plugin).__name__))
+
+    def cmd_unload(self, msg):
+        """[plugin]
+
+        Unload a plugin, cancelling anything it was doing.
+        """
+        plugin = self.bot.find_plugin(msg.trailing.strip())
+        if plugin is None:
+            self.bot.mention_reply(msg, "No plugin named {}.".format(msg.trailing))
+            return
+
+        self.bot.unload_plugin(plugin)
+        self.bot.mention_reply(msg, "Unloaded {}.".format(type(plugin).__name__))
+
+    def cmd_reload(self, msg):
+        """[plugin]
+
+        Reload a plugin (and any others from the same module) from disk
+        without reconnecting.
+        """
+        plugin = self.bot.find_plugin(msg.trailing.strip())
+        if plugin is None:
+            self.bot.mention_reply(msg, "No plugin named {}.".format(msg.trailing))
+            return
+
+        try:
+            plugins = self.bot.reload_plugin(plugin)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.exception("Failed to reload plugin %s", type(plugin))
+            self.bot.mention_reply(msg, "Failed to reload: {}".format(exc))
+            return
+
+        self.bot.mention_reply(
+            msg,
+            "Reloaded {}.".format(", ".join(type(p).__name__ for p in plugins)),
+        )
+
+    def cmd_profile(self, msg):
+        """[seconds] [collapsed|pstats]
+
+        Profile the bot for a while (30 seconds by default) and write the
+        results to PROFILE_DIR. collapsed samples the stack and can be turned
+        into a flame graph. pstats records every call but slows the bot down.
+        """
+        args = msg.trailing.split()
+        try:
+            seconds = float(args[0]) if args else 30
+        except ValueError:
+            seconds = None
+
+        if seconds is None or not math.isfinite(seconds) or seconds <= 0:
+            self.bot.mention_reply(msg, "Invalid number of seconds.")
+            return
+
+        kind = args[1] if len(args) > 1 else "collapsed"
+        if kind not in PROFILERS:
+            self.bot.mention_reply(
+                msg, "Unknown profile type. Options are: {}".format(", ".join(PROFILERS))
+            )
+            return
+
+        if self.profiler is not None:
+            self.bot.mention_reply(msg, "A profile is already running.")
+            return
+
+        path = os.path.join(
+            self.profile_dir,
+            "seabird-{}.{}".format(time.strftime("%Y%m%d-%H%M%S"), kind),
+        )
+
+        self.profiler = PROFILERS[kind]()
+        self.profiler.start()
+        self.profile_handle = self.bot.loop.call_later(
+            seconds, self.finish_profile, msg, path
+        )
+        self.bot.mention_reply(msg, "Profiling for {:g}s.".format(seconds))
+
+    def finish_profile(self, msg, path):
+        profiler, self.profiler = self.profiler, None
+        self.profile_handle = None
+        profiler.stop()
+
+        def written(future):
+            exc = future.exception()
+            if exc is not None:
+                LOG.error("Failed to write profile to %s: %s", path, exc)
+                self.bot.mention_reply(msg, "Failed to write profile: {}".format(exc))
+            else:
+                self.bot.mention_reply(msg, "Wrote profile to {}.".format(path))
+
+        # Writing a big profile can take a moment, so it's done off the loop.
+        self.bot.run_in_executor(profiler.write, path).add_done_callback(written)
+
+    async def cmd_memory(self, msg):
+        """baseline|diff [count]|stop
+
+        baseline starts tracking allocations and remembers what everything is
+        using. diff shows what grew the most since then, both by line and by
+        plugin attribute. stop turns tracking off again.
+        """
+        args = msg.trailing.split()
+        action = args[0] if args else "diff"
+
+        if action in ("baseline", "stop", "diff") and self.memory_busy:
+            self.bot.mention_reply(msg, "Still working on the last memory command.")
+            return
+
+        if action == "baseline":
+            await self.memory_baseline(msg)
+        elif action == "stop":
+            self.memory.stop()
+            self.bot.mention_reply(msg, "Memory tracking stopped.")
+        elif action == "diff":
+            await self.memory_diff(msg, args[1:])
+        else:
+            self.bot.mention_reply(msg, "Unknown action {}.".format(action))
+
+    async def memory_baseline(self, msg):
+        # Snapshots are taken in a thread because they can take a while with a
+        # lot of allocations traced. Plugins can only be measured from the
+        # loop, but that walk is bounded.
+        self.memory.start()
+        sizes = plugin_sizes(self.bot.plugins)
+        self.memory_busy = True
+        try:
+            snapshot = await self.bot.run_in_executor(self.memory.take_snapshot)
+        finally:
+            self.memory_busy = False
+
+        self.memory.set_baseline(snapshot, sizes)
+        self.bot.mention_reply(msg, "Memory baseline taken.")
+
+    async def memory_diff(self, msg, args):
+        if not self.memory.active:
+            self.bot.mention_reply(msg, "No baseline. Use memory baseline first.")
+            return
+
+        try:
+            limit = int(args[0]) if args else 5
+        except ValueError:
+            self.bot.mention_reply(msg, "Invalid count.")
+            return
+
+        truncated = set()
+        sizes = plugin_sizes(self.bot.plugins, truncated)
+        baseline = (self.memory.snapshot, self.memory.sizes)
+
+        def compare():
+            return self.memory.compare(baseline, self.memory.take_snapshot(), sizes, limit)
+
+        self.memory_busy = True
+        try:
+            stats, structures = await self.bot.run_in_executor(compare)
+        finally:
+            self.memory_busy = False
+
+        for stat in stats:
+            frame = stat.traceback[0]
+            self.bot.mention_reply(
+                msg,
+                "{}:{}: {:+.1f} KiB ({:+d} blocks)".format(
+                    frame.filename,
+                    frame.lineno,
+                    stat.size_diff / 1024,
+                    stat.count_diff,
+                ),
+            )
+        self.report_structures(msg, structures, truncated)
+
+    def report_structures(self, msg, structures, truncated):
+        for name, before, after, before_length, length in structures:
+            if after == before and before_length == length:
+                continue
+
+            items = ""
+            if length is not None:
+                items = ", {} -> {} items".format(before_length, length)
+            if name in truncated:
+                items += " (too big to measure fully)"
+            self.bot.mention_reply(
+                msg,
+                "{}: {:.1f} -> {:.1f} KiB{}".format(
+                    name, before / 1024, after / 1024, items
+                ),
+            )
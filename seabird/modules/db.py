@@ -1,6 +1,8 @@
 from contextlib import contextmanager
+import time
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -8,6 +10,7 @@ from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session as AlembicSession
 
 from seabird.plugin import Plugin
+from seabird.tracing import current_trace
 
 
 # This is the base all models should inherit from
@@ -34,13 +37,23 @@ class DatabasePlugin(Plugin):
     def __init__(self, bot):
         super().__init__(bot)
 
-        self.engine = create_engine(self.bot.config.get("DB_URI", "sqlite:///bot.db"))
-        self.engine.connect()
+        # Bots on other networks using the same database share the engine
+        # (and its connection pool).
+        uri = self.bot.config.get("DB_URI", "sqlite:///bot.db")
+        self.engine = self.bot.shared.get(
+            ("db.engine", uri), lambda: self.create_engine(uri), close=Engine.dispose
+        )
 
         # We need to use our own session class so we can add methods onto
         # it. In particular, get_or_create is very useful.
         self.sessionmaker = sessionmaker(bind=self.engine, class_=Session)
 
+    @staticmethod
+    def create_engine(uri):
+        engine = create_engine(uri)
+        engine.connect()
+        return engine
+
     @contextmanager
     def session(self):
         """Provide a transactional scope around a series of operations.
@@ -50,6 +63,7 @@ class DatabasePlugin(Plugin):
 
         It will be available on the bot object as db_session.
         """
+        start = time.perf_counter()
         session = self.sessionmaker()
         try:
             yield session
@@ -60,6 +74,14 @@ class DatabasePlugin(Plugin):
         finally:
             session.close()
 
+            end = time.perf_counter()
+            if self.bot.metrics is not None:
+                self.bot.metrics.db_sessions.observe(end - start)
+
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add_span("db", start, end)
+
 
 class DatabaseMixin:
     def __init__(self):
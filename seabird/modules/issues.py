@@ -1,14 +1,12 @@
-import asyncio
-
-import aiohttp
-
 from seabird.plugin import Plugin, CommandMixin
 
+from .upstream import UpstreamError, UpstreamMixin
+
 
 ISSUES_URL = "https://api.github.com/repos/{}/{}/issues"
 
 
-class IssuesPlugin(Plugin, CommandMixin):
+class IssuesPlugin(Plugin, CommandMixin, UpstreamMixin):
     def __init__(self, bot):
         super().__init__(bot)
 
@@ -17,8 +15,7 @@ class IssuesPlugin(Plugin, CommandMixin):
         self.target = bot.config.get("GITHUB_TARGET", ("belak", "python-seabird"))
 
     def cmd_issue(self, msg):
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.issue_callback(msg))
+        self.create_task(self.issue_callback(msg))
 
     async def issue_callback(self, msg):
         assignee = None
@@ -48,17 +45,23 @@ class IssuesPlugin(Plugin, CommandMixin):
             "user-agent": "seabird/0.1",
         }
 
-        auth = aiohttp.BasicAuth(self.username, self.token)
+        # Only imported here to keep it out of startup time.
+        from aiohttp import BasicAuth  # pylint: disable=import-outside-toplevel
+
+        auth = BasicAuth(self.username, self.token)
 
         url = ISSUES_URL.format(self.target[0], self.target[1])
-        async with aiohttp.ClientSession() as session, session.post(
-            url, json=data, headers=headers, auth=auth
-        ) as resp:
-            if resp.status != 201:
-                self.bot.mention_reply(msg, "Failed to file issue")
-                return
+        try:
+            async with self.upstreams["github"].request(
+                "POST", url, json=data, headers=headers, auth=auth
+            ) as resp:
+                if resp.status != 201:
+                    self.bot.mention_reply(msg, "Failed to file issue")
+                    return
+
+                issue_data = await resp.json()
+        except UpstreamError as exc:
+            self.bot.mention_reply(msg, "Failed to file issue: {}".format(exc))
+            return
 
-            issue_data = await resp.json()
-            self.bot.mention_reply(
-                msg, "Issue created. {}".format(issue_data["html_url"])
-            )
+        self.bot.mention_reply(msg, "Issue created. {}".format(issue_data["html_url"]))
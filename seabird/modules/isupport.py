@@ -10,6 +10,7 @@ from collections import namedtuple
 import logging
 import re
 from string import ascii_letters
+from types import MappingProxyType
 
 from seabird.plugin import Plugin
 
@@ -36,48 +37,106 @@ def prefix_parse(prefix):
     return ret
 
 
-def status_prefix_parse(prefix, string):
-    prefix = prefix.prefix_to_mode
-
-    modes = set()
-    while string[0] in prefix:
-        prefix_char, string = string[0], string[1:]
-        modes.add(prefix[prefix_char])
-
-    return (modes, string)
-
-
-def mode_parse(modes, params, modegroups, prefix):
-    prefix = prefix.mode_to_prefix
-    params = list(params)
-    status = "".join(mode for mode in prefix if mode in ascii_letters)
-
-    # Groups of modes
-    group_pop_add = modegroups[0] + modegroups[1] + modegroups[2] + status
-    group_pop_remove = modegroups[0] + modegroups[2] + status
-
+# All the ISUPPORT derived tables needed to handle modes and names. These are
+# built once each time ISUPPORT changes and are read-only afterwards.
+ModeTables = namedtuple(
+    "ModeTables",
+    [
+        "mode_to_prefix",
+        "prefix_to_mode",
+        # Bit used to store each prefix mode (and prefix char) in a bitmask
+        "mode_bits",
+        "prefix_bits",
+        # Modes which take a param when being set and when being unset
+        "param_on_add",
+        "param_on_remove",
+        "chantypes",
+    ],
+)
+
+
+def _value(supported, key):
+    # A token with an empty value (like "CHANTYPES=") is stored as True, but
+    # it means there aren't any.
+    value = supported[key]
+    return "" if value is True else value
+
+
+def build_tables(supported):
+    prefix = _value(supported, "PREFIX")
+    prefix = prefix_parse(prefix) if prefix else ParsedPrefix({}, {})
+
+    # CHANMODES is made of 4 groups: A (lists) and B (always take a param), C
+    # (only takes a param when set) and D (never takes a param). A single
+    # group comes through as a string rather than a list.
+    chanmodes = _value(supported, "CHANMODES")
+    if isinstance(chanmodes, str):
+        chanmodes = [chanmodes]
+    modegroups = list(chanmodes) + ["", "", "", ""]
+    status = "".join(mode for mode in prefix.mode_to_prefix if mode in ascii_letters)
+
+    mode_bits = {}
+    prefix_bits = {}
+    for i, (mode, prefix_char) in enumerate(prefix.mode_to_prefix.items()):
+        mode_bits[mode] = 1 << i
+        prefix_bits[prefix_char] = 1 << i
+
+    return ModeTables(
+        MappingProxyType(prefix.mode_to_prefix),
+        MappingProxyType(prefix.prefix_to_mode),
+        MappingProxyType(mode_bits),
+        MappingProxyType(prefix_bits),
+        frozenset(modegroups[0] + modegroups[1] + modegroups[2] + status),
+        frozenset(modegroups[0] + modegroups[1] + status),
+        tuple(_value(supported, "CHANTYPES")),
+    )
+
+
+def status_prefix_parse(tables, string):
+    """Split the status prefixes off a nick
+
+    This returns a tuple of the prefix mode bitmask and the nick.
+    """
+    prefix_bits = tables.prefix_bits
+
+    mask = 0
+    i = 0
+    while i < len(string) and string[i] in prefix_bits:
+        mask |= prefix_bits[string[i]]
+        i += 1
+
+    return (mask, string[i:])
+
+
+def mode_parse(modes, params, tables):
     adding = True
-    group = group_pop_add
+    group = tables.param_on_add
+    i = 0
     for char in modes:
         if char == "+":
             adding = True
-            group = group_pop_add
+            group = tables.param_on_add
             continue
         elif char == "-":
             adding = False
-            group = group_pop_remove
+            group = tables.param_on_remove
             continue
 
         param = None
-        if char in group:
-            param = params.pop(0)
+        if char in group and i < len(params):
+            param = params[i]
+            i += 1
 
         yield (char, param, adding)
 
 
 class ISupportPlugin(Plugin):
+    # Everything else needs to see what the server supports before it handles
+    # the next message.
+    synchronous = True
+
     defaults = {
-        "PREFIX": ["o", "v", "@", "+"],
+        "PREFIX": "(ov)@+",
         "CHANTYPES": "#&!+",
         "NICKLEN": "8",
         "CASEMAPPING": "RFC1459",
@@ -89,6 +148,21 @@ class ISupportPlugin(Plugin):
 
         # Copy over the initial defaults
         self.supported = deepcopy(self.defaults)
+        self.tables = build_tables(self.supported)
+
+    def reconnected(self):
+        # We may have ended up on a different server, so we start over and
+        # wait for its ISUPPORT.
+        self.supported = deepcopy(self.defaults)
+        self.tables = build_tables(self.supported)
+        self.bot.casemap.set_mapping(self.supported["CASEMAPPING"])
+
+    def export_state(self):
+        return self.supported
+
+    def import_state(self, state):
+        self.supported = state
+        self.tables = build_tables(self.supported)
 
     def irc_005(self, msg):
         # This is based off of PyIRC.extensions.isupport.ISupport.isupport and
@@ -146,3 +220,14 @@ class ISupportPlugin(Plugin):
             LOG.info("ISUPPORT [k:v] %s:%s", key, supported[key])
 
         self.supported.update(supported)
+        self._apply(supported)
+
+    def _apply(self, supported):
+        """Update anything which depends on the newly supported tokens"""
+        # Anything which could affect the mode tables means we need to rebuild
+        # them.
+        if {"PREFIX", "CHANMODES", "CHANTYPES"} & supported.keys():
+            self.tables = build_tables(self.supported)
+
+        if isinstance(supported.get("CASEMAPPING"), str):
+            self.bot.casemap.set_mapping(supported["CASEMAPPING"])
@@ -17,10 +17,15 @@ class Karma(Base):
 class KarmaPlugin(Plugin, CommandMixin, DatabaseMixin):
     regex = re.compile(r"([^\s]+)(\+\+|--)(?:\s|$)")
 
+    def normalize(self, item):
+        # Items are usually nicks, so they're folded using the server's
+        # casemapping on top of being lowercased.
+        return self.bot.casemap.fold(item.lower())
+
     def cmd_karma(self, msg):
-        normalized_item = msg.trailing.lower().strip()
+        normalized_item = self.normalize(msg.trailing.strip())
         if normalized_item == "":
-            normalized_item = msg.identity.name
+            normalized_item = self.normalize(msg.identity.name)
 
         with self.db.session() as session:
             score = Karma.score.default.arg
@@ -41,7 +46,7 @@ class KarmaPlugin(Plugin, CommandMixin, DatabaseMixin):
         if self.regex.search(msg.trailing):
             with self.db.session() as session:
                 for (item, operation) in self.regex.findall(msg.trailing):
-                    normalized_item = item.lower()
+                    normalized_item = self.normalize(item)
 
                     k, _ = session.get_or_create(Karma, name=normalized_item)
 
@@ -23,6 +23,11 @@ class MultiMention(Base):
 class MultiMentionPlugin(Plugin, CommandMixin, DatabaseMixin):
     regex = re.compile(r"@(?P<group>[^\s]+)\b")
 
+    def normalize(self, name):
+        # Group names and nicks are stored folded with the server's
+        # casemapping so the same nick is never stored twice.
+        return self.bot.casemap.fold(name.lower())
+
     def _get_mention_groups(self, group_name=None):
         """
         Gets a list of mention groups and optionally filters by group
@@ -155,7 +160,7 @@ class MultiMentionPlugin(Plugin, CommandMixin, DatabaseMixin):
             )
 
     def cmd_mmention(self, msg):
-        args = msg.trailing.lower().strip().split(" ")
+        args = self.normalize(msg.trailing.strip()).split(" ")
 
         cmd = args[0]
         args.pop(0)
@@ -181,7 +186,7 @@ class MultiMentionPlugin(Plugin, CommandMixin, DatabaseMixin):
 
         match = self.regex.match(msg.trailing)
         if match is not None:
-            group_name = match.group("group")
+            group_name = self.normalize(match.group("group"))
             group = self._get_mention_groups(group_name=group_name)
             if not group:
                 return
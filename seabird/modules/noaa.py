@@ -1,30 +1,26 @@
-import asyncio
-
-import aiohttp
-
 from seabird.plugin import Plugin, CommandMixin
 
+from .upstream import UpstreamError, UpstreamMixin, UpstreamUnavailable
+
 
 METAR_URL = "http://tgftp.nws.noaa.gov/data/observations/metar/stations/{}.TXT"
 TAF_URL = "http://tgftp.nws.noaa.gov/data/forecasts/taf/stations/{}.TXT"
 
 
-class NOAAPlugin(Plugin, CommandMixin):
+class NOAAPlugin(Plugin, CommandMixin, UpstreamMixin):
     def cmd_taf(self, msg):
         """<station>
 
         Returns the TAF report given an airport code
         """
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.noaa_callback(TAF_URL, msg))
+        self.create_task(self.noaa_callback(TAF_URL, msg))
 
     def cmd_metar(self, msg):
         """<station>
 
         Returns the METAR report given an airport code
         """
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.noaa_callback(METAR_URL, msg))
+        self.create_task(self.noaa_callback(METAR_URL, msg))
 
     async def noaa_callback(self, url, msg):
         loc = msg.trailing.upper()
@@ -32,13 +28,14 @@ class NOAAPlugin(Plugin, CommandMixin):
             self.bot.mention_reply(msg, "Not a valid airport code")
             return
 
-        async with aiohttp.ClientSession() as session, session.get(
-            url.format(loc)
-        ) as resp:
-            if resp.status != 200:
-                self.bot.mention_reply(msg, "Could not find data for station")
-                return
+        try:
+            data = await self.upstreams["noaa"].fetch_text(url.format(loc))
+        except UpstreamUnavailable:
+            self.bot.mention_reply(msg, "NOAA is temporarily unavailable")
+            return
+        except UpstreamError:
+            self.bot.mention_reply(msg, "Could not find data for station")
+            return
 
-            data = await resp.text()
-            for line in data.splitlines()[1:]:
-                self.bot.mention_reply(msg, line.strip())
+        for line in data.splitlines()[1:]:
+            self.bot.mention_reply(msg, line.strip())
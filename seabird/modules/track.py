@@ -1,58 +1,378 @@
+import asyncio
+from collections import deque
 import logging
+from sys import intern
+import time
 
 from seabird.plugin import Plugin
 
-from .isupport import ISupportPlugin, prefix_parse, status_prefix_parse, mode_parse
+from .isupport import ISupportPlugin, status_prefix_parse, mode_parse
 
 LOG = logging.getLogger(__name__)
 
+# Token used to recognize replies to our own WHOX queries. It has to be at most
+# 3 digits.
+WHOX_TOKEN = "152"
+WHOX_FIELDS = "%tcuhnfar"
+
 
 class User:
+    __slots__ = ("nick", "channels", "user", "host", "account", "realname")
+
     def __init__(self, nick):
         self.nick = nick
+
+        # Mapping of channel name to a bitmask of the prefix modes this user
+        # has in that channel.
         self.channels = {}
 
+        # These are only known after a WHOX sync of a channel the user is in.
+        self.user = None
+        self.host = None
+        self.account = None
+        self.realname = None
+
+
+class Channel:
+    __slots__ = ("name", "members")
+
+    def __init__(self, name):
+        self.name = name
 
-# Mapping of users to channels and other useful information
-class UserTrack(Plugin):
-    # TODO: This is currently broken because cap req was removed.
-    __disabled__ = True
+        # Mapping of nick to User for everyone in this channel.
+        self.members = {}
 
+
+class MembershipIndex:
+    """Bidirectional index of nicks to channels and channels to members
+
+    Every operation only touches the users and channels it affects, so parts,
+    kicks and quits don't need to scan every known user. All names are
+    interned, so the same nick or channel is only stored once no matter how
+    many memberships reference it.
+
+    Nicks and channels are stored under the keys returned by fold, but the
+    User and Channel objects keep the names as they were last seen.
+    """
+
+    def __init__(self, fold=str):
+        self.fold = fold
+
+        self.users = {}
+        self.channels = {}
+
+    def get_user(self, nick):
+        return self.users.get(self.fold(nick))
+
+    def get_channel(self, name):
+        return self.channels.get(self.fold(name))
+
+    def add_user(self, nick):
+        key = self.fold(nick)
+        user = self.users.get(key)
+        if user is None:
+            user = User(intern(nick))
+            self.users[key] = user
+
+        return user
+
+    def remove_user(self, nick):
+        key = self.fold(nick)
+        user = self.users.pop(key, None)
+        if user is None:
+            return None
+
+        for name in user.channels:
+            channel = self.channels.get(name)
+            if channel is None:
+                continue
+
+            channel.members.pop(key, None)
+            if not channel.members:
+                del self.channels[name]
+
+        return user
+
+    def join(self, nick, name, modes=0):
+        key = self.fold(nick)
+        user = self.users.get(key)
+        if user is None:
+            user = User(intern(nick))
+            self.users[key] = user
+
+        name_key = self.fold(name)
+        channel = self.channels.get(name_key)
+        if channel is None:
+            channel = Channel(intern(name))
+            self.channels[name_key] = channel
+
+        channel.members[key] = user
+        user.channels[name_key] = modes
+
+        return user
+
+    def join_many(self, name, members):
+        """Add (nick, modes) pairs to a single channel"""
+        name_key = self.fold(name)
+        channel = self.channels.get(name_key)
+        if channel is None:
+            channel = Channel(intern(name))
+            self.channels[name_key] = channel
+
+        fold = self.fold
+        users = self.users
+        channel_members = channel.members
+        for nick, modes in members:
+            key = fold(nick)
+            user = users.get(key)
+            if user is None:
+                user = User(intern(nick))
+                users[key] = user
+
+            channel_members[key] = user
+            user.channels[name_key] = modes
+
+    def part(self, nick, name, keep=None):
+        """Remove a single membership
+
+        If the user isn't in any other channels, they will be forgotten unless
+        their nick is keep. Returns False if the membership didn't exist.
+        """
+        nick = self.fold(nick)
+        name = self.fold(name)
+
+        user = self.users.get(nick)
+        channel = self.channels.get(name)
+        if user is None or channel is None or name not in user.channels:
+            return False
+
+        del user.channels[name]
+        del channel.members[nick]
+
+        if not channel.members:
+            del self.channels[name]
+
+        if not user.channels and (keep is None or nick != self.fold(keep)):
+            del self.users[nick]
+
+        return True
+
+    def drop_channel(self, name, keep=None):
+        """Forget a channel and everyone who was only known through it"""
+        name = self.fold(name)
+        channel = self.channels.pop(name, None)
+        if channel is None:
+            return
+
+        keep = self.fold(keep) if keep is not None else None
+        for nick, user in channel.members.items():
+            user.channels.pop(name, None)
+            if not user.channels and nick != keep:
+                del self.users[nick]
+
+    def rename(self, oldnick, newnick):
+        oldkey = self.fold(oldnick)
+        newkey = self.fold(newnick)
+
+        user = self.users.pop(oldkey)
+        user.nick = intern(newnick)
+        self.users[newkey] = user
+
+        for name in user.channels:
+            members = self.channels[name].members
+            del members[oldkey]
+            members[newkey] = user
+
+        return user
+
+    def set_modes(self, nick, name, mask, adding):
+        user = self.users[self.fold(nick)]
+        name = self.fold(name)
+        if adding:
+            user.channels[name] |= mask
+        else:
+            user.channels[name] &= ~mask
+
+        return user.channels[name]
+
+
+# Mapping of users to channels and other useful information. Most of the
+# public methods are handlers and hooks the bot looks up by name.
+class UserTrack(Plugin):  # pylint: disable=too-many-public-methods
     # See https://gist.github.com/belak/09edcc4f5e51056bf5bc728647659d81 for
     # more info
+
+    # Other plugins look up users while handling the same message, so the
+    # index has to be up to date by then.
+    synchronous = True
+
     def __init__(self, bot):
         super().__init__(bot)
 
         # Grab the ISUPPORT plugin for PREFIX info
         self.isupport = self.bot.load_plugin(ISupportPlugin)
 
-        # This is just a simple dict which will store all users this bot knows
-        # about.
-        self.users = {}
+        # This stores all users and channels this bot knows about.
+        self.index = MembershipIndex(self.bot.casemap.fold)
+
+        # When we join a channel, we sync the full member info with a single
+        # WHOX query. These are paced so joining a large number of channels
+        # doesn't flood the server.
+        self.who_delay = self.bot.config.get("TRACK_WHO_DELAY", 0.2)
+        self.who_outstanding = self.bot.config.get("TRACK_WHO_OUTSTANDING", 3)
+        self.who_timeout = self.bot.config.get("TRACK_WHO_TIMEOUT", 30)
+
+        self.sync_queue = deque()
+        self.sync_task = None
+        self.syncing = {}
+
+        # Mapping of channel to how long the last sync took in seconds
+        self.sync_times = {}
+
+    @property
+    def users(self):
+        return self.index.users
+
+    @property
+    def channels(self):
+        return self.index.channels
 
     def connection_made(self, _):
         # We use multi-prefix to simplify a few operations. Because it's part
         # of the core IRCv3.1 spec, it should be supported almost everywhere.
         self.bot.cap_req("multi-prefix")
 
+    def connection_lost(self, exc):
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+            self.sync_task = None
+
+        self.sync_queue.clear()
+        self.syncing.clear()
+
+    def reconnected(self):
+        # Nothing we knew about is valid any more. Channels will be synced
+        # again as they're re-joined.
+        self.index = MembershipIndex(self.bot.casemap.fold)
+        self.sync_times.clear()
+
+    def export_state(self):
+        # Any channels which haven't finished syncing are synced again by the
+        # new instance.
+        pending = [channel for channel, _, _ in self.syncing.values()]
+        pending.extend(self.sync_queue)
+
+        return {
+            "users": self.index.users,
+            "channels": self.index.channels,
+            "sync_times": self.sync_times,
+            "pending": pending,
+        }
+
+    def import_state(self, state):
+        self.index.users = state["users"]
+        self.index.channels = state["channels"]
+        self.sync_times = state["sync_times"]
+
+        for channel in state["pending"]:
+            self.queue_sync(channel)
+
+    def queue_sync(self, channel):
+        self.sync_queue.append(channel)
+
+        if self.sync_task is None:
+            self.sync_task = self.create_task(self.sync_channels())
+
+    async def sync_channels(self):
+        loop = asyncio.get_event_loop()
+        pending = set()
+
+        try:
+            while True:
+                while self.sync_queue:
+                    channel = self.sync_queue.popleft()
+
+                    # Without WHOX, NAMES is all we get.
+                    if not self.isupport.supported.get("WHOX"):
+                        continue
+
+                    future = loop.create_future()
+                    self.syncing[self.bot.casemap.fold(channel)] = (
+                        channel,
+                        time.monotonic(),
+                        future,
+                    )
+                    pending.add(future)
+
+                    self.bot.write("WHO", channel, "{},{}".format(WHOX_FIELDS, WHOX_TOKEN))
+
+                    if len(pending) >= self.who_outstanding:
+                        pending = await self._wait_for_syncs(pending)
+
+                    await asyncio.sleep(self.who_delay)
+
+                # Everything has been sent, but the last few WHOs still need
+                # to finish (or time out). More channels may be queued while
+                # we wait.
+                pending = {future for future in pending if not future.done()}
+                if not pending:
+                    break
+
+                pending = await self._wait_for_syncs(pending)
+        finally:
+            self.sync_task = None
+
+    async def _wait_for_syncs(self, pending):
+        """Wait for one of the pending WHOs, returning the rest
+
+        If none of them finish within who_timeout, they're all given up on.
+        """
+        done, pending = await asyncio.wait(
+            pending, timeout=self.who_timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            self.sync_timed_out(pending)
+            return set()
+
+        return pending
+
+    def sync_timed_out(self, futures):
+        # Stop waiting for these, so a late RPL_ENDOFWHO is ignored and a
+        # reload doesn't sync them again.
+        for key, (channel, _, future) in list(self.syncing.items()):
+            if future in futures:
+                LOG.warning("Timed out waiting for WHO replies for %s", channel)
+                del self.syncing[key]
+
     def get_user(self, nick):
-        return self.users.get(nick)
+        return self.index.get_user(nick)
 
     def add_user(self, nick):
-        user = self.get_user(nick)
-        if user:
-            return user
+        return self.index.add_user(nick)
 
-        LOG.info("Adding user %s", nick)
+    def remove_user(self, nick):
+        LOG.debug("Deleting user %s", nick)
 
-        user = User(nick)
-        self.users[nick] = user
-        return user
+        self.index.remove_user(nick)
 
-    def remove_user(self, nick):
-        LOG.info("Deleting user %s", nick)
+    def members(self, channel):
+        """Return the nicks of everyone in the given channel"""
+        channel = self.index.get_channel(channel)
+        if channel is None:
+            return []
+
+        return [user.nick for user in channel.members.values()]
 
-        del self.users[nick]
+    def modes(self, nick, channel):
+        """Return the set of prefix modes a user has in a channel"""
+        user = self.index.get_user(nick)
+        channel = self.bot.casemap.fold(channel)
+        if user is None or channel not in user.channels:
+            return set()
+
+        mask = user.channels[channel]
+        mode_bits = self.isupport.tables.mode_bits
+        return {mode for mode, bit in mode_bits.items() if mask & bit}
 
     # Now that the public interface is out of the way, we need to actually get
     # the tracking done.
@@ -61,25 +381,61 @@ class UserTrack(Plugin):
 
     def irc_353(self, msg):
         # RPL_NAMREPLY
-        channel = msg.args[2]
-        prefix = prefix_parse(self.isupport.supported.get("PREFIX"))
+        tables = self.isupport.tables
+        self.index.join_many(
+            msg.args[2],
+            (
+                status_prefix_parse(tables, nick)[::-1]
+                for nick in msg.args[3].split(" ")
+                if nick
+            ),
+        )
 
-        for nick in msg.args[3].split(" "):
-            if not nick:
-                continue
+    def irc_join(self, msg):
+        self.index.join(msg.identity.name, msg.args[0])
 
-            modes, nick = status_prefix_parse(prefix, nick)
+        if self.bot.casemap.equal(msg.identity.name, self.bot.current_nick):
+            self.queue_sync(msg.args[0])
 
-            user = self.get_user(nick)
-            if not user:
-                user = self.add_user(nick)
+    def irc_354(self, msg):
+        # RPL_WHOSPCRPL for %tcuhnfar: token, channel, user, host, nick, flags,
+        # account, realname
+        if len(msg.args) < 9 or msg.args[1] != WHOX_TOKEN:
+            return
 
-            user.channels[channel] = modes
-            LOG.info("Modes for %s in %s are %s", nick, channel, modes)
+        _, _, channel, username, host, nick, flags, account, realname = msg.args[:9]
+
+        # Flags start with H or G, optionally followed by * for opers and then
+        # all the user's status prefixes.
+        prefix_bits = self.isupport.tables.prefix_bits
+        mask = 0
+        for char in flags:
+            mask |= prefix_bits.get(char, 0)
+
+        user = self.index.join(nick, channel, mask)
+        user.user = username
+        user.host = host
+        user.account = account if account != "0" else None
+        user.realname = realname
+
+    def irc_315(self, msg):
+        # RPL_ENDOFWHO
+        sync = self.syncing.pop(self.bot.casemap.fold(msg.args[1]), None)
+        if sync is None:
+            return
 
-    def irc_join(self, msg):
-        user = self.add_user(msg.identity.name)
-        user.channels[msg.args[0]] = set()
+        channel, start, future = sync
+        elapsed = time.monotonic() - start
+        self.sync_times[channel] = elapsed
+        if not future.done():
+            future.set_result(elapsed)
+
+        LOG.info(
+            "Synced %s (%d users) in %.3fs",
+            channel,
+            len(self.members(channel)),
+            elapsed,
+        )
 
     def irc_nick(self, msg):
         oldnick = msg.identity.name
@@ -88,60 +444,31 @@ class UserTrack(Plugin):
         if not self.get_user(oldnick):
             raise ValueError("Missing renamed nick {}".format(oldnick))
 
-        self.users[newnick] = self.get_user(oldnick)
-        self.users[newnick].nick = newnick
-
-        del self.users[oldnick]
+        self.index.rename(oldnick, newnick)
 
         LOG.info("Nick renamed %s --> %s", oldnick, newnick)
 
     def irc_part(self, msg):
         if msg.event == "PART":
-            user = self.get_user(msg.identity.name)
+            nick = msg.identity.name
         else:
-            user = self.get_user(msg.args[1])
+            nick = msg.args[1]
 
         channel = msg.args[0]
-        if not user:
-            LOG.warning(
-                "Got a part/kick for nonexistent user: %s in %s",
-                msg.identity.name,
-                msg.args[0],
-            )
-            return
 
-        if channel not in user.channels:
+        if self.bot.casemap.equal(nick, self.bot.current_nick):
+            # We left the channel, so remove all unneeded users
+            self.index.drop_channel(channel, keep=nick)
+        elif not self.index.part(nick, channel):
             LOG.warning(
-                "Got a part/kick for user not in a channel: %s in %s",
-                msg.identity.name,
-                msg.args[0],
+                "Got a part/kick for user not in a channel: %s in %s", nick, channel
             )
-            return
-
-        user.channels.pop(channel)
-
-        if user.nick == self.bot.current_nick:
-            # We left the channel, so remove all unneeded users
-            for u_nick, u_user in list(self.users.items()):
-                u_user.channels.pop(channel, None)
-
-                # Don't delete ourselves
-                if u_user.nick == self.bot.current_nick:
-                    continue
-
-                if not u_user.channels:
-                    self.remove_user(u_nick)
-        elif not user.channels:
-            # If they're not in any tracked channels, we need to forget about
-            # them.
-            self.remove_user(user.nick)
 
     # Dirty hack because I'm too lazy to re-implement this for kicks
     irc_kick = irc_part
 
     def irc_mode(self, msg):
-        modegroups = self.isupport.supported.get("CHANMODES")
-        prefix = prefix_parse(self.isupport.supported.get("PREFIX"))
+        tables = self.isupport.tables
 
         target = msg.args[0]
         modes = msg.args[1]
@@ -149,34 +476,48 @@ class UserTrack(Plugin):
 
         # We don't care about user modes right now, so if the target isn't a
         # channel, we discard the message.
-        channels = tuple(self.isupport.supported.get("CHANTYPES"))
-        if not target.startswith(channels):
+        if not target.startswith(tables.chantypes):
             return
 
-        gen = mode_parse(modes, params, modegroups, prefix)
-        prefix = prefix.mode_to_prefix
-        for mode, param, adding in gen:
+        mode_bits = tables.mode_bits
+        channel = self.bot.casemap.fold(target)
+        for mode, param, adding in mode_parse(modes, params, tables):
             # There are a bunch of other types of modes, but we only care about
             # prefix modes because they are the only ones which can be applied
             # to users in the way we want.
-            if mode in prefix:
-                user = self.get_user(param)
-                if not user:
-                    LOG.warning(
-                        "User %s is not known. Skipping changing of mode %s",
-                        param,
-                        mode,
-                    )
-                    continue
+            if mode not in mode_bits:
+                continue
 
-                if adding:
-                    LOG.info("Setting mode %s for %s in %s", mode, param, target)
-                    user.channels[target].add(mode)
-                else:
-                    LOG.info("Unsetting mode %s for %s in %s", mode, param, target)
-                    user.channels[target].discard(mode)
+            user = self.get_user(param) if param is not None else None
+            if not user or channel not in user.channels:
+                LOG.warning(
+                    "User %s is not known. Skipping changing of mode %s", param, mode
+                )
+                continue
 
-                LOG.info("Modes for %s in %s: %s", param, target, user.channels[target])
+            self.index.set_modes(param, target, mode_bits[mode], adding)
 
     def irc_quit(self, msg):
         self.remove_user(msg.identity.name)
+
+    # When the batch cap is enabled, netsplits and netjoins are delivered all
+    # at once, so we can skip all the per-message dispatch overhead.
+    def batch_netsplit(self, batch):
+        remove_user = self.index.remove_user
+        for msg in batch.messages:
+            if msg.event == "QUIT":
+                remove_user(msg.identity.name)
+            else:
+                self.dispatch_event(msg)
+
+        LOG.info(
+            "Netsplit %s removed %d users", " ".join(batch.params), len(batch.messages)
+        )
+
+    def batch_netjoin(self, batch):
+        join = self.index.join
+        for msg in batch.messages:
+            if msg.event == "JOIN":
+                join(msg.identity.name, msg.args[0])
+            else:
+                self.dispatch_event(msg)
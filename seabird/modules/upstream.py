@@ -0,0 +1,436 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import logging
+import random
+import time
+
+from seabird.plugin import Plugin, CommandMixin
+from seabird.tracing import current_trace
+
+LOG = logging.getLogger(__name__)
+
+
+# Every upstream starts with these settings. They can be overridden for each
+# upstream in the UPSTREAMS setting, eg. {"forecast": {"read_timeout": 5}}.
+DEFAULT_POLICY = {
+    # Timeouts (in seconds) for connecting and for each read from the socket
+    "connect_timeout": 5,
+    "read_timeout": 10,
+    # Retries for idempotent requests. Backoff is exponential with full jitter
+    # and every request adds retry_ratio tokens to a bucket of at most
+    # retry_budget, so a flaky upstream is never retried at the full rate of
+    # incoming requests.
+    "retries": 2,
+    "backoff": 0.25,
+    "max_backoff": 4,
+    "retry_ratio": 0.2,
+    "retry_budget": 10,
+    # The breaker opens once error_threshold of the last window requests
+    # failed (with at least min_requests in the window) and stays open for
+    # cooldown seconds. An error_threshold of None disables the breaker.
+    "error_threshold": 0.5,
+    "min_requests": 5,
+    "window": 20,
+    "cooldown": 30,
+    # Number of successful GET responses kept around to serve while the
+    # upstream is unavailable.
+    "stale_cache_size": 128,
+}
+
+# Some upstreams aren't really a single service, so the defaults don't make
+# sense for them.
+DEFAULT_UPSTREAMS = {
+    # Page titles are fetched from arbitrary sites, so one bad site shouldn't
+    # stop all of them from working.
+    "url": {"retries": 0, "error_threshold": None, "stale_cache_size": 0}
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamUnavailable(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, error_threshold, min_requests, window, cooldown):
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+
+        self.state = self.CLOSED
+        self.results = deque(maxlen=window)
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def error_rate(self):
+        if not self.results:
+            return 0.0
+
+        return self.results.count(False) / len(self.results)
+
+    def allow(self):
+        """Return True if a request should be attempted"""
+        if self.error_threshold is None or self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+
+            self.state = self.HALF_OPEN
+
+        # When half-open, we let a single request through to see if the
+        # upstream has recovered.
+        if self.trial_running:
+            return False
+
+        self.trial_running = True
+        return True
+
+    def record(self, success):
+        if self.error_threshold is None:
+            return
+
+        if self.state == self.HALF_OPEN:
+            self.trial_running = False
+            if success:
+                LOG.info("Circuit breaker closed")
+                self.state = self.CLOSED
+                self.results.clear()
+            else:
+                self.trip()
+            return
+
+        self.results.append(success)
+        if self.state != self.CLOSED or len(self.results) < self.min_requests:
+            return
+
+        if self.error_rate >= self.error_threshold:
+            self.trip()
+
+    def release(self):
+        """Let another trial through if the running one never finished"""
+        if self.state == self.HALF_OPEN:
+            self.trial_running = False
+
+    def trip(self):
+        LOG.warning("Circuit breaker opened")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_running = False
+
+
+class Upstream:
+    """A single upstream service with its own timeouts, retries and breaker"""
+
+    # Number of recent request latencies used for percentiles
+    latency_samples = 512
+
+    def __init__(self, name, session_factory, **policy):
+        self.name = name
+        self.session_factory = session_factory
+        self.policy = policy
+
+        # aiohttp takes a noticeable amount of time to import, so we wait
+        # until an upstream is actually used.
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=policy["connect_timeout"], sock_read=policy["read_timeout"]
+        )
+        self.breaker = CircuitBreaker(
+            policy["error_threshold"],
+            policy["min_requests"],
+            policy["window"],
+            policy["cooldown"],
+        )
+
+        self.retry_tokens = policy["retry_budget"]
+        self.latencies = deque(maxlen=self.latency_samples)
+        self.latency_sum = 0.0
+        self.requests = 0
+        self.failures = 0
+
+        self.stale = OrderedDict()
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))]
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": self.breaker.error_rate,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+    def _record_attempt(self, success, start):
+        self.requests += 1
+        if not success:
+            self.failures += 1
+
+        end = time.perf_counter()
+        elapsed = end - start
+        self.latencies.append(elapsed)
+        self.latency_sum += elapsed
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span("upstream", start, end, upstream=self.name, ok=success)
+
+    def _record(self, success, start):
+        """Record the last attempt of a request
+
+        The breaker only sees how the request as a whole went, so retries
+        don't count as extra failures.
+        """
+        self._record_attempt(success, start)
+        self.breaker.record(success)
+
+    def _can_retry(self, method, attempt):
+        if method not in IDEMPOTENT_METHODS or attempt >= self.policy["retries"]:
+            return False
+
+        # If the breaker opened in the meantime (or this request is the
+        # half-open trial), there's no point in trying again.
+        if not self.breaker.allow():
+            return False
+
+        if self.retry_tokens < 1:
+            LOG.warning("Retry budget for %s exhausted", self.name)
+            return False
+
+        self.retry_tokens -= 1
+        return True
+
+    async def _backoff(self, attempt):
+        delay = min(self.policy["max_backoff"], self.policy["backoff"] * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, delay))
+
+    async def _send(self, method, url, **kwargs):
+        """Send a request, retrying if allowed, and return the response
+
+        The start time of the attempt which got the response is returned
+        with it, so the rest of the request can be recorded.
+        """
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        session = self.session_factory()
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                resp = await session.request(
+                    method, url, timeout=self.timeout, **kwargs
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if not self._can_retry(method, attempt):
+                    self._record(False, start)
+                    raise UpstreamUnavailable(
+                        "{} is temporarily unavailable".format(self.name)
+                    ) from exc
+                self._record_attempt(False, start)
+            else:
+                if resp.status < 500:
+                    return resp, start
+
+                resp.release()
+                if not self._can_retry(method, attempt):
+                    self._record(False, start)
+                    raise UpstreamError(
+                        "{} returned status {}".format(self.name, resp.status)
+                    )
+                self._record_attempt(False, start)
+
+            LOG.info("Retrying request to %s (attempt %d)", self.name, attempt + 1)
+            await self._backoff(attempt)
+            attempt += 1
+
+    @asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        """Make a request to this upstream, yielding the response
+
+        Connection errors, timeouts and server errors are retried (for
+        idempotent methods) before the response is yielded. Errors while
+        reading the response are counted against the upstream. If the
+        upstream can't be reached, UpstreamUnavailable is raised.
+        """
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        method = method.upper()
+
+        if not self.breaker.allow():
+            raise UpstreamUnavailable("{} is temporarily unavailable".format(self.name))
+
+        try:
+            self.retry_tokens = min(
+                self.policy["retry_budget"], self.retry_tokens + self.policy["retry_ratio"]
+            )
+
+            resp, start = await self._send(method, url, **kwargs)
+
+            try:
+                yield resp
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                self._record(False, start)
+                raise UpstreamUnavailable(
+                    "{} is temporarily unavailable".format(self.name)
+                ) from exc
+            except UpstreamError:
+                # The caller didn't like the response (like a 404), but the
+                # upstream itself answered just fine.
+                self._record(True, start)
+                raise
+            except Exception:
+                # Anything else going wrong while the response is read (like a
+                # body which doesn't parse) means the request failed.
+                self._record(False, start)
+                raise
+            else:
+                self._record(True, start)
+            finally:
+                resp.release()
+        finally:
+            # If the request was cancelled (like when the plugin using it is
+            # unloaded), nothing was recorded. A half-open breaker would then
+            # wait forever for its trial, so let the next request be one.
+            self.breaker.release()
+
+    async def _fetch(self, reader, url, **kwargs):
+        """GET a url and read the body, falling back to a stale copy"""
+        key = (reader, url, repr(sorted(kwargs.get("params", {}).items())))
+
+        try:
+            async with self.request("GET", url, **kwargs) as resp:
+                if resp.status != 200:
+                    raise UpstreamError(
+                        "{} returned status {}".format(self.name, resp.status)
+                    )
+
+                data = await getattr(resp, reader)()
+        except UpstreamUnavailable:
+            if key not in self.stale:
+                raise
+
+            LOG.warning("Serving stale response from %s", self.name)
+            return self.stale[key]
+
+        if self.policy["stale_cache_size"]:
+            self.stale[key] = data
+            self.stale.move_to_end(key)
+            while len(self.stale) > self.policy["stale_cache_size"]:
+                self.stale.popitem(last=False)
+
+        return data
+
+    async def fetch_json(self, url, **kwargs):
+        return await self._fetch("json", url, **kwargs)
+
+    async def fetch_text(self, url, **kwargs):
+        return await self._fetch("text", url, **kwargs)
+
+
+class UpstreamPlugin(Plugin, CommandMixin):
+    """Shared HTTP client and per-upstream request policies
+
+    Plugins should use UpstreamMixin and look up upstreams by name with
+    self.upstreams["name"].
+    """
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        # Upstreams are shared by bots on every network so they share a
+        # connection pool and a single view of each upstream's health. The
+        # policy comes from whichever network used the upstream first.
+        self.registry = self.bot.shared.get("upstreams", dict)
+
+    @property
+    def session(self):
+        return self.bot.shared.resources.get("http.session")
+
+    def get_session(self):
+        # The session needs to be created from within a coroutine, so we can't
+        # do it in __init__.
+        session = self.session
+        if session is None:
+            session = self.bot.shared.get(
+                "http.session", self.create_session, close=self.close_session
+            )
+        elif session.closed:
+            session = self.bot.shared.replace("http.session", self.create_session())
+
+        return session
+
+    @staticmethod
+    def create_session():
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        return aiohttp.ClientSession()
+
+    @staticmethod
+    async def close_session(session):
+        if not session.closed:
+            await session.close()
+
+    def __getitem__(self, name):
+        upstream = self.registry.get(name)
+        if upstream is None:
+            policy = dict(DEFAULT_POLICY)
+            policy.update(DEFAULT_UPSTREAMS.get(name, {}))
+            policy.update(self.bot.config.get("UPSTREAMS", {}).get(name, {}))
+
+            upstream = Upstream(name, self.get_session, **policy)
+            self.registry[name] = upstream
+
+        return upstream
+
+    def cmd_upstreams(self, msg):
+        """Show the state and latency of all upstream services"""
+        if not self.registry:
+            self.bot.reply(msg, "No upstreams have been used")
+            return
+
+        for name, upstream in sorted(self.registry.items()):
+            stats = upstream.stats()
+            latency = ", ".join(
+                "{} {:.0f}ms".format(pct, stats[pct] * 1000)
+                for pct in ("p50", "p90", "p99")
+                if stats[pct] is not None
+            )
+            self.bot.reply(
+                msg,
+                "{}: {}, {} requests, {:.0%} recent errors. {}".format(
+                    name,
+                    stats["state"],
+                    stats["requests"],
+                    stats["error_rate"],
+                    latency or "No latency data",
+                ),
+            )
+
+
+class UpstreamMixin:
+    def __init__(self):
+        super().__init__()
+
+        self.upstreams = self.bot.load_plugin(UpstreamPlugin)
@@ -1,19 +1,102 @@
-import asyncio
+import codecs
+from html.parser import HTMLParser
 import re
 from urllib.parse import urlparse
 
-import aiohttp
-import lxml.html
-
 from seabird.plugin import Plugin
 
+from ..upstream import UpstreamError, UpstreamMixin
+
+
+# Only documents with these content types can contain a title we know how to
+# read. Everything else (images, video, pdfs) is skipped before reading the
+# body.
+TITLE_CONTENT_TYPES = {"text/html", "application/xhtml+xml"}
+
+# This roughly matches what browsers do when sniffing for a charset: only the
+# first 1024 bytes are checked for a meta tag.
+META_SNIFF_BYTES = 1024
+META_CHARSET_REGEX = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE
+)
+
+
+def sniff_charset(head):
+    """Return the charset declared in a meta tag or None"""
+    match = META_CHARSET_REGEX.search(head)
+    if match is None:
+        return None
+
+    return match.group(1).decode("ascii")
+
+
+def make_decoder(*charsets):
+    """Return an incremental decoder for the first valid charset
+
+    Any charsets which are None or unknown are skipped. If nothing matches, we
+    fall back to utf-8.
+    """
+    for charset in charsets:
+        if not charset:
+            continue
+
+        try:
+            return codecs.getincrementaldecoder(charset)(errors="replace")
+        except LookupError:
+            continue
+
+    return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class TitleParser(HTMLParser):
+    """Incremental parser which only looks for the page title
+
+    Data can be fed in chunks as it arrives and done will be set as soon as
+    the title has been closed (or we've made it into the body without finding
+    one), so the caller can stop reading.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+
+        self.done = False
+        self.title = None
+
+        self._in_title = False
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.done:
+            self._in_title = True
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = "".join(self._parts)
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._parts.append(data)
+
+    def error(self, message):
+        # Only needed to satisfy the abstract method on older pythons.
+        pass
+
 
 class URLMixin:
     """Simple marker class to mark a plugin as a url plugin
 
-    A URL plugin requires only one thing:
+    A URL plugin requires only two things:
+    - A url_patterns dict mapping each hostname the plugin handles to a
+      compiled regex the url path must match (or None to accept any path).
     - A method named url_match which takes a msg and url as an argument and
-      returns True if the url matches this plugin.
+      returns True if the url was handled by this plugin.
+
+    URL plugins need to register themselves with the URLPlugin when they are
+    loaded so urls can be routed to them.
 
     Note that callback functions are not required to be coroutines in case they
     need to access data from other plugins, but most should have a background
@@ -21,49 +104,141 @@ class URLMixin:
     or data transfer.
     """
 
+    url_patterns = {}
+
     def url_match(self, msg, url):
         raise NotImplementedError
 
 
-class URLPlugin(Plugin):
+def normalize_host(url):
+    """Return the lowercased hostname of a parsed url without any port"""
+    return (url.hostname or "").rstrip(".")
+
+
+class URLPlugin(Plugin, UpstreamMixin):
     url_regex = re.compile(r"https?://[^ ]+")
 
+    # The maximum amount of the body we'll read while looking for a title.
+    max_bytes = 1024 * 1024
+    chunk_size = 16 * 1024
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        # Mapping of hostname to (plugin, path regex)
+        self.handlers = {}
+
+    def register(self, plugin):
+        """Route all urls matching the plugin's url_patterns to it"""
+        for host, path_regex in plugin.url_patterns.items():
+            current = self.handlers.get(host)
+            if current is not None and current[0] is not plugin:
+                raise ValueError(
+                    "Host {} is already handled by {}".format(host, current[0])
+                )
+
+            self.handlers[host] = (plugin, path_regex)
+
+    def unregister(self, plugin):
+        """Stop routing urls to a plugin"""
+        for host, (current, _) in list(self.handlers.items()):
+            if current is plugin:
+                del self.handlers[host]
+
+    def export_state(self):
+        return self.handlers
+
+    def import_state(self, state):
+        self.handlers = state
+
     def irc_privmsg(self, msg):
+        seen = set()
         for match in URLPlugin.url_regex.finditer(msg.trailing):
             url = match.group(0)
-            parsed_url = urlparse(url)
 
-            matching_plugin = False
-            for plugin in self.bot.plugins:
-                if isinstance(plugin, URLMixin) and plugin.url_match(msg, parsed_url):
-                    matching_plugin = True
+            # Only handle each url once per message
+            if url in seen:
+                continue
+            seen.add(url)
 
             # As a fallback, use our own internal URL handler
-            if not matching_plugin:
-                loop = asyncio.get_event_loop()
-                loop.create_task(self.url_callback(msg, url))
+            if not self.route(msg, urlparse(url)):
+                self.create_task(self.url_callback(msg, url))
 
-    async def url_callback(self, msg, url):
-        async with aiohttp.ClientSession() as session, session.get(url) as resp:
-            # Read up to 1m
-            try:
-                data = await resp.content.readexactly(1024 * 1024)
-            except asyncio.IncompleteReadError as exc:
-                data = exc.partial
+    def route(self, msg, url):
+        """Send a url to the plugin registered for its host
 
-            if not data:
-                return
+        Returns True if a plugin handled the url.
+        """
+        handler = self.handlers.get(normalize_host(url))
+        if handler is None:
+            return False
 
-            # lxml has an implementation of xpath, so we use that to search for
-            # the title tag.
-            tree = lxml.html.fromstring(data)
-            title = tree.find(".//title")
-            if title is None or title.text is None:
-                return
+        plugin, path_regex = handler
+        if path_regex is not None and path_regex.match(url.path) is None:
+            return False
 
-            text = title.text.translate({"\t": None, "\n": None, "\v": None}).strip()
+        return plugin.url_match(msg, url)
 
-            if not text:
-                return
-
-            self.bot.reply(msg, "Title: {}".format(text))
+    async def url_callback(self, msg, url):
+        try:
+            async with self.upstreams["url"].request("GET", url) as resp:
+                try:
+                    title = await self.read_title(resp)
+                finally:
+                    # If we stopped early, there's still data on the wire, so
+                    # we make sure the connection is closed rather than
+                    # re-used.
+                    resp.close()
+        except UpstreamError:
+            return
+
+        if title is None:
+            return
+
+        text = title.translate({ord("\t"): None, ord("\n"): None, ord("\v"): None})
+        text = text.strip()
+        if not text:
+            return
+
+        self.bot.reply(msg, "Title: {}".format(text))
+
+    async def read_title(self, resp):
+        # Check the headers before touching the body so we don't download
+        # images or videos only to throw them away.
+        if resp.content_type not in TITLE_CONTENT_TYPES:
+            return None
+
+        if resp.content_length == 0:
+            return None
+
+        parser = TitleParser()
+        decoder = None
+        head = b""
+        read = 0
+
+        async for chunk in resp.content.iter_chunked(self.chunk_size):
+            read += len(chunk)
+
+            # We need to wait until we have enough of the document to look for
+            # a meta tag before we can pick a decoder. The charset from the
+            # headers always wins though.
+            if decoder is None:
+                head += chunk
+                if resp.charset is None and len(head) < META_SNIFF_BYTES:
+                    continue
+
+                decoder = make_decoder(resp.charset, sniff_charset(head))
+                chunk, head = head, b""
+
+            parser.feed(decoder.decode(chunk))
+            if parser.done or read >= self.max_bytes:
+                break
+        else:
+            # We hit the end of the body, so flush out anything we were
+            # holding on to.
+            if decoder is None:
+                decoder = make_decoder(resp.charset, sniff_charset(head))
+            parser.feed(decoder.decode(head, final=True))
+
+        return parser.title
@@ -1,36 +1,36 @@
-import asyncio
 import re
 
 from seabird.plugin import Plugin
 
 from . import URLPlugin, URLMixin
-from ..utils import fetch_json
+from ..upstream import UpstreamError, UpstreamMixin
 
 
-class XKCDURLPlugin(Plugin, URLMixin):
-    url_regex = re.compile(r"(/\d+)?/?$")
+XKCD_PATH_REGEX = re.compile(r"(/\d+)?/?$")
+
+
+class XKCDURLPlugin(Plugin, URLMixin, UpstreamMixin):
+    url_patterns = {"xkcd.com": XKCD_PATH_REGEX, "www.xkcd.com": XKCD_PATH_REGEX}
 
     def __init__(self, bot):
         super().__init__(bot)
 
-        self.bot.load_plugin(URLPlugin)
+        self.bot.load_plugin(URLPlugin).register(self)
 
-    def url_match(self, msg, url):
-        if url.netloc != "xkcd.com":
-            return False
+    def unload(self):
+        self.bot.load_plugin(URLPlugin).unregister(self)
 
-        match = XKCDURLPlugin.url_regex.match(url.path)
-        if match is None:
-            return False
-
-        url = url._replace(path=url.path + "/info.0.json")
+    def url_match(self, msg, url):
+        url = url._replace(path=url.path.rstrip("/") + "/info.0.json")
 
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.url_callback(msg, url.geturl()))
+        self.create_task(self.url_callback(msg, url.geturl()))
 
         return True
 
     async def url_callback(self, msg, url):
-        data = await fetch_json(url)
+        try:
+            data = await self.upstreams["xkcd"].fetch_json(url)
+        except UpstreamError:
+            return
 
         self.bot.reply(msg, "[XKCD] {}: {}".format(data["title"], data["alt"]))
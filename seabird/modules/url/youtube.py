@@ -1,49 +1,164 @@
-import asyncio
+from collections import OrderedDict
+import re
 from urllib.parse import parse_qs
 
-from isodate import parse_duration
-
 from seabird.plugin import Plugin
 
 from . import URLPlugin, URLMixin
-from ..utils import fetch_json
+from ..upstream import UpstreamError, UpstreamMixin
+
+
+YOUTUBE_URL = "https://www.googleapis.com/youtube/v3/videos"
 
+WATCH_PATH_REGEX = re.compile(r"/watch/?$")
+SHORT_PATH_REGEX = re.compile(r"/[\w-]+/?$")
 
-YOUTUBE_URL = (
-    "https://www.googleapis.com/youtube/v3/videos?"
-    "part=contentDetails%2Csnippet&id={}&"
-    "fields=items(contentDetails%2Csnippet)&key={}"
-)
 
+class YoutubeURLPlugin(Plugin, URLMixin, UpstreamMixin):
+    url_patterns = {
+        "youtube.com": WATCH_PATH_REGEX,
+        "www.youtube.com": WATCH_PATH_REGEX,
+        "m.youtube.com": WATCH_PATH_REGEX,
+        "youtu.be": SHORT_PATH_REGEX,
+    }
+
+    # The videos endpoint accepts at most 50 ids per call, so we collect
+    # lookups for a short time and send them off together.
+    batch_size = 50
+    batch_delay = 0.1
 
-class YoutubeURLPlugin(Plugin, URLMixin):
     def __init__(self, bot):
         super().__init__(bot)
 
-        self.bot.load_plugin(URLPlugin)
+        self.bot.load_plugin(URLPlugin).register(self)
+
+        # Video ids waiting to be sent and video ids which have been sent but
+        # not answered yet. Both map to the list of messages which asked for
+        # them.
+        self.pending = OrderedDict()
+        self.inflight = {}
+        self.flush_handle = None
+
+        # LRU cache of video id to (title, duration), shared with bots on
+        # other networks.
+        self.cache = self.bot.shared.get("youtube.cache", OrderedDict)
+        self.cache_size = self.bot.config.get("YOUTUBE_CACHE_SIZE", 1024)
+
+        # Hits and misses for the shared cache, for metrics
+        self.cache_counts = self.bot.shared.get("youtube.cache.counts", lambda: [0, 0])
+
+    def unload(self):
+        # Lookups which haven't been sent yet are dropped with the timer.
+        # Requests in flight are cancelled along with the plugin's tasks.
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending.clear()
+
+        self.bot.load_plugin(URLPlugin).unregister(self)
+
+    def export_state(self):
+        return self.cache
+
+    def import_state(self, state):
+        self.cache = state
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
 
     def url_match(self, msg, url):
-        video_id = None
-        if url.netloc == "youtube.com":
-            query = parse_qs(url.query)
-            video_id = query.get("v")[0]
-        elif url.netloc == "youtu.be":
-            video_id = url.path[1:]
-
-        if video_id is None:
+        if url.hostname == "youtu.be":
+            video_id = url.path.strip("/")
+        else:
+            video_id = parse_qs(url.query).get("v", [None])[0]
+
+        if not video_id:
             return False
 
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.url_callback(msg, video_id))
+        self.lookup(msg, video_id)
         return True
 
-    async def url_callback(self, msg, video_id):
-        url = YOUTUBE_URL.format(video_id, self.bot.config["YOUTUBE_KEY"])
-        data = await fetch_json(url)
+    def cache_stats(self):
+        return {"youtube": tuple(self.cache_counts)}
+
+    def lookup(self, msg, video_id):
+        info = self.cache.get(video_id)
+        if info is not None:
+            self.cache_counts[0] += 1
+            self.cache.move_to_end(video_id)
+            self.reply_video(msg, info)
+            return
+
+        self.cache_counts[1] += 1
+
+        # If someone else already asked for this video, we can piggyback on
+        # their request.
+        if video_id in self.inflight:
+            self.inflight[video_id].append(msg)
+            return
+
+        self.pending.setdefault(video_id, []).append(msg)
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.bot.loop.call_later(self.batch_delay, self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        while self.pending:
+            video_ids = []
+            while self.pending and len(video_ids) < self.batch_size:
+                video_id, msgs = self.pending.popitem(last=False)
+                self.inflight[video_id] = msgs
+                video_ids.append(video_id)
+
+            self.create_task(self.batch_callback(video_ids))
+
+    async def batch_callback(self, video_ids):
+        # Deferred so isodate is only imported once someone links a video.
+        from isodate import parse_duration  # pylint: disable=import-outside-toplevel
+
+        results = {}
+        try:
+            data = await self.upstreams["youtube"].fetch_json(
+                YOUTUBE_URL,
+                params={
+                    "part": "contentDetails,snippet",
+                    "id": ",".join(video_ids),
+                    "fields": "items(id,contentDetails(duration),snippet(title))",
+                    "key": self.bot.config["YOUTUBE_KEY"],
+                },
+            )
+
+            # Pull what we need out of the response
+            for video in (data or {}).get("items", []):
+                results[video["id"]] = (
+                    video["snippet"]["title"],
+                    parse_duration(video["contentDetails"]["duration"]),
+                )
+        except UpstreamError:
+            pass
+        finally:
+            # Even if the request failed, we need to make sure nothing is left
+            # in flight, otherwise those videos could never be looked up again.
+            for video_id in video_ids:
+                msgs = self.inflight.pop(video_id, [])
+                info = results.get(video_id)
+                if info is None:
+                    continue
+
+                self.cache_video(video_id, info)
+                for msg in msgs:
+                    self.reply_video(msg, info)
 
-        # Pull what we need out of the response
-        video = data["items"][0]
-        duration = parse_duration(video["contentDetails"]["duration"])
-        title = video["snippet"]["title"]
+    def cache_video(self, video_id, info):
+        self.cache[video_id] = info
+        self.cache.move_to_end(video_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
 
-        self.bot.reply(msg, "[YouTube] {} ~ {}".format(title, duration))
+    def reply_video(self, msg, info):
+        self.bot.reply(msg, "[YouTube] {} ~ {}".format(*info))
@@ -1,6 +1,6 @@
 from collections import namedtuple
 
-import aiohttp
+from .upstream import UpstreamError, UpstreamUnavailable
 
 
 GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
@@ -13,29 +13,22 @@ class LocationException(Exception):
     pass
 
 
-async def fetch_location(address):
-    async with aiohttp.ClientSession() as session, session.get(
-        GEOCODE_URL, params={"address": address, "sensor": False}
-    ) as resp:
-        if resp.status != 200:
-            raise LocationException("Failed to lookup address")
+async def fetch_location(upstream, address):
+    try:
+        data = await upstream.fetch_json(
+            GEOCODE_URL, params={"address": address, "sensor": "false"}
+        )
+    except UpstreamUnavailable as exc:
+        raise LocationException("Location lookup is temporarily unavailable") from exc
+    except UpstreamError as exc:
+        raise LocationException("Failed to lookup address") from exc
 
-        data = await resp.json()
-        res = data["results"]
-        if not res:
-            raise LocationException("No location results found")
+    res = data["results"]
+    if not res:
+        raise LocationException("No location results found")
 
-        if len(res) > 1:
-            raise LocationException("More than 1 location result")
+    if len(res) > 1:
+        raise LocationException("More than 1 location result")
 
-        loc = res[0]["geometry"]["location"]
-        return Location(res[0]["formatted_address"], loc["lat"], loc["lng"])
-
-
-async def fetch_json(*args, **kwargs):
-    async with aiohttp.ClientSession() as session, session.get(*args, **kwargs) as resp:
-        data = await resp.json()
-        if data:
-            return data
-
-    return None
+    loc = res[0]["geometry"]["location"]
+    return Location(res[0]["formatted_address"], loc["lat"], loc["lng"])
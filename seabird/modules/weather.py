@@ -1,12 +1,13 @@
 import asyncio
 from datetime import date
+import time
 
-import aiohttp
 from sqlalchemy import Column, Float, String
 
 from seabird.plugin import Plugin, CommandMixin
 
 from .db import Base, DatabaseMixin
+from .upstream import UpstreamError, UpstreamMixin, UpstreamUnavailable
 from .utils import fetch_location, LocationException, Location
 
 
@@ -22,110 +23,212 @@ class WeatherLocation(Base):
     lon = Column(Float)
 
 
-class WeatherPlugin(Plugin, CommandMixin, DatabaseMixin):
+class ForecastCache:
+    """Forecast data shared between all commands and users
+
+    Locations are snapped to a grid (in degrees) so nearby locations share a
+    single entry. Concurrent lookups for the same cell share one request.
+    """
+
+    # Both commands only need the current conditions and the daily forecast,
+    # so there's no use in transferring anything else.
+    params = {"exclude": "minutely,hourly,alerts,flags"}
+
+    def __init__(self, upstream, key, grid=0.05, ttl=600, max_entries=1024):
+        self.upstream = upstream
+        self.key = key
+        self.grid = grid
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # Mapping of grid cell to (expiration, data) and grid cell to the task
+        # currently fetching that cell.
+        self.entries = {}
+        self.inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def cell(self, lat, lon):
+        return (round(lat / self.grid), round(lon / self.grid))
+
+    async def get(self, lat, lon):
+        cell = self.cell(lat, lon)
+
+        entry = self.entries.get(cell)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+
+        task = self.inflight.get(cell)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch(cell))
+            task.add_done_callback(lambda _: self.inflight.pop(cell, None))
+            self.inflight[cell] = task
+
+        # Shield the shared task so one caller being cancelled doesn't cancel
+        # the request for everyone else.
+        return await asyncio.shield(task)
+
+    async def fetch(self, cell):
+        url = FORECAST_URL.format(self.key, cell[0] * self.grid, cell[1] * self.grid)
+        data = await self.upstream.fetch_json(url, params=self.params)
+
+        now = time.monotonic()
+        if len(self.entries) >= self.max_entries:
+            for key, (expires, _) in list(self.entries.items()):
+                if expires <= now:
+                    del self.entries[key]
+
+            # If everything is still fresh, drop the oldest entries.
+            while len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+
+        self.entries[cell] = (now + self.ttl, data)
+
+        return data
+
+
+class WeatherPlugin(Plugin, CommandMixin, DatabaseMixin, UpstreamMixin):
     def __init__(self, bot):
         super().__init__(bot)
 
-        self.key = bot.config["FORECAST_KEY"]
+        key = bot.config["FORECAST_KEY"]
+        grid = bot.config.get("FORECAST_GRID", 0.05)
+        ttl = bot.config.get("FORECAST_CACHE_TTL", 600)
+
+        # Forecasts don't depend on the network, so bots on other networks
+        # with the same settings share the cache.
+        self.forecasts = self.bot.shared.get(
+            ("forecast", key, grid, ttl),
+            lambda: ForecastCache(self.upstreams["forecast"], key, grid=grid, ttl=ttl),
+        )
+
+        # Stored locations by nick so we only hit the database when a location
+        # changes.
+        self.locations = {}
+
+    def export_state(self):
+        return {"forecasts": self.forecasts.entries, "locations": self.locations}
+
+    def import_state(self, state):
+        self.forecasts.entries = state["forecasts"]
+        self.locations = state["locations"]
+
+    def cache_stats(self):
+        return {"forecast": (self.forecasts.hits, self.forecasts.misses)}
+
+    def stored_location(self, nick):
+        loc = self.locations.get(nick)
+        if loc is not None:
+            return loc
+
+        with self.db.session() as session:
+            db_loc = (
+                session.query(WeatherLocation)
+                .filter(WeatherLocation.nick == nick)
+                .one_or_none()
+            )
+
+            if not db_loc:
+                raise LocationException("No stored location found.")
+
+            loc = Location(db_loc.address, db_loc.lat, db_loc.lon)
+
+        self.locations[nick] = loc
+        return loc
 
     async def fetch_location(self, msg):
+        nick = self.bot.casemap.fold(msg.identity.name)
         search_loc = msg.trailing.strip()
-        loc = None
         if not search_loc:
-            with self.db.session() as session:
-                db_loc = (
-                    session.query(WeatherLocation)
-                    .filter(WeatherLocation.nick == msg.identity.name)
-                    .one_or_none()
-                )
+            return self.stored_location(nick)
 
-                if not db_loc:
-                    raise LocationException("No stored location found.")
-
-                loc = Location(db_loc.address, db_loc.lat, db_loc.lon)
-
-        if loc is None:
-            loc = await fetch_location(search_loc)
+        loc = await fetch_location(self.upstreams["geocode"], search_loc)
+        if self.locations.get(nick) == loc:
+            return loc
 
         # Update the stored location for the given nick
         with self.db.session() as session:
-            weather_loc, _ = session.get_or_create(
-                WeatherLocation, nick=msg.identity.name
-            )
+            weather_loc, _ = session.get_or_create(WeatherLocation, nick=nick)
             weather_loc.address = loc.address
             weather_loc.lat = loc.lat
             weather_loc.lon = loc.lon
             session.add(weather_loc)
             session.flush()
 
+        self.locations[nick] = loc
         return loc
 
-    def cmd_forecast(self, msg):
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.forecast_callback(msg))
+    async def fetch_forecast(self, msg):
+        """Return the location and forecast data for a message
 
-    async def forecast_callback(self, msg):
+        Any errors will be sent as replies and None will be returned.
+        """
         try:
             loc = await self.fetch_location(msg)
         except LocationException as exc:
             self.bot.mention_reply(msg, exc)
-            return
+            return None
 
-        url = FORECAST_URL.format(self.key, loc.lat, loc.lon)
-        async with aiohttp.ClientSession() as session, session.get(url) as resp:
-            if resp.status != 200:
-                self.bot.mention_reply(msg, "Could not get weather data.")
-                return
-
-            data = await resp.json()
-
-            self.bot.mention_reply(msg, "3 day forecast for {}.".format(loc.address))
-            for day in data["daily"]["data"][:3]:
-                weekday = date.fromtimestamp(day["time"]).strftime("%A")
-                print(day)
-
-                self.bot.mention_reply(
-                    msg,
-                    "{}: High {:.2f}, Low {:.2f}, Humidity {:.0f}. {}".format(
-                        weekday,
-                        day["temperatureMax"],
-                        day["temperatureMin"],
-                        day["humidity"] * 100,
-                        day["summary"],
-                    ),
-                )
+        try:
+            return loc, await self.forecasts.get(loc.lat, loc.lon)
+        except UpstreamUnavailable:
+            self.bot.mention_reply(msg, "Weather data is temporarily unavailable.")
+        except UpstreamError:
+            self.bot.mention_reply(msg, "Could not get weather data.")
 
-    def cmd_weather(self, msg):
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.weather_callback(msg))
+        return None
 
-    async def weather_callback(self, msg):
-        try:
-            loc = await self.fetch_location(msg)
-        except LocationException as exc:
-            self.bot.mention_reply(msg, exc)
-            return
+    def cmd_forecast(self, msg):
+        self.create_task(self.forecast_callback(msg))
 
-        url = FORECAST_URL.format(self.key, loc.lat, loc.lon)
-        async with aiohttp.ClientSession() as session, session.get(url) as resp:
-            if resp.status != 200:
-                self.bot.mention_reply(msg, "Could not get weather data.")
-                return
+    async def forecast_callback(self, msg):
+        forecast = await self.fetch_forecast(msg)
+        if forecast is None:
+            return
 
-            data = await resp.json()
+        loc, data = forecast
 
-            today = data["daily"]["data"][0]
-            currently = data["currently"]
+        self.bot.mention_reply(msg, "3 day forecast for {}.".format(loc.address))
+        for day in data["daily"]["data"][:3]:
+            weekday = date.fromtimestamp(day["time"]).strftime("%A")
 
             self.bot.mention_reply(
                 msg,
-                "{}. Currently {:.1f}. High {:.2f}, Low {:.2f}, "
-                "Humidity {:.0f}. {}.".format(
-                    loc.address,
-                    currently["temperature"],
-                    today["temperatureMax"],
-                    today["temperatureMin"],
-                    currently["humidity"] * 100,
-                    currently["summary"],
+                "{}: High {:.2f}, Low {:.2f}, Humidity {:.0f}. {}".format(
+                    weekday,
+                    day["temperatureMax"],
+                    day["temperatureMin"],
+                    day["humidity"] * 100,
+                    day["summary"],
                 ),
             )
+
+    def cmd_weather(self, msg):
+        self.create_task(self.weather_callback(msg))
+
+    async def weather_callback(self, msg):
+        forecast = await self.fetch_forecast(msg)
+        if forecast is None:
+            return
+
+        loc, data = forecast
+
+        today = data["daily"]["data"][0]
+        currently = data["currently"]
+
+        self.bot.mention_reply(
+            msg,
+            "{}. Currently {:.1f}. High {:.2f}, Low {:.2f}, "
+            "Humidity {:.0f}. {}.".format(
+                loc.address,
+                currently["temperature"],
+                today["temperatureMax"],
+                today["temperatureMin"],
+                currently["humidity"] * 100,
+                currently["summary"],
+            ),
+        )
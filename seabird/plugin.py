@@ -1,16 +1,23 @@
+import inspect
+import re
+
 from .irc import Message
+from .tracing import current_trace
 
 
 class CommandMixin:
     def irc_privmsg(self, event):
         if event.event != "PRIVMSG":
-            return
+            return None
 
         if not event.trailing.startswith(self.bot.config["PREFIX"]):
-            return
+            return None
 
         # Create a new message
-        cmd = Message(event.line, current_nick=event.current_nick)
+        cmd = Message(
+            event.line, current_nick=event.current_nick, casemap=event.casemap
+        )
+        cmd.trace = event.trace
         split = cmd.trailing[len(self.bot.config["PREFIX"]) :].split(" ", 1)
         cmd.event = split[0]
 
@@ -21,18 +28,21 @@ class CommandMixin:
         else:
             cmd.args.append("")
 
+        if not self.bot.command_enabled(cmd):
+            return None
+
         # Send it off!
-        self.dispatch_command(cmd)
+        return self.dispatch_command(cmd)
 
     def dispatch_command(self, cmd):
         callback = getattr(self, "cmd_{}".format(cmd.event.lower()), None)
         if not callback:
-            return
+            return None
 
         if not callable(callback):
             raise ValueError
 
-        callback(cmd)  # pylint: disable=not-callable
+        return callback(cmd)  # pylint: disable=not-callable
 
 
 class Plugin:
@@ -47,9 +57,24 @@ class Plugin:
     before Plugin in the MRO.
     """
 
+    # Batch types which are never dispatched as individual messages.
+    bulk_only_batches = {"chathistory", "draft/chathistory"}
+
+    # Plugins which keep protocol state other plugins depend on set this so
+    # they're always dispatched inline, even if listed in PLUGIN_QUEUES.
+    synchronous = False
+
     def __init__(self, bot):
         self.bot = bot
 
+        # Background tasks started with create_task. These are cancelled when
+        # the plugin is unloaded.
+        self.tasks = set()
+
+        # The seabird.actor.Inbox this plugin is handled from, if it's in
+        # PLUGIN_QUEUES.
+        self.inbox = None
+
         super().__init__()
 
     def connection_made(self, transport):
@@ -58,6 +83,59 @@ class Plugin:
     def connection_lost(self, exc):
         """Stub method for protocol level connection_lost"""
 
+    def reconnected(self):
+        """Stub method called when we've registered after a reconnect
+
+        Plugins stay loaded across reconnects, so this is the place to throw
+        away or resync anything which was specific to the old connection.
+        """
+
+    def cache_stats(self):
+        """Return hit and miss counts for any caches this plugin keeps
+
+        This should be a dict of cache name to (hits, misses). It's only used
+        for metrics.
+        """
+        return {}
+
+    def create_task(self, coro):
+        """Start a background task which belongs to this plugin"""
+        task = self.bot.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        # The task inherits the current context, so anything it does is
+        # already part of the trace. The trace just needs to wait for it.
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_task(task)
+
+        return task
+
+    def schedule(self, result):
+        """Run a coroutine returned by a handler as a background task
+
+        Handlers (irc_*, cmd_* and batch_*) can be coroutines. Queued plugins
+        wait for each one before the next message, but inline plugins can't
+        hold up dispatch, so they're started here instead.
+        """
+        if inspect.iscoroutine(result):
+            self.create_task(result)
+
+    def unload(self):
+        """Stub method called before the plugin is removed from the bot
+
+        Anything which isn't a task started with create_task (timers,
+        registrations with other plugins) should be cleaned up here.
+        """
+
+    def export_state(self):
+        """Return state to hand off to the new instance when reloading"""
+        return None
+
+    def import_state(self, state):
+        """Restore state returned by export_state on the old instance"""
+
     def dispatch_event(self, event):
         """Attempt to dispatch an event
 
@@ -66,9 +144,32 @@ class Plugin:
         """
         callback = getattr(self, "irc_{}".format(event.event.lower()), None)
         if not callback:
-            return
+            return None
 
         if not callable(callback):
             raise ValueError
 
-        callback(event)  # pylint: disable=not-callable
+        return callback(event)  # pylint: disable=not-callable
+
+    def dispatch_batch(self, batch):
+        """Attempt to dispatch a completed IRCv3 batch
+
+        If a callback named batch_<type> exists, it gets the whole batch at
+        once. Otherwise, messages are dispatched one at a time as if they
+        weren't batched, except for batch types in bulk_only_batches (like
+        chathistory) which would otherwise look like new messages.
+        """
+        batch_type = re.sub(r"[^a-z0-9]", "_", batch.type.lower())
+        callback = getattr(self, "batch_{}".format(batch_type), None)
+        if callback:
+            return callback(batch)
+
+        if batch.type.lower() in self.bulk_only_batches:
+            return None
+
+        for event in batch.messages:
+            result = self.dispatch_event(event)
+            if result is not None:
+                self.schedule(result)
+
+        return None
@@ -0,0 +1,245 @@
+"""Profiling and memory tracking for a running bot
+
+These are driven by the admin plugin's profile and memory commands so a
+slow bot can be looked at without restarting it.
+
+SamplingProfiler looks at the loop thread's stack from a background thread
+every few milliseconds and writes the results as collapsed stacks, which
+flamegraph.pl, speedscope and most other flame graph tools read. For exact
+call counts, DeterministicProfiler wraps cProfile and writes a pstats file,
+at the cost of slowing everything down while it runs.
+
+MemoryTracker takes tracemalloc snapshots and also measures what each
+plugin is holding on to, so the difference from a baseline shows both where
+memory was allocated and which plugin structures grew.
+"""
+
+import asyncio
+from collections import Counter, deque
+import cProfile
+import os
+import sys
+import threading
+import tracemalloc
+from types import ModuleType
+
+from .irc import Protocol
+from .plugin import Plugin
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.labels = {}
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="seabird-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = "{} ({}:{})".format(
+                code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+            )
+            self.labels[code] = label
+
+        return label
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+class DeterministicProfiler:
+    """cProfile, started and stopped from the loop thread"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+PROFILERS = {
+    "collapsed": SamplingProfiler,
+    "pstats": DeterministicProfiler,
+}
+
+# Containers which are walked when measuring a plugin's structures, and
+# things which belong to the whole bot rather than a plugin.
+CONTAINERS = (list, tuple, set, frozenset, deque)
+NOT_FOLLOWED = (Plugin, Protocol, type, ModuleType, asyncio.AbstractEventLoop)
+
+
+def deep_sizeof(obj, seen, limit=100000):
+    """Return the size in bytes of obj and everything it refers to
+
+    Other plugins and the bot are never followed, and objects already in seen
+    aren't counted again. At most limit objects are visited, so this doesn't
+    hold up the loop for long. The second value returned is False if the
+    walk was cut short, in which case the size is too small.
+    """
+    size = 0
+    stack = [obj]
+    while stack and limit > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, NOT_FOLLOWED):
+            continue
+
+        seen.add(id(obj))
+        limit -= 1
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, CONTAINERS):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__") and not callable(obj):
+            stack.append(vars(obj))
+
+    return size, not stack
+
+
+def plugin_sizes(plugins, truncated=None):
+    """Return the size of every attribute of every plugin
+
+    The result maps "Plugin.attribute" to (bytes, length), where length is
+    len() of the attribute or None if it doesn't have one. Attributes too big
+    to measure completely are added to truncated, if it's given.
+
+    The plugins are walked as they are, so this has to run on the loop.
+    """
+    ret = {}
+    for plugin in plugins:
+        name = type(plugin).__name__
+        for attr, value in vars(plugin).items():
+            if attr == "bot" or callable(value):
+                continue
+
+            try:
+                length = len(value)
+            except TypeError:
+                length = None
+
+            key = "{}.{}".format(name, attr)
+            size, complete = deep_sizeof(value, set())
+            if not complete and truncated is not None:
+                truncated.add(key)
+
+            ret[key] = (size, length)
+
+    return ret
+
+
+class MemoryTracker:
+    """tracemalloc snapshots and plugin sizes to compare against
+
+    baseline and diff do everything at once. The bot instead takes the
+    snapshots and compares them in a thread with take_snapshot and compare,
+    since they can take a while with a lot of allocations traced, and only
+    measures the plugins (with plugin_sizes) on the loop.
+    """
+
+    def __init__(self, frames=10):
+        self.frames = frames
+
+        self.snapshot = None
+        self.sizes = None
+        self.started = False
+
+    @property
+    def active(self):
+        return self.snapshot is not None
+
+    def start(self):
+        """Start tracing, unless it already is"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started = True
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+
+    def set_baseline(self, snapshot, sizes):
+        self.snapshot = snapshot
+        self.sizes = sizes
+
+    def baseline(self, plugins):
+        """Start tracing if needed and remember the current state"""
+        self.start()
+        self.set_baseline(self.take_snapshot(), plugin_sizes(plugins))
+
+    def compare(self, baseline, snapshot, sizes, limit=5):
+        """Compare a snapshot and plugin sizes against a baseline
+
+        baseline is the (snapshot, sizes) pair to compare against. Returns
+        (allocation differences by line, plugin structure differences as
+        (name, bytes before, bytes after, length before, length after)), both
+        sorted by how much they grew and cut down to limit entries.
+        """
+        before_snapshot, before_sizes = baseline
+        stats = snapshot.compare_to(before_snapshot, "lineno")
+
+        structures = []
+        for name, (size, length) in sizes.items():
+            before, before_length = before_sizes.get(name, (0, None))
+            structures.append((name, before, size, before_length, length))
+        structures.sort(key=lambda item: item[2] - item[1], reverse=True)
+
+        return stats[:limit], structures[:limit]
+
+    def diff(self, plugins, limit=5):
+        """Compare the current state against the baseline"""
+        return self.compare(
+            (self.snapshot, self.sizes), self.take_snapshot(), plugin_sizes(plugins), limit
+        )
+
+    def stop(self):
+        self.snapshot = None
+        self.sizes = None
+
+        # If tracing was turned on some other way, leave it alone.
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
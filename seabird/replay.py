@@ -0,0 +1,220 @@
+"""Feed a traffic capture through a bot without a network connection
+
+Run with python -m seabird.replay capture.sbw. The bot is configured from
+the same config module as a normal run (SEABIRD_CONFIG_MODULE), with the
+full plugin set loaded, but everything it writes goes to a fake transport.
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+import logging
+import os
+import time
+
+from .bot import Bot
+from .config import Config
+from .modules.upstream import UpstreamUnavailable
+from .wire import read_file
+
+LOG = logging.getLogger(__name__)
+
+
+class ReplayTransport:
+    """Transport which records every line written along with when"""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        now = time.monotonic()
+        for line in data.decode("utf-8").splitlines():
+            self.lines.append((now, line))
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class OfflineSession:
+    """HTTP session which fails every request
+
+    Plugins see upstreams as unavailable, the same as during an outage, so a
+    replay never makes requests on behalf of recorded messages.
+    """
+
+    closed = False
+
+    async def request(self, method, url, **kwargs):
+        raise UpstreamUnavailable("No requests are made during a replay")
+
+    async def close(self):
+        pass
+
+
+class Replay:
+    """Replay messages into a bot, timing each plugin's handlers
+
+    Timings are kept per (plugin, event) as [calls, total seconds, max
+    seconds].
+    """
+
+    # When replaying as fast as possible, background tasks get a chance to
+    # run after this many messages.
+    yield_every = 100
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.transport = ReplayTransport()
+        self.timings = defaultdict(lambda: [0, 0.0, 0.0])
+
+        self.messages = 0
+        self.elapsed = 0.0
+
+        bot.shared.replace("http.session", OfflineSession())
+
+        for plugin in bot.plugins:
+            self.instrument(plugin)
+
+    def _record(self, key, elapsed):
+        timing = self.timings[key]
+        timing[0] += 1
+        timing[1] += elapsed
+        if elapsed > timing[2]:
+            timing[2] = elapsed
+
+    def instrument(self, plugin):
+        name = type(plugin).__name__
+        dispatch_event = plugin.dispatch_event
+        dispatch_batch = plugin.dispatch_batch
+
+        def timed_event(event):
+            start = time.perf_counter()
+            try:
+                return dispatch_event(event)
+            finally:
+                self._record((name, event.event), time.perf_counter() - start)
+
+        def timed_batch(batch):
+            start = time.perf_counter()
+            try:
+                return dispatch_batch(batch)
+            finally:
+                self._record(
+                    (name, "BATCH " + batch.type), time.perf_counter() - start
+                )
+
+        plugin.dispatch_event = timed_event
+        plugin.dispatch_batch = timed_batch
+
+    async def run(self, messages, realtime=False, speed=1.0, drain_timeout=5):
+        """Feed (timestamp, message) pairs into the bot
+
+        With realtime set, the gaps between messages are kept (divided by
+        speed). Otherwise messages are sent as fast as the bot can handle
+        them.
+        """
+        self.bot.connection_made(self.transport)
+
+        start = time.monotonic()
+        first = None
+        for timestamp, msg in messages:
+            if realtime:
+                if first is None:
+                    first = timestamp
+
+                delay = (timestamp - first) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif not self.messages % self.yield_every:
+                await asyncio.sleep(0)
+
+            self.bot.dispatch(msg)
+            self.messages += 1
+
+        self.elapsed = time.monotonic() - start
+
+        # Give anything started by the plugins a chance to finish.
+        tasks = set()
+        for plugin in self.bot.plugins:
+            tasks.update(plugin.tasks)
+        if tasks:
+            await asyncio.wait(tasks, timeout=drain_timeout)
+
+        self.bot.connection_lost(None)
+
+    def report(self, top=20):
+        """Return a summary of the replay as a list of lines"""
+        ret = [
+            "Replayed {} messages in {:.3f}s ({:.0f}/s), {} lines written".format(
+                self.messages,
+                self.elapsed,
+                self.messages / self.elapsed if self.elapsed else 0,
+                len(self.transport.lines),
+            )
+        ]
+
+        timings = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)
+        for (plugin, event), (calls, total, slowest) in timings[:top]:
+            ret.append(
+                "  {:<24} {:<12} {:>8} calls {:>10.3f}ms total {:>8.1f}us avg "
+                "{:>8.1f}us max".format(
+                    plugin,
+                    event,
+                    calls,
+                    total * 1000,
+                    total / calls * 1e6,
+                    slowest * 1e6,
+                )
+            )
+
+        return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="capture file to replay")
+    parser.add_argument(
+        "--realtime", action="store_true", help="keep the recorded timing"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="speed multiplier with --realtime"
+    )
+    parser.add_argument("--output", help="file to write the bot's output to")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    config = Config()
+    config.from_module(os.getenv("SEABIRD_CONFIG_MODULE", "config"))
+
+    # A replay should never touch the network, record itself or open
+    # anything other processes might be using.
+    for key in ("CAPTURE_FILE", "WORKER_PLUGINS", "METRICS_PORT", "METRICS_SOCKET", "TRACE_FILE"):
+        config.pop(key, None)
+
+    loop = asyncio.get_event_loop()
+    bot = Bot(config, loop=loop)
+    bot.load_plugins()
+
+    replay = Replay(bot)
+    try:
+        loop.run_until_complete(
+            replay.run(read_file(args.capture), args.realtime, args.speed)
+        )
+    finally:
+        bot.close()
+
+    for line in replay.report():
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for timestamp, line in replay.transport.lines:
+                f.write("{:.6f} {}\n".format(timestamp, line))
+
+
+if __name__ == "__main__":
+    main()
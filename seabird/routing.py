@@ -0,0 +1,217 @@
+"""Which plugins and commands are enabled where
+
+By default every plugin sees every message. These settings narrow that down
+for the whole network (they can go in a NETWORKS section like anything
+else) or for single channels:
+
+PLUGIN_ALLOW, PLUGIN_DENY
+    Plugins, by class name or path, to enable or disable on the network.
+    If PLUGIN_ALLOW is set, nothing else is enabled.
+COMMAND_ALLOW, COMMAND_DENY
+    The same, for command names (without the prefix).
+CHANNEL_RULES
+    A dict of channel to a dict with any of plugin_allow, plugin_deny,
+    command_allow and command_deny. These take precedence over the network
+    settings, so a plugin denied on the network can be allowed in a channel.
+
+Rather than checking the rules for every message, Router compiles them into
+a Route for each channel the bot is in, holding the list of plugins to call
+and the commands allowed there. Routes are built when the bot joins a
+channel and thrown away when it leaves, and rebuilt for every channel when
+plugins are loaded or unloaded, or Bot.update_routes is called after
+changing the config. Everything which isn't for a channel we're in, like private
+messages, uses the network's route.
+
+Plugins in worker processes (WORKER_PLUGINS) are routed by a Router in the
+worker, which the bot tells whenever it joins or leaves a channel.
+
+Channels are looked up by their casemapped name, so "#Chan" gets the
+same route as "#chan". A batch goes to each plugin with only the messages
+that plugin is enabled for.
+
+Plugins which set synchronous keep protocol state other plugins rely on, so
+they're always called.
+"""
+
+from .irc import Batch
+
+
+def _plugin_names(plugin):
+    cls = type(plugin)
+    return cls.__name__, "{}.{}".format(cls.__module__, cls.__qualname__)
+
+
+class Rules:
+    """Allow and deny lists at one level (the network or a channel)"""
+
+    def __init__(
+        self, plugin_allow=None, plugin_deny=None, command_allow=None, command_deny=None
+    ):
+        self.plugin_allow = set(plugin_allow) if plugin_allow is not None else None
+        self.plugin_deny = set(plugin_deny or ())
+        self.command_allow = (
+            {name.lower() for name in command_allow} if command_allow is not None else None
+        )
+        self.command_deny = {name.lower() for name in command_deny or ()}
+
+    def plugin_enabled(self, names):
+        """Return True or False if these rules decide, None if they don't"""
+        if self.plugin_deny.intersection(names):
+            return False
+
+        if self.plugin_allow is not None:
+            return bool(self.plugin_allow.intersection(names))
+
+        return None
+
+    def command_enabled(self, name):
+        if name in self.command_deny:
+            return False
+
+        if self.command_allow is not None:
+            return name in self.command_allow
+
+        return None
+
+
+class Route:
+    """The plugins to call and commands allowed for one target"""
+
+    __slots__ = ("plugins", "enabled", "command_rules")
+
+    def __init__(self, plugins, command_rules):
+        self.plugins = plugins
+        self.enabled = frozenset(plugins)
+        self.command_rules = command_rules
+
+    def command_enabled(self, name):
+        name = name.lower()
+        for rules in self.command_rules:
+            enabled = rules.command_enabled(name)
+            if enabled is not None:
+                return enabled
+
+        return True
+
+
+CONFIG_KEYS = ("PLUGIN_ALLOW", "PLUGIN_DENY", "COMMAND_ALLOW", "COMMAND_DENY", "CHANNEL_RULES")
+
+
+class Router:
+    def __init__(self, config, casemap):
+        self.casemap = casemap
+
+        self.network = None
+        self.channels = {}
+        self.configure(config)
+
+        self.plugins = []
+        self.default = Route([], [self.network])
+        self.routes = {}
+
+    @classmethod
+    def from_config(cls, config, casemap):
+        """Return a Router if there are any rules, None otherwise"""
+        if not any(config.get(key) for key in CONFIG_KEYS):
+            return None
+
+        return cls(config, casemap)
+
+    def configure(self, config):
+        """Read the rules from the config. They apply on the next rebuild."""
+        self.network = Rules(
+            config.get("PLUGIN_ALLOW"),
+            config.get("PLUGIN_DENY"),
+            config.get("COMMAND_ALLOW"),
+            config.get("COMMAND_DENY"),
+        )
+        self.channels = {
+            channel: Rules(**rules)
+            for channel, rules in config.get("CHANNEL_RULES", {}).items()
+        }
+
+    def channel_rules(self, channel):
+        folded = self.casemap.fold(channel)
+        for name, rules in self.channels.items():
+            if self.casemap.fold(name) == folded:
+                return rules
+
+        return None
+
+    def compile(self, rules):
+        levels = [rules, self.network] if rules is not None else [self.network]
+
+        plugins = []
+        for plugin in self.plugins:
+            if plugin.synchronous:
+                plugins.append(plugin)
+                continue
+
+            names = _plugin_names(plugin)
+            for level in levels:
+                enabled = level.plugin_enabled(names)
+                if enabled is not None:
+                    break
+            else:
+                enabled = True
+
+            if enabled:
+                plugins.append(plugin)
+
+        return Route(plugins, levels)
+
+    def rebuild(self, plugins):
+        """Recompile every route for a new list of plugins"""
+        self.plugins = list(plugins)
+        self.default = self.compile(None)
+        for channel in self.routes:
+            self.routes[channel] = self.compile(self.channel_rules(channel))
+
+    def join(self, channel):
+        self.routes[self.casemap.fold(channel)] = self.compile(self.channel_rules(channel))
+
+    def part(self, channel):
+        self.routes.pop(self.casemap.fold(channel), None)
+
+    def clear(self):
+        self.routes.clear()
+
+    def route(self, msg):
+        if not msg.args:
+            return self.default
+
+        # Most channel names are already folded, which saves folding every
+        # message.
+        target = msg.args[0]
+        route = self.routes.get(target)
+        if route is None:
+            route = self.routes.get(self.casemap.fold(target), self.default)
+
+        return route
+
+    def route_batch(self, batch):
+        """Return (plugin, batch) pairs to dispatch a batch to
+
+        If the messages don't all have the same route, each plugin gets a copy
+        of the batch with only the messages it's enabled for.
+        """
+        routes = [self.route(msg) for msg in batch.messages]
+        first = routes[0] if routes else self.default
+        if all(route is first for route in routes):
+            return [(plugin, batch) for plugin in first.plugins]
+
+        ret = []
+        for plugin in self.plugins:
+            messages = [
+                msg
+                for msg, route in zip(batch.messages, routes)
+                if plugin in route.enabled
+            ]
+            if len(messages) == len(batch.messages):
+                ret.append((plugin, batch))
+            elif messages:
+                routed = Batch(batch.ref, batch.type, batch.params, batch.parent)
+                routed.messages = messages
+                ret.append((plugin, routed))
+
+        return ret
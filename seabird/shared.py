@@ -0,0 +1,74 @@
+"""Resources shared between every connection in a process
+
+When running on multiple networks, each network gets its own Bot and its own
+plugin instances, but things which are expensive to hold more than once
+(database engines, HTTP connection pools, caches, thread pools) live here and
+are looked up by key.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class SharedResources:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+        self.resources = {}
+        self.closers = {}
+        self._executor = None
+
+    def get(self, key, factory, close=None):
+        """Return the resource stored under key, creating it if needed
+
+        close is called with the resource when the process shuts down. It can
+        be a regular function or a coroutine function.
+        """
+        if key not in self.resources:
+            LOG.debug("Creating shared resource %r", key)
+            self.resources[key] = factory()
+            if close is not None:
+                self.closers[key] = close
+
+        return self.resources[key]
+
+    def replace(self, key, value):
+        """Replace a resource which is no longer usable, like a closed session"""
+        self.resources[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.resources
+
+    @property
+    def executor(self):
+        """Thread pool for blocking work from any connection"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="seabird"
+            )
+
+        return self._executor
+
+    async def close(self):
+        for key, close in self.closers.items():
+            try:
+                ret = close(self.resources[key])
+                if inspect.isawaitable(ret):
+                    await ret
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Failed to close shared resource %r", key)
+
+        self.resources.clear()
+        self.closers.clear()
+
+        if self._executor is not None:
+            # Don't block the loop waiting for running jobs.
+            executor, self._executor = self._executor, None
+            await asyncio.get_event_loop().run_in_executor(
+                None, executor.shutdown
+            )
@@ -0,0 +1,193 @@
+"""A tiny IRC server stand-in for tests
+
+It understands just enough of the protocol to get a bot connected and into
+channels: registration (001 and 005), PING, JOIN/PART with NAMES replies and
+PRIVMSG fan-out between clients. Every line received is recorded. Tests can
+drop clients on purpose to exercise reconnects.
+
+Besides real clients, the server can have simulated users who only exist on
+the server side. They show up in NAMES and the load generator in loadtest.py
+uses them to send traffic to connected bots.
+"""
+
+import asyncio
+import time
+
+ISUPPORT = 'CHANTYPES=# PREFIX=(ov)@+ CASEMAPPING=ascii NETWORK=Example'
+
+
+class IRCServer:
+    def __init__(self, name='irc.example.com'):
+        self.name = name
+
+        self.server = None
+        self.port = None
+
+        # Open connections, registered clients mapped to their nick, and every
+        # line received from them.
+        self.writers = set()
+        self.handlers = set()
+        self.clients = {}
+        self.lines = []
+        self.record_lines = True
+        self.connections = 0
+        self.registered = asyncio.Event()
+
+        # Channel name to the nicks in it, and the other way around. Both real
+        # clients and simulated users are in here.
+        self.channels = {}
+        self.memberships = {}
+
+        # Called with (nick, line, time received) for every line from a
+        # client.
+        self.listeners = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.drop()
+        self.server.close()
+        await self.server.wait_closed()
+
+        # Let the connection handlers see their clients are gone.
+        if self.handlers:
+            await asyncio.wait(self.handlers)
+
+    def drop(self):
+        """Disconnect every client"""
+        for nick in self.clients.values():
+            self.leave_all(nick)
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+        self.clients.clear()
+        self.registered.clear()
+
+    def send(self, writer, line):
+        writer.write('{}\r\n'.format(line).encode('utf-8'))
+
+    def hostmask(self, nick):
+        return '{0}!{0}@{0}.example.com'.format(nick)
+
+    def broadcast(self, line, channel=None, exclude=None):
+        """Send a line to every client, or every client in a channel"""
+        data = '{}\r\n'.format(line).encode('utf-8')
+        members = self.channels.get(channel, ()) if channel else None
+        for writer, nick in self.clients.items():
+            if nick == exclude:
+                continue
+            if members is None or nick in members:
+                writer.write(data)
+
+    def leave_all(self, nick):
+        for channel in self.memberships.pop(nick, ()):
+            self.channels[channel].discard(nick)
+
+    def join(self, nick, channel):
+        self.channels.setdefault(channel, set()).add(nick)
+        self.memberships.setdefault(nick, set()).add(channel)
+        self.broadcast(':{} JOIN {}'.format(self.hostmask(nick), channel), channel)
+
+    def part(self, nick, channel, reason='Leaving'):
+        self.broadcast(
+            ':{} PART {} :{}'.format(self.hostmask(nick), channel, reason), channel
+        )
+        self.channels.get(channel, set()).discard(nick)
+        self.memberships.get(nick, set()).discard(channel)
+
+    def quit(self, nick, reason='Quit'):
+        """Quit a user, telling everyone who shared a channel with them"""
+        line = ':{} QUIT :{}'.format(self.hostmask(nick), reason)
+
+        channels = self.memberships.get(nick, ())
+        for writer, client in self.clients.items():
+            if client != nick and any(client in self.channels[c] for c in channels):
+                self.send(writer, line)
+
+        self.leave_all(nick)
+
+    def privmsg(self, nick, target, text):
+        line = ':{} PRIVMSG {} :{}'.format(self.hostmask(nick), target, text)
+        if target.startswith('#'):
+            self.broadcast(line, target, exclude=nick)
+        else:
+            for writer, client in self.clients.items():
+                if client == target:
+                    self.send(writer, line)
+
+    def names(self, writer, nick, channel):
+        members = sorted(self.channels.get(channel, ()))
+        for start in range(0, len(members), 50):
+            self.send(
+                writer,
+                ':{} 353 {} = {} :{}'.format(
+                    self.name, nick, channel, ' '.join(members[start : start + 50])
+                ),
+            )
+        self.send(writer, ':{} 366 {} {} :End of /NAMES list.'.format(self.name, nick, channel))
+
+    def handle_line(self, writer, nick, line):
+        """Handle a line from a client, returning its nick afterwards"""
+        verb, _, rest = line.partition(' ')
+        if verb == 'NICK':
+            if writer in self.clients:
+                self.broadcast(':{} NICK {}'.format(self.hostmask(nick), rest))
+                channels = self.memberships.pop(nick, set())
+                for channel in channels:
+                    self.channels[channel].discard(nick)
+                    self.channels[channel].add(rest)
+                self.memberships[rest] = channels
+                self.clients[writer] = rest
+            nick = rest
+        elif verb == 'USER':
+            self.clients[writer] = nick
+            self.send(writer, ':{} 001 {} :Welcome'.format(self.name, nick))
+            self.send(writer, ':{} 005 {} {} :are supported by this server'.format(
+                self.name, nick, ISUPPORT))
+            self.registered.set()
+        elif verb == 'PING':
+            self.send(writer, ':{} PONG {}'.format(self.name, rest))
+        elif verb == 'JOIN':
+            for channel in rest.split(' ')[0].split(','):
+                self.join(nick, channel)
+                self.names(writer, nick, channel)
+        elif verb == 'PART':
+            channel, _, reason = rest.partition(' :')
+            self.part(nick, channel, reason or 'Leaving')
+        elif verb == 'PRIVMSG':
+            target, _, text = rest.partition(' :')
+            self.privmsg(nick, target, text)
+
+        return nick
+
+    async def handle(self, reader, writer):
+        self.writers.add(writer)
+        self.handlers.add(asyncio.current_task())
+        self.connections += 1
+
+        nick = '*'
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                now = time.perf_counter()
+                line = line.decode('utf-8').rstrip('\r\n')
+                if self.record_lines:
+                    self.lines.append(line)
+
+                nick = self.handle_line(writer, nick, line)
+                for listener in self.listeners:
+                    listener(nick, line, now)
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            self.handlers.discard(asyncio.current_task())
+            if self.clients.pop(writer, None) is not None:
+                self.leave_all(nick)
+            writer.close()
@@ -0,0 +1,436 @@
+"""Drive a bot with synthetic traffic from a local IRC server
+
+Run from the root of the repo with:
+
+    PYTHONPATH=. python seabird/tests/loadtest.py --rate 500 --duration 10
+
+The bot is started with Bot.run in its own process and connects to an
+IRCServer on localhost, so nothing here needs network access. Simulated
+users chat, join and part channels and send !math probes. The time between
+sending a probe and the server receiving the bot's reply is the reply
+latency.
+
+With --find-max, the rate is raised step by step until the latency SLO is
+missed, and the highest rate which met it is reported.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import random
+import re
+import time
+
+from ircserver import IRCServer
+
+from seabird.bot import Bot
+from seabird.config import Config
+
+PROBE_REGEX = re.compile(r'(\d+)\+0 = ')
+
+WORDS = 'the quick brown fox jumps over a lazy dog http://example.com/'.split()
+
+# Relative weights of what simulated users do
+DEFAULT_MIX = {'chat': 85, 'probe': 5, 'join': 5, 'part': 5}
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError('Unknown action {}'.format(kind))
+        mix[kind] = float(weight)
+    return mix
+
+
+class Load:
+    """Settings for a load run
+
+    rate is in lines per second, not counting netsplit bursts. Every
+    netsplit_every seconds, netsplit_size of the online users quit at once
+    and come back split_length seconds later.
+    """
+
+    def __init__(
+        self,
+        rate=100,
+        users=500,
+        channels=10,
+        duration=10,
+        mix=None,
+        netsplit_every=0,
+        netsplit_size=0.2,
+        split_length=1,
+        seed=1,
+    ):
+        self.rate = rate
+        self.users = users
+        self.channels = channels
+        self.duration = duration
+        self.mix = mix or DEFAULT_MIX
+        self.netsplit_every = netsplit_every
+        self.netsplit_size = netsplit_size
+        self.split_length = split_length
+        self.seed = seed
+
+
+class Results:
+    def __init__(self, rate):
+        self.rate = rate
+
+        # Every line sent, and the ones sent at the steady rate as opposed to
+        # netsplit bursts.
+        self.lines = 0
+        self.steady = 0
+        self.elapsed = 0
+        self.probes = 0
+        self.latencies = []
+        self.lost = 0
+        self.netsplits = 0
+
+    @property
+    def sent_rate(self):
+        return self.steady / self.elapsed if self.elapsed else 0
+
+    def percentiles(self):
+        latencies = sorted(self.latencies)
+        return {pct: percentile(latencies, pct) for pct in (50, 99, 99.9)}
+
+    def meets(self, slo):
+        """Return True if p99 latency was within slo seconds
+
+        Lost probes count as a miss, as does the generator not being able to
+        send at the requested rate.
+        """
+        p99 = self.percentiles()[99]
+        if p99 is None or p99 > slo or self.lost:
+            return False
+
+        return self.sent_rate >= self.rate * 0.95
+
+    def report(self):
+        pcts = self.percentiles()
+
+        def fmt(value):
+            return '-' if value is None else '{:.2f}ms'.format(value * 1000)
+
+        return (
+            '{:>8.0f} lines/s: sent {} lines in {:.2f}s ({:.0f}/s), {} probes, '
+            '{} lost, {} netsplits, p50 {} p99 {} p999 {}'.format(
+                self.rate,
+                self.lines,
+                self.elapsed,
+                self.sent_rate,
+                self.probes,
+                self.lost,
+                self.netsplits,
+                fmt(pcts[50]),
+                fmt(pcts[99]),
+                fmt(pcts[99.9]),
+            )
+        )
+
+
+class LoadGenerator:
+    """Send synthetic traffic from simulated users on an IRCServer"""
+
+    # How often lines are sent. Each tick sends however many lines are due.
+    tick = 0.005
+
+    def __init__(self, server, load, nick='bot'):
+        self.server = server
+        self.load = load
+        self.nick = nick
+
+        self.random = random.Random(load.seed)
+        self.channels = ['#load{}'.format(i) for i in range(load.channels)]
+        self.online = []
+        self.split = []
+
+        self.next_probe = 0
+        self.pending = {}
+        self.results = None
+
+        server.listeners.append(self.received)
+
+    def populate(self):
+        """Put the simulated users into channels
+
+        This should be done before the bot joins so they show up in NAMES.
+        """
+        for i in range(self.load.users):
+            nick = 'user{}'.format(i)
+            for channel in self.random.sample(
+                self.channels, min(len(self.channels), self.random.randint(1, 3))
+            ):
+                self.server.join(nick, channel)
+            self.online.append(nick)
+
+    def joined(self):
+        """Return True once the bot is in every channel"""
+        return all(
+            self.nick in self.server.channels.get(channel, ()) for channel in self.channels
+        )
+
+    def received(self, nick, line, now):
+        if nick != self.nick or not line.startswith('PRIVMSG '):
+            return
+
+        match = PROBE_REGEX.search(line)
+        if match is None:
+            return
+
+        sent = self.pending.pop(int(match.group(1)), None)
+        if sent is not None and self.results is not None:
+            self.results.latencies.append(now - sent)
+
+    def probe(self, nick):
+        channel = self.random.choice(tuple(self.server.memberships[nick]))
+        probe = self.next_probe
+        self.next_probe += 1
+
+        self.server.privmsg(nick, channel, '!math {}+0'.format(probe))
+        self.pending[probe] = time.perf_counter()
+        self.results.probes += 1
+
+    def action(self, kind):
+        nick = self.random.choice(self.online)
+        channels = self.server.memberships.get(nick, ())
+
+        if kind == 'probe' and channels:
+            self.probe(nick)
+        elif kind == 'join' and len(channels) < len(self.channels):
+            channel = self.random.choice(
+                [channel for channel in self.channels if channel not in channels]
+            )
+            self.server.join(nick, channel)
+        elif kind == 'part' and len(channels) > 1:
+            self.server.part(nick, self.random.choice(tuple(channels)))
+        elif channels:
+            text = ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(1, 15)))
+            self.server.privmsg(nick, self.random.choice(tuple(channels)), text)
+        else:
+            # Users with nowhere to talk join somewhere instead.
+            self.server.join(nick, self.random.choice(self.channels))
+
+    def netsplit(self):
+        count = int(len(self.online) * self.load.netsplit_size)
+        split = self.random.sample(self.online, count)
+        gone = set(split)
+        self.online = [nick for nick in self.online if nick not in gone]
+
+        for nick in split:
+            channels = tuple(self.server.memberships.get(nick, ()))
+            self.server.quit(nick, '*.net *.split')
+            self.split.append((nick, channels))
+
+        self.results.netsplits += 1
+        self.results.lines += count
+
+    def rejoin(self):
+        for nick, channels in self.split:
+            for channel in channels:
+                self.server.join(nick, channel)
+                self.results.lines += 1
+            self.online.append(nick)
+        self.split = []
+
+    async def run(self, rate=None, duration=None, drain=2):
+        """Send traffic and return the Results
+
+        After sending, this waits up to drain seconds for outstanding probe
+        replies. Any still missing after that are counted as lost.
+        """
+        load = self.load
+        rate = rate or load.rate
+        duration = duration or load.duration
+
+        results = self.results = Results(rate)
+        self.pending.clear()
+
+        kinds = list(load.mix)
+        weights = [load.mix[kind] for kind in kinds]
+
+        start = time.perf_counter()
+        next_split = start + load.netsplit_every if load.netsplit_every else None
+        rejoin_at = None
+
+        while True:
+            now = time.perf_counter()
+            elapsed = now - start
+            if elapsed >= duration:
+                break
+
+            if next_split is not None and now >= next_split:
+                self.netsplit()
+                next_split = now + load.netsplit_every
+                rejoin_at = now + load.split_length
+            if rejoin_at is not None and now >= rejoin_at:
+                self.rejoin()
+                rejoin_at = None
+
+            due = int(rate * elapsed) - results.steady
+            for kind in self.random.choices(kinds, weights, k=due):
+                self.action(kind)
+            results.steady += due
+            results.lines += due
+
+            await asyncio.sleep(self.tick)
+
+        results.elapsed = time.perf_counter() - start
+
+        if self.split:
+            self.rejoin()
+
+        deadline = time.perf_counter() + drain
+        while self.pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+        results.lost = len(self.pending)
+        self.results = None
+
+        return results
+
+    async def find_max(self, slo, step=1.5, max_rate=100000, duration=None):
+        """Raise the rate until the SLO is missed
+
+        Returns (best passing Results or None, list of all Results).
+        """
+        best = None
+        runs = []
+        rate = self.load.rate
+        while rate <= max_rate:
+            results = await self.run(rate, duration)
+            runs.append(results)
+            if not results.meets(slo):
+                break
+
+            best = results
+            rate *= step
+
+        return best, runs
+
+
+def run_bot(settings):
+    logging.basicConfig(level=logging.WARNING)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    Bot(Config(settings), loop=loop).run()
+
+
+def bot_settings(port, generator, plugins):
+    return {
+        'NICK': generator.nick,
+        'USER': generator.nick,
+        'NAME': 'Load Test',
+        'HOST': '127.0.0.1',
+        'PORT': port,
+        'SSL': False,
+        'PREFIX': '!',
+        'PLUGIN_CLASSES': plugins,
+        'CMDS': ['JOIN {}'.format(','.join(generator.channels))],
+        'RECONNECT_ON_FAILURE': False,
+    }
+
+
+async def main(args):
+    load = Load(
+        rate=args.rate,
+        users=args.users,
+        channels=args.channels,
+        duration=args.duration,
+        mix=args.mix,
+        netsplit_every=args.netsplit_every,
+        netsplit_size=args.netsplit_size,
+        seed=args.seed,
+    )
+
+    server = await IRCServer().start()
+    generator = LoadGenerator(server, load)
+    generator.populate()
+
+    # Keeping every line the bot sends isn't useful here.
+    server.record_lines = False
+
+    ctx = multiprocessing.get_context('spawn')
+    process = ctx.Process(
+        target=run_bot,
+        args=(bot_settings(server.port, generator, args.plugins),),
+        daemon=True,
+    )
+    process.start()
+
+    try:
+        deadline = time.monotonic() + 30
+        while not generator.joined():
+            if time.monotonic() > deadline or not process.is_alive():
+                raise SystemExit('The bot never joined its channels')
+            await asyncio.sleep(0.05)
+
+        slo = args.slo / 1000
+        if args.find_max:
+            best, runs = await generator.find_max(slo, args.step, args.max_rate)
+            for results in runs:
+                print(results.report())
+
+            if best is None:
+                print('No rate met the p99 SLO of {}ms'.format(args.slo))
+            else:
+                print('Max sustained rate meeting the p99 SLO of {}ms: {:.0f} lines/s'.format(
+                    args.slo, best.rate))
+        else:
+            results = await generator.run()
+            print(results.report())
+            print('p99 SLO of {}ms {}'.format(args.slo, 'met' if results.meets(slo) else 'missed'))
+    finally:
+        process.terminate()
+        process.join()
+        await server.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=100, help='lines per second to send')
+    parser.add_argument('--users', type=int, default=500, help='number of simulated users')
+    parser.add_argument('--channels', type=int, default=10, help='number of channels')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument(
+        '--mix',
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help='weights of user actions (default chat=85,probe=5,join=5,part=5)',
+    )
+    parser.add_argument(
+        '--netsplit-every', type=float, default=0, help='seconds between netsplits'
+    )
+    parser.add_argument(
+        '--netsplit-size', type=float, default=0.2, help='fraction of users to split'
+    )
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--slo', type=float, default=50, help='p99 reply latency SLO in ms')
+    parser.add_argument('--find-max', action='store_true', help='search for the max rate')
+    parser.add_argument('--step', type=float, default=1.5, help='rate multiplier per step')
+    parser.add_argument('--max-rate', type=float, default=100000)
+    parser.add_argument(
+        '--plugin',
+        dest='plugins',
+        action='append',
+        default=['seabird.modules.math.MathPlugin'],
+        help='extra plugin classes to load',
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
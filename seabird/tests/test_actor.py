@@ -0,0 +1,158 @@
+import asyncio
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Batch, Message
+from seabird.metrics import MetricsServer
+from seabird.plugin import CommandMixin, Plugin
+
+
+class FakeTransport:
+    def __init__(self):
+        self.paused = []
+
+    def write(self, data):
+        pass
+
+    def pause_reading(self):
+        self.paused.append(True)
+
+    def resume_reading(self):
+        self.paused.append(False)
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+class InlinePlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.seen = []
+
+    def irc_privmsg(self, msg):
+        self.seen.append(msg.trailing)
+
+
+class SlowPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.seen = []
+
+    async def irc_privmsg(self, msg):
+        await asyncio.sleep(0.001)
+        self.seen.append(msg.trailing)
+
+
+class AsyncInlinePlugin(Plugin, CommandMixin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.seen = []
+
+    async def cmd_wait(self, msg):
+        await asyncio.sleep(0.001)
+        self.seen.append(msg.trailing)
+
+
+def privmsg(text):
+    return Message(':alice!alice@example.com PRIVMSG #chan :{}'.format(text))
+
+
+def make_bot(**queue):
+    loop = asyncio.new_event_loop()
+    config = Config(
+        NICK='bot', PREFIX='!', HOST='irc.example.com',
+        PLUGIN_QUEUES={
+            'test_actor.SlowPlugin': queue,
+            'seabird.modules.isupport.ISupportPlugin': {},
+        },
+    )
+    bot = Bot(config, loop=loop)
+    bot._transport = FakeTransport()
+    return bot
+
+
+def drain(bot, plugin, count):
+    async def wait():
+        while len(plugin.seen) < count:
+            await asyncio.sleep(0.001)
+
+    bot.loop.run_until_complete(asyncio.wait_for(wait(), 5))
+    for task in list(plugin.tasks):
+        task.cancel()
+    bot.loop.run_until_complete(asyncio.sleep(0))
+    bot.loop.close()
+
+
+def test_queue_keeps_order():
+    bot = make_bot()
+    slow = bot.load_plugin(SlowPlugin)
+    inline = bot.load_plugin(InlinePlugin)
+    isupport = bot.load_plugin('seabird.modules.isupport.ISupportPlugin')
+
+    assert slow.inbox is not None
+    assert inline.inbox is None
+    assert isupport.inbox is None
+
+    bot.dispatch(privmsg('1'))
+    batch = Batch('ref', 'netsplit', [])
+    batch.messages = [privmsg('2'), privmsg('3')]
+    bot.dispatch_batch(batch)
+    bot.dispatch(privmsg('4'))
+
+    # Inline plugins don't wait for queued ones.
+    assert inline.seen == ['1', '2', '3', '4']
+    assert slow.seen == []
+
+    drain(bot, slow, 4)
+    assert slow.seen == ['1', '2', '3', '4']
+
+
+def test_queue_drop_policies():
+    for policy, expected in (('drop_oldest', ['4', '5']), ('drop_newest', ['1', '2'])):
+        bot = make_bot(size=2, policy=policy)
+        slow = bot.load_plugin(SlowPlugin)
+        inbox = slow.inbox
+
+        for i in range(1, 6):
+            bot.dispatch(privmsg(str(i)))
+        assert inbox.dropped == 3
+
+        server = MetricsServer()
+        server.add(bot)
+        lines = server.render().splitlines()
+        labels = '{network="irc.example.com",plugin="SlowPlugin"}'
+        assert 'seabird_plugin_queue_depth' + labels + ' 2' in lines
+        assert 'seabird_plugin_queue_dropped_total' + labels + ' 3' in lines
+
+        drain(bot, slow, 2)
+        assert slow.seen == expected
+
+
+def test_queue_block_policy():
+    bot = make_bot(size=2, policy='block')
+    slow = bot.load_plugin(SlowPlugin)
+
+    for i in range(1, 5):
+        bot.dispatch(privmsg(str(i)))
+    assert bot._transport.paused == [True]
+    assert slow.inbox.dropped == 0
+
+    drain(bot, slow, 4)
+    assert slow.seen == ['1', '2', '3', '4']
+    assert bot._transport.paused == [True, False]
+    assert not bot.paused_by
+
+
+def test_inline_coroutines_are_scheduled():
+    bot = make_bot()
+    plugin = bot.load_plugin(AsyncInlinePlugin)
+    assert plugin.inbox is None
+
+    bot.dispatch(privmsg('!wait 1'))
+    batch = Batch('ref', 'netsplit', [])
+    batch.messages = [privmsg('!wait 2'), privmsg('!wait 3')]
+    bot.dispatch_batch(batch)
+    assert len(plugin.tasks) == 3
+
+    drain(bot, plugin, 3)
+    assert sorted(plugin.seen) == ['1', '2', '3']
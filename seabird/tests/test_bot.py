@@ -0,0 +1,234 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Message
+from seabird.plugin import Plugin
+
+
+class FakeTransport:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode('utf-8').splitlines())
+
+    def close(self):
+        pass
+
+
+class RecordingPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.events = []
+        self.batches = []
+
+    def irc_quit(self, msg):
+        self.events.append(msg.identity.name)
+
+    def irc_privmsg(self, msg):
+        self.events.append(msg.trailing)
+
+
+class NetsplitPlugin(RecordingPlugin):
+    def batch_netsplit(self, batch):
+        self.batches.append(batch)
+
+
+@pytest.fixture
+def bot():
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False
+    )
+    bot = Bot(config, loop=asyncio.new_event_loop())
+    yield bot
+    bot.loop.close()
+
+
+def connect(bot):
+    transport = FakeTransport()
+    bot.connection_made(transport)
+    return transport
+
+
+def feed(bot, *lines):
+    for line in lines:
+        bot.dispatch(Message(line))
+
+
+def test_cap_negotiation(bot):
+    bot.cap_req('multi-prefix', 'away-notify')
+    transport = connect(bot)
+
+    assert transport.lines[0] == 'CAP LS 302'
+    assert transport.lines[1:] == ['NICK bot', 'USER bot 0.0.0.0 0.0.0.0 Bot']
+    transport.lines.clear()
+
+    feed(
+        bot,
+        ':irc.example.com CAP * LS * :multi-prefix sasl=PLAIN,EXTERNAL',
+        ':irc.example.com CAP * LS :batch server-time',
+    )
+    assert bot.caps.available['sasl'] == 'PLAIN,EXTERNAL'
+    assert transport.lines == ['CAP REQ :batch multi-prefix']
+    transport.lines.clear()
+
+    feed(bot, ':irc.example.com CAP * ACK :batch')
+    assert transport.lines == []
+
+    feed(bot, ':irc.example.com CAP * NAK :multi-prefix')
+    assert transport.lines == ['CAP END']
+    assert bot.caps.enabled == {'batch'}
+    assert not bot.cap_enabled('multi-prefix')
+
+
+def test_cap_without_server_support(bot):
+    transport = connect(bot)
+    feed(bot, ':irc.example.com 001 bot :Welcome')
+
+    # If the server never answered, we shouldn't send anything else.
+    assert not bot.caps.negotiating
+    assert 'CAP END' not in transport.lines
+
+
+def test_batch_bulk_dispatch(bot):
+    recording = bot.load_plugin(RecordingPlugin)
+    netsplit = bot.load_plugin(NetsplitPlugin)
+    connect(bot)
+
+    feed(
+        bot,
+        ':irc.example.com BATCH +abc netsplit irc.a.net irc.b.net',
+        '@batch=abc :alice!a@host QUIT :irc.a.net irc.b.net',
+        '@batch=abc :bob!b@host QUIT :irc.a.net irc.b.net',
+    )
+
+    # Nothing should be delivered until the batch is over
+    assert recording.events == []
+    assert netsplit.batches == []
+
+    feed(bot, ':irc.example.com BATCH -abc')
+
+    assert recording.events == ['alice', 'bob']
+    assert len(netsplit.batches) == 1
+    assert netsplit.batches[0].params == ['irc.a.net', 'irc.b.net']
+    assert [m.identity.name for m in netsplit.batches[0].messages] == ['alice', 'bob']
+    assert netsplit.events == []
+
+
+def test_chathistory_not_replayed(bot):
+    recording = bot.load_plugin(RecordingPlugin)
+    connect(bot)
+
+    feed(
+        bot,
+        ':irc.example.com BATCH +h chathistory #chan',
+        '@batch=h :alice!a@host PRIVMSG #chan :old message',
+        ':irc.example.com BATCH -h',
+        ':alice!a@host PRIVMSG #chan :new message',
+    )
+
+    assert recording.events == ['new message']
+
+
+def test_chathistory_keeps_state(bot):
+    connect(bot)
+    feed(bot, ':irc.example.com 001 bot :Welcome')
+
+    feed(
+        bot,
+        ':irc.example.com BATCH +h chathistory #chan',
+        '@batch=h :bot!bot@host NICK :oldnick',
+        ':irc.example.com BATCH -h',
+    )
+    assert bot.current_nick == 'bot'
+
+    # Live batches still count.
+    feed(
+        bot,
+        ':irc.example.com BATCH +n netjoin irc.a.net irc.b.net',
+        '@batch=n :bot!bot@host NICK :newnick',
+        ':irc.example.com BATCH -n',
+    )
+    assert bot.current_nick == 'newnick'
+
+
+RELOADABLE = '''
+import asyncio
+
+from seabird.plugin import Plugin
+
+
+class ReloadablePlugin(Plugin):
+    version = {version}
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.seen = []
+
+    def irc_privmsg(self, msg):
+        self.seen.append(msg.trailing)
+        self.create_task(asyncio.sleep(60))
+
+    def export_state(self):
+        return self.seen
+
+    def import_state(self, state):
+        self.seen = state
+'''
+
+
+class DependentPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.reloadable = bot.load_plugin('reloadable_plugin.ReloadablePlugin')
+
+
+@pytest.fixture
+def reloadable(tmpdir, monkeypatch):
+    path = tmpdir.join('reloadable_plugin.py')
+    path.write(RELOADABLE.format(version=1))
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield path
+    sys.modules.pop('reloadable_plugin', None)
+
+
+def test_reload_plugin(bot, reloadable):
+    recording = bot.load_plugin(RecordingPlugin)
+    dependent = bot.load_plugin(DependentPlugin)
+    old = dependent.reloadable
+    connect(bot)
+
+    feed(bot, ':alice!a@host PRIVMSG #chan :hello')
+    task = next(iter(old.tasks))
+
+    # Make sure the mtime changes so the module isn't loaded from the cache.
+    reloadable.write(RELOADABLE.format(version=2))
+    os.utime(str(reloadable), (0, 0))
+
+    new, = bot.reload_plugin(old)
+    bot.loop.run_until_complete(asyncio.sleep(0))
+
+    assert task.cancelled()
+    assert new.version == 2
+    assert new.seen == ['hello']
+    assert bot.plugins == [recording, new, dependent]
+    assert dependent.reloadable is new
+
+    # Loading by name should find the new instance
+    assert bot.load_plugin('reloadable_plugin.ReloadablePlugin') is new
+
+    feed(bot, ':alice!a@host PRIVMSG #chan :again')
+    assert new.seen == ['hello', 'again']
+    assert len(new.tasks) == 1
+
+    bot.unload_plugin(new)
+    bot.loop.run_until_complete(asyncio.sleep(0))
+    assert bot.plugins == [recording, dependent]
+    assert not new.tasks
@@ -1,7 +1,7 @@
 import pytest
 import yaml
 
-from seabird.irc import Message, Identity
+from seabird.irc import CaseMapping, Message, Identity
 
 
 def load_irc_fixture(fname):
@@ -40,3 +40,28 @@ def test_identity_parsing(test):
 
     # Ensure that we tested with all the data provided
     assert not atoms
+
+
+def test_casemapping():
+    casemap = CaseMapping()
+    assert casemap.fold('Foo[]\\~') == 'foo{}|^'
+    assert casemap.equal('Foo[', 'foo{')
+
+    casemap.set_mapping('strict-rfc1459')
+    assert casemap.fold('Foo[]\\~') == 'foo{}|~'
+
+    casemap.set_mapping('ascii')
+    assert casemap.fold('Foo[]\\~') == 'foo[]\\~'
+    assert not casemap.equal('Foo[', 'foo{')
+
+    # Unknown mappings fall back to rfc1459
+    casemap.set_mapping('unknown')
+    assert casemap.name == 'rfc1459'
+
+
+def test_from_channel_casemapping():
+    msg = Message(':nick!user@host PRIVMSG Bot[m] :hi', current_nick='bot{m}')
+    assert msg.from_channel
+
+    msg.casemap = CaseMapping()
+    assert not msg.from_channel
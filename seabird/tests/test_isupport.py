@@ -0,0 +1,54 @@
+from seabird.modules.isupport import build_tables, mode_parse, status_prefix_parse
+
+
+SUPPORTED = {
+    'PREFIX': '(qaohv)~&@%+',
+    'CHANMODES': ['beI', 'k', 'l', 'imnpst'],
+    'CHANTYPES': '#&',
+}
+
+
+def test_build_tables():
+    tables = build_tables(SUPPORTED)
+
+    assert tables.mode_to_prefix['o'] == '@'
+    assert tables.prefix_to_mode['+'] == 'v'
+    assert tables.mode_bits['q'] == tables.prefix_bits['~'] == 1
+    assert tables.mode_bits['v'] == tables.prefix_bits['+'] == 16
+    assert tables.param_on_add == frozenset('beIklqaohv')
+    assert tables.param_on_remove == frozenset('beIkqaohv')
+    assert tables.chantypes == ('#', '&')
+
+
+def test_build_tables_empty_values():
+    # Tokens like "CHANTYPES=" are parsed as True
+    tables = build_tables({'PREFIX': True, 'CHANMODES': True, 'CHANTYPES': True})
+
+    assert tables.mode_to_prefix == {}
+    assert tables.param_on_add == frozenset()
+    assert tables.chantypes == ()
+
+    tables = build_tables({'PREFIX': '(ov)@+', 'CHANMODES': 'beI', 'CHANTYPES': '#'})
+    assert tables.param_on_add == frozenset('beIov')
+    assert tables.param_on_remove == frozenset('beIov')
+
+
+def test_status_prefix_parse():
+    tables = build_tables(SUPPORTED)
+
+    assert status_prefix_parse(tables, '@+nick') == (4 | 16, 'nick')
+    assert status_prefix_parse(tables, 'nick') == (0, 'nick')
+    assert status_prefix_parse(tables, '~') == (1, '')
+
+
+def test_mode_parse():
+    tables = build_tables(SUPPORTED)
+
+    modes = list(mode_parse('+ol-lk+m', ['alice', '10', 'key'], tables))
+    assert modes == [
+        ('o', 'alice', True),
+        ('l', '10', True),
+        ('l', None, False),
+        ('k', 'key', False),
+        ('m', None, True),
+    ]
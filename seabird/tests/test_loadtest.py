@@ -0,0 +1,81 @@
+import asyncio
+
+from ircserver import IRCServer
+from loadtest import Load, LoadGenerator, bot_settings, percentile
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.plugin import Plugin
+
+
+class NamesPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.names = set()
+
+    def irc_353(self, msg):
+        self.names.update(msg.trailing.split())
+
+
+def test_percentile():
+    values = list(range(1, 1001))
+    assert percentile(values, 50) == 500
+    assert percentile(values, 99) == 990
+    assert percentile(values, 99.9) == 999
+    assert percentile([], 50) is None
+
+
+def test_load():
+    async def test():
+        server = await IRCServer().start()
+        generator = LoadGenerator(
+            server,
+            Load(
+                rate=200,
+                users=50,
+                channels=3,
+                duration=0.5,
+                mix={'chat': 50, 'probe': 30, 'join': 10, 'part': 10},
+                netsplit_every=0.2,
+                split_length=0.1,
+            ),
+        )
+        generator.populate()
+
+        settings = bot_settings(server.port, generator, ['seabird.modules.math.MathPlugin'])
+        bot = Bot(Config(settings), loop=asyncio.get_event_loop())
+        bot.load_plugins()
+        names = bot.load_plugin(NamesPlugin)
+        task = asyncio.ensure_future(bot.connect())
+
+        while not generator.joined():
+            await asyncio.sleep(0.01)
+
+        # The simulated users were listed in NAMES
+        assert names.names == {'bot'} | {'user{}'.format(i) for i in range(50)}
+
+        results = await generator.run()
+
+        bot.stop()
+        await asyncio.wait_for(task, 5)
+        await server.stop()
+
+        return results
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(test())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert results.probes > 0
+    assert results.lost == 0
+    assert len(results.latencies) == results.probes
+    assert results.netsplits >= 1
+    assert results.lines > results.steady
+
+    pcts = results.percentiles()
+    assert pcts[50] <= pcts[99] <= pcts[99.9]
+    assert results.meets(5)
@@ -0,0 +1,66 @@
+import logging
+
+from seabird.config import Config
+from seabird.irc import TRAFFIC_LOG
+from seabird.log import DroppingQueueHandler, SampleFilter, configure_traffic, setup_logging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def record(msg):
+    return logging.makeLogRecord({'msg': msg, 'levelno': logging.INFO})
+
+
+def test_dropping_queue_handler():
+    handler = DroppingQueueHandler(maxsize=2)
+    for i in range(5):
+        handler.handle(record('message {}'.format(i)))
+
+    assert handler.dropped == 3
+
+    # Once there's room, the drops are reported before the next record.
+    handler.queue.get_nowait()
+    handler.queue.get_nowait()
+    handler.handle(record('after'))
+
+    warning = handler.queue.get_nowait()
+    assert warning.levelno == logging.WARNING
+    assert warning.getMessage() == 'Dropped 3 log records'
+    assert handler.queue.get_nowait().getMessage() == 'after'
+
+
+def test_sample_filter():
+    sample = SampleFilter(10)
+    kept = [i for i in range(100) if sample.filter(record(str(i)))]
+    assert len(kept) == 10
+
+
+def test_setup_logging():
+    root_logger = logging.getLogger()
+    old_handlers, old_level = root_logger.handlers[:], root_logger.level
+
+    output = ListHandler()
+    listener = setup_logging(Config(LOG_LEVEL=logging.DEBUG, LOG_TRAFFIC_SAMPLE=5), output)
+    try:
+        for i in range(20):
+            TRAFFIC_LOG.debug('<-- line %d', i)
+        logging.getLogger('seabird.test').info('hello')
+    finally:
+        listener.stop()
+        root_logger.handlers[:] = old_handlers
+        root_logger.setLevel(old_level)
+        configure_traffic(1)
+
+    messages = [record.getMessage() for record in output.records]
+    assert messages == ['<-- line {}'.format(i) for i in range(4, 20, 5)] + ['hello']
+
+    configure_traffic(0)
+    assert not TRAFFIC_LOG.isEnabledFor(logging.DEBUG)
+    configure_traffic(1)
@@ -0,0 +1,74 @@
+import os
+
+from seabird import modules
+from seabird.manifest import load_manifest, missing_dependencies, plugin_classes
+
+
+def write(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def test_plugin_classes():
+    manifest = load_manifest(modules.__path__[0], 'seabird.modules.')
+    plugins = plugin_classes(manifest)
+
+    # Disabled plugins need to be loaded explicitly
+    assert 'BleepPlugin' not in plugins.get('seabird.modules.bleep', [])
+
+    assert plugins['seabird.modules.track'] == ['UserTrack']
+    assert 'URLPlugin' in plugins['seabird.modules.url']
+    assert 'YoutubeURLPlugin' in plugins['seabird.modules.url.youtube']
+
+    # Helper modules without plugins shouldn't be imported at all
+    assert 'seabird.modules.utils' not in plugins
+
+
+def test_inherited_plugins(tmpdir):
+    write(str(tmpdir.join('__init__.py')), '')
+    write(str(tmpdir.join('base.py')), '\n'.join([
+        'from seabird.plugin import Plugin',
+        '',
+        'class Base(Plugin):',
+        '    __disabled__ = True',
+        '',
+        'class Helper:',
+        '    pass',
+    ]))
+    write(str(tmpdir.join('child.py')), '\n'.join([
+        'from . import base',
+        'from .base import Base as Parent',
+        'import not_a_real_module',
+        '',
+        'class Child(Parent):',
+        '    __disabled__ = False',
+        '',
+        'class Other(base.Base):',
+        '    pass',
+        '',
+        'class Unrelated(base.Helper):',
+        '    pass',
+    ]))
+
+    manifest = load_manifest(str(tmpdir), 'pkg.')
+    assert plugin_classes(manifest) == {'pkg.child': ['Child']}
+    assert missing_dependencies(manifest['pkg.child']) == ['not_a_real_module']
+
+
+def test_manifest_cache(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    write(str(pkg.join('a.py')), 'class A:\n    pass\n')
+    cache = str(tmpdir.join('manifest.json'))
+
+    manifest = load_manifest(str(pkg), 'pkg.', cache)
+    assert os.path.exists(cache)
+    assert [c['name'] for c in manifest['pkg.a']['classes']] == ['A']
+
+    # Changing the file should cause it to be scanned again
+    write(str(pkg.join('a.py')), 'class B:\n    pass\n\n\nclass C:\n    pass\n')
+    manifest = load_manifest(str(pkg), 'pkg.', cache)
+    assert [c['name'] for c in manifest['pkg.a']['classes']] == ['B', 'C']
+
+    # Removed modules should disappear from the manifest
+    os.remove(str(pkg.join('a.py')))
+    assert load_manifest(str(pkg), 'pkg.', cache) == {}
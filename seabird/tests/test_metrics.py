@@ -0,0 +1,81 @@
+import asyncio
+
+from ircserver import IRCServer
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.metrics import Histogram
+
+
+async def until(cond, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not cond():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+async def scrape(port, path='/metrics'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('GET {} HTTP/1.0\r\n\r\n'.format(path).encode('utf-8'))
+    data = await reader.read()
+    writer.close()
+
+    header, _, body = data.decode('utf-8').partition('\r\n\r\n')
+    return header.split('\r\n')[0], body
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2))
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe(value)
+
+    samples = list(histogram.samples('t', {}))
+    assert [value for _, _, value in samples] == [2, 3, 4, 6.0, 4]
+
+
+def test_metrics():
+    async def test():
+        server = await IRCServer().start()
+        config = Config(
+            NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=server.port,
+            SSL=False, PREFIX='!', PLUGIN_CLASSES=['seabird.modules.math.MathPlugin'],
+            CMDS=['JOIN #chan'], METRICS_PORT=0,
+        )
+        bot = Bot(config, loop=asyncio.get_event_loop())
+        bot.load_plugins()
+        task = asyncio.ensure_future(bot.connect())
+
+        await until(lambda: 'bot' in server.channels.get('#chan', ()))
+        server.privmsg('alice', '#chan', '!math 1+1')
+        await until(lambda: 'PRIVMSG #chan :alice: 1+1 = 2' in server.lines)
+
+        metrics = bot.shared.resources['metrics.server']
+        status, body = await scrape(metrics.port)
+        missing, _ = await scrape(metrics.port, '/nope')
+
+        bot.stop()
+        await asyncio.wait_for(task, 5)
+        bot.close()
+        await bot.shared.close()
+        await server.stop()
+
+        return status, body, missing
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        status, body, missing = loop.run_until_complete(test())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert status == 'HTTP/1.0 200 OK'
+    assert missing == 'HTTP/1.0 404 Not Found'
+
+    lines = body.splitlines()
+    assert '# TYPE seabird_lines_received_total counter' in lines
+    assert 'seabird_messages_total{network="127.0.0.1",verb="PRIVMSG"} 1' in lines
+    assert 'seabird_lines_sent_total{network="127.0.0.1"} 5' in lines
+    assert 'seabird_handler_seconds_count{network="127.0.0.1",plugin="MathPlugin"} 6' in lines
+    assert 'seabird_plugin_tasks{network="127.0.0.1",plugin="MathPlugin"} 0' in lines
+    assert '# TYPE seabird_loop_lag_seconds histogram' in lines
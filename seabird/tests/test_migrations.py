@@ -0,0 +1,55 @@
+import importlib.util
+import os
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+import sqlalchemy as sa
+
+VERSIONS = os.path.join(os.path.dirname(__file__), '..', '..', 'migrations', 'versions')
+
+
+def load_migration(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(VERSIONS, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def upgrade(conn, name):
+    with Operations.context(MigrationContext.configure(conn)):
+        load_migration(name).upgrade()
+
+
+def test_fold_nicks():
+    engine = sa.create_engine('sqlite://')
+    with engine.begin() as conn:
+        for name in sorted(os.listdir(VERSIONS)):
+            if name.endswith('.py') and name < '005':
+                upgrade(conn, name[:-3])
+
+        conn.execute(sa.text(
+            "INSERT INTO karma (name, score) VALUES ('foo[]', 2), ('foo{}', 3), ('bar', 1)"
+        ))
+        conn.execute(sa.text(
+            "INSERT INTO weather_locations (nick, address, lat, lon) VALUES "
+            "('Alice', 'old', 1, 2), ('alice', 'new', 3, 4), ('Bob', 'bob', 5, 6)"
+        ))
+        conn.execute(sa.text(
+            "INSERT INTO multimention (group_name, nick) VALUES "
+            "('ops', 'Alice'), ('ops', 'alice'), ('Ops[]', 'Bob')"
+        ))
+
+        upgrade(conn, '005_fold_nicks_with_casemapping')
+
+        karma = conn.execute(sa.text('SELECT name, score FROM karma ORDER BY name')).fetchall()
+        assert [tuple(row) for row in karma] == [('bar', 1), ('foo{}', 5)]
+
+        weather = conn.execute(
+            sa.text('SELECT nick, address FROM weather_locations ORDER BY nick')
+        ).fetchall()
+        assert [tuple(row) for row in weather] == [('alice', 'new'), ('bob', 'bob')]
+
+        mentions = conn.execute(
+            sa.text('SELECT group_name, nick FROM multimention ORDER BY mmention_id')
+        ).fetchall()
+        assert sorted(tuple(row) for row in mentions) == [('ops', 'alice'), ('ops{}', 'bob')]
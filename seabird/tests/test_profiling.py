@@ -0,0 +1,162 @@
+import asyncio
+import pstats
+import time
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Message
+from seabird.plugin import Plugin
+from seabird.profiling import (
+    DeterministicProfiler,
+    MemoryTracker,
+    SamplingProfiler,
+    deep_sizeof,
+    plugin_sizes,
+)
+
+
+class FakeTransport:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode('utf-8').splitlines())
+
+    def close(self):
+        pass
+
+
+class GrowingPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.items = {}
+
+
+def busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_sampling_profiler(tmpdir):
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy(0.2)
+    profiler.stop()
+
+    assert profiler.samples > 0
+    stack, _ = profiler.stacks.most_common(1)[0]
+    assert stack.split(';')[-1].startswith('busy (test_profiling.py')
+
+    path = str(tmpdir.join('profile.collapsed'))
+    profiler.write(path)
+    with open(path) as f:
+        line = f.readline()
+    assert line.rsplit(' ', 1)[1].strip().isdigit()
+
+
+def test_deterministic_profiler(tmpdir):
+    profiler = DeterministicProfiler()
+    profiler.start()
+    busy(0.01)
+    profiler.stop()
+
+    path = str(tmpdir.join('profile.pstats'))
+    profiler.write(path)
+    stats = pstats.Stats(path)
+    assert any(func[2] == 'busy' for func in stats.stats)
+
+
+def test_memory_tracker():
+    bot = Bot(Config(NICK='bot'), loop=asyncio.new_event_loop())
+    plugin = bot.load_plugin(GrowingPlugin)
+
+    tracker = MemoryTracker()
+    tracker.baseline(bot.plugins)
+    for i in range(1000):
+        plugin.items['key{}'.format(i)] = ['value'] * 10
+
+    stats, structures = tracker.diff(bot.plugins)
+    tracker.stop()
+    bot.loop.close()
+
+    assert stats and stats[0].size_diff > 0
+
+    name, before, after, before_length, length = structures[0]
+    assert name == 'GrowingPlugin.items'
+    assert after > before
+    assert (before_length, length) == (0, 1000)
+
+
+def test_size_limit():
+    items = {str(i): [i] for i in range(100)}
+    size, complete = deep_sizeof(items, set())
+    assert complete
+
+    partial, complete = deep_sizeof(items, set(), limit=10)
+    assert not complete
+    assert partial < size
+
+    bot = Bot(Config(NICK='bot'), loop=asyncio.new_event_loop())
+    plugin = bot.load_plugin(GrowingPlugin)
+    plugin.items = {i: list(range(10)) for i in range(100000)}
+
+    truncated = set()
+    plugin_sizes(bot.plugins, truncated)
+    bot.loop.close()
+    assert truncated == {'GrowingPlugin.items'}
+
+
+def test_admin_commands(tmpdir):
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', PREFIX='!', ADMINS=['admin!*@*'],
+        PROFILE_DIR=str(tmpdir),
+    )
+    bot = Bot(config, loop=asyncio.new_event_loop())
+    bot.load_plugin('seabird.modules.admin.AdminPlugin')
+    bot.load_plugin(GrowingPlugin)
+
+    transport = FakeTransport()
+    bot.connection_made(transport)
+    transport.lines.clear()
+
+    def command(text, nick='admin'):
+        bot.dispatch(Message(':{0}!{0}@host PRIVMSG #chan :{1}'.format(nick, text)))
+
+    command('!profile 0.05', nick='someone')
+    assert transport.lines == ['PRIVMSG #chan :someone: Permission denied.']
+
+    def wait(text):
+        async def wait():
+            while not any(text in line for line in transport.lines):
+                await asyncio.sleep(0.01)
+
+        bot.loop.run_until_complete(asyncio.wait_for(wait(), 5))
+
+    # Snapshots are taken off the loop, so each command has to finish before
+    # the next.
+    command('!memory baseline')
+    command('!memory diff')
+    wait('Memory baseline taken.')
+    assert 'PRIVMSG #chan :admin: Still working on the last memory command.' in transport.lines
+
+    bot.find_plugin('GrowingPlugin').items.update((i, str(i)) for i in range(100))
+    command('!memory diff')
+    wait('GrowingPlugin.items')
+    command('!memory stop')
+
+    command('!profile 0')
+    command('!profile nan')
+    assert transport.lines[-2:] == ['PRIVMSG #chan :admin: Invalid number of seconds.'] * 2
+
+    command('!profile 0.05')
+    wait('Wrote profile')
+    bot.close()
+    bot.loop.run_until_complete(bot.shared.close())
+    bot.loop.close()
+
+    assert 'PRIVMSG #chan :admin: Memory baseline taken.' in transport.lines
+    assert any('GrowingPlugin.items' in line and '0 -> 100 items' in line
+               for line in transport.lines)
+    assert 'PRIVMSG #chan :admin: Profiling for 0.05s.' in transport.lines
+    assert len(tmpdir.listdir()) == 1
@@ -0,0 +1,139 @@
+import asyncio
+import socket
+
+from ircserver import IRCServer
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.plugin import Plugin
+
+
+class ReconnectPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.lost = 0
+        self.reconnects = 0
+
+    def connection_lost(self, exc):
+        self.lost += 1
+
+    def reconnected(self):
+        self.reconnects += 1
+
+
+async def until(cond, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not cond():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def make_bot(**settings):
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', SSL=False,
+        RECONNECT_DELAY=0.01, CMDS=['JOIN #chan'],
+    )
+    config.update(settings)
+    return Bot(config, loop=asyncio.get_event_loop())
+
+
+def test_reconnect_with_fallback():
+    async def test():
+        server = await IRCServer().start()
+
+        # Nothing is listening on the first server, so we should fall back to
+        # the second one.
+        bot = make_bot(PORT=unused_port(), SERVERS=[{'PORT': server.port}])
+        plugin = bot.load_plugin(ReconnectPlugin)
+        task = asyncio.ensure_future(bot.connect())
+
+        await until(lambda: bot.connection.registrations == 1)
+        assert plugin.reconnects == 0
+
+        server.drop()
+        await until(lambda: bot.connection.registrations == 2)
+
+        # The plugin was kept around and told about the reconnect.
+        assert bot.plugins == [plugin]
+        assert plugin.lost == 1
+        assert plugin.reconnects == 1
+        assert len(bot.connection.reconnect_times) == 1
+        assert server.connections == 2
+        assert server.lines.count('JOIN #chan') == 2
+
+        bot.stop()
+        await asyncio.wait_for(task, 5)
+        await server.stop()
+
+    run(test())
+
+
+def test_fallback_after_server_goes_down():
+    async def test():
+        primary = await IRCServer().start()
+        backup = await IRCServer().start()
+
+        bot = make_bot(PORT=primary.port, SERVERS=[{'PORT': backup.port}])
+        task = asyncio.ensure_future(bot.connect())
+
+        await until(lambda: bot.connection.registrations == 1)
+        assert backup.connections == 0
+
+        # The primary registered us before, but now nothing is listening
+        # there, so we should move on to the backup.
+        await primary.stop()
+        await until(lambda: bot.connection.registrations == 2)
+        assert backup.connections == 1
+
+        bot.stop()
+        await asyncio.wait_for(task, 5)
+        await backup.stop()
+
+    run(test())
+
+
+def test_no_reconnect():
+    async def test():
+        server = await IRCServer().start()
+
+        bot = make_bot(PORT=server.port, RECONNECT_ON_FAILURE=False)
+        task = asyncio.ensure_future(bot.connect())
+
+        await until(lambda: bot.connection.registrations == 1)
+        server.drop()
+
+        await asyncio.wait_for(task, 5)
+        assert server.connections == 1
+        await server.stop()
+
+    run(test())
+
+
+def test_reconnect_delay():
+    loop = asyncio.new_event_loop()
+    config = Config(NICK='bot', RECONNECT_DELAY=1, RECONNECT_MAX_DELAY=10)
+    bot = Bot(config, loop=loop)
+
+    for attempt in range(10):
+        assert 0 <= bot._reconnect_delay(attempt) <= min(10, 2 ** attempt)
+
+    loop.close()
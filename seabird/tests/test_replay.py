@@ -0,0 +1,152 @@
+import asyncio
+import os
+
+import pytest
+
+from seabird.bot import Bot, network_configs
+from seabird.capture import Capture, Scrubber
+from seabird.config import Config
+from seabird.irc import CaseMapping, Message
+from seabird.modules.upstream import UpstreamPlugin, UpstreamUnavailable
+from seabird.replay import OfflineSession, Replay
+from seabird.wire import read_file
+
+
+class FakeTransport:
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_bot(**settings):
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False,
+        PREFIX='!', PLUGIN_CLASSES=[],
+    )
+    config.update(settings)
+    return Bot(config, loop=asyncio.new_event_loop())
+
+
+def test_scrubber():
+    scrubber = Scrubber(salt=b'salt')
+
+    msg = scrubber.message(Message(':alice!a@10.0.0.1 PRIVMSG #chan :from 192.168.1.1'))
+    assert '10.0.0.1' not in msg.line
+    assert '192.168.1.1' not in msg.line
+    assert msg.hostmask.startswith('alice!a@')
+
+    # The same host always maps to the same pseudonym
+    again = scrubber.message(Message(':alice!a@10.0.0.1 QUIT :bye'))
+    assert again.hostmask == msg.hostmask
+
+    whois = scrubber.message(Message(':irc 311 bot alice a secret.example.com * :Alice'))
+    assert whois.args[3] == scrubber.host('secret.example.com')
+
+    # Times and other numbers are left alone
+    text = scrubber.message(Message(':a!a@h PRIVMSG #chan :at 12:30 or 1.2.3'))
+    assert text.args[1] == 'at 12:30 or 1.2.3'
+
+
+def test_capture(tmpdir):
+    path = str(tmpdir.join('capture.sbw'))
+    bot = make_bot(CAPTURE_FILE=path, CAPTURE_MAX_BYTES=200, CAPTURE_BACKUPS=2)
+    bot.connection_made(FakeTransport())
+
+    for i in range(20):
+        bot.data_received(':alice!a@h PRIVMSG #chan :message {}\r\n'.format(i).encode('utf-8'))
+
+    bot.close()
+    bot.loop.close()
+
+    # Older files are rotated out, but what's left is in order.
+    assert os.path.exists(path + '.2')
+    assert not os.path.exists(path + '.3')
+
+    messages = []
+    for name in (path + '.2', path + '.1', path):
+        messages.extend(msg.args[1] for _, msg in read_file(name))
+
+    numbers = [int(text.split()[1]) for text in messages]
+    assert numbers == list(range(numbers[0], 20))
+
+
+def test_capture_reopen(tmpdir):
+    path = str(tmpdir.join('capture.sbw'))
+    casemap = CaseMapping()
+    for i in range(2):
+        capture = Capture(path)
+        capture.write(Message('PRIVMSG #chan :run {}'.format(i), casemap=casemap), timestamp=i)
+        capture.close()
+
+    # Restarting moves the last run's capture out of the way.
+    assert [msg.args[1] for _, msg in read_file(path + '.1')] == ['run 0']
+    assert [msg.args[1] for _, msg in read_file(path)] == ['run 1']
+
+
+def test_capture_per_network():
+    config = Config(
+        CAPTURE_FILE='capture.sbw',
+        NETWORKS={'libera': {}, 'oftc': {'CAPTURE_FILE': 'oftc.sbw'}},
+    )
+    networks = network_configs(config)
+
+    assert networks['libera']['CAPTURE_FILE'] == 'capture.libera.sbw'
+    assert networks['oftc']['CAPTURE_FILE'] == 'oftc.sbw'
+
+
+def test_replay_offline():
+    bot = make_bot(PLUGIN_CLASSES=['seabird.modules.url.URLPlugin'])
+    bot.load_plugins()
+    Replay(bot)
+
+    upstream = bot.load_plugin(UpstreamPlugin)['example']
+    assert isinstance(upstream.session_factory(), OfflineSession)
+
+    async def fetch():
+        async with upstream.request('GET', 'http://example.com'):
+            pass
+
+    try:
+        with pytest.raises(UpstreamUnavailable):
+            bot.loop.run_until_complete(fetch())
+    finally:
+        bot.close()
+        bot.loop.close()
+
+
+def test_replay(tmpdir):
+    path = str(tmpdir.join('capture.sbw'))
+    capture = Capture(path)
+    casemap = CaseMapping()
+    for i in range(10):
+        capture.write(
+            Message(
+                ':alice!a@h PRIVMSG #chan :!math {}*2'.format(i),
+                current_nick='bot',
+                casemap=casemap,
+            ),
+            timestamp=i * 0.001,
+        )
+    capture.close()
+
+    bot = make_bot(PLUGIN_CLASSES=['seabird.modules.math.MathPlugin'])
+    bot.load_plugins()
+
+    replay = Replay(bot)
+    try:
+        bot.loop.run_until_complete(replay.run(read_file(path), realtime=True))
+    finally:
+        bot.close()
+        bot.loop.close()
+
+    lines = [line for _, line in replay.transport.lines if line.startswith('PRIVMSG')]
+    assert lines == ['PRIVMSG #chan :alice: {}*2 = {}'.format(i, i * 2) for i in range(10)]
+
+    # Realtime replays keep the recorded gaps between messages
+    assert replay.elapsed >= 0.009
+
+    assert replay.messages == 10
+    assert replay.timings['MathPlugin', 'PRIVMSG'][0] == 10
+    assert replay.report()[0].startswith('Replayed 10 messages')
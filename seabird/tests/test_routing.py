@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Batch, Message
+from seabird.plugin import Plugin, CommandMixin
+
+
+class FakeTransport:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode('utf-8').splitlines())
+
+
+class RecordPlugin(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.seen = []
+
+    def irc_privmsg(self, msg):
+        self.seen.append((msg.args[0], msg.trailing))
+
+
+class OtherPlugin(RecordPlugin):
+    pass
+
+
+class EchoPlugin(Plugin, CommandMixin):
+    def cmd_echo(self, msg):
+        self.bot.reply(msg, msg.trailing)
+
+    def cmd_ping(self, msg):
+        self.bot.reply(msg, 'pong')
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def make_bot(loop, **rules):
+    config = Config(NICK='bot', PREFIX='!', **rules)
+    bot = Bot(config, loop=loop)
+    bot._transport = FakeTransport()
+    return bot
+
+
+def privmsg(target, text):
+    return Message(':alice!alice@example.com PRIVMSG {} :{}'.format(target, text))
+
+
+def test_no_rules(loop):
+    bot = make_bot(loop)
+    plugin = bot.load_plugin(RecordPlugin)
+    bot.dispatch(privmsg('#chan', 'hi'))
+
+    assert bot.router is None
+    assert plugin.seen == [('#chan', 'hi')]
+
+
+def test_plugin_rules(loop):
+    bot = make_bot(
+        loop,
+        PLUGIN_DENY=['OtherPlugin'],
+        CHANNEL_RULES={
+            '#quiet': {'plugin_deny': ['test_routing.RecordPlugin']},
+            '#Other': {'plugin_allow': ['OtherPlugin']},
+        },
+    )
+    record = bot.load_plugin(RecordPlugin)
+    other = bot.load_plugin(OtherPlugin)
+    isupport = bot.load_plugin('seabird.modules.isupport.ISupportPlugin')
+
+    for channel in ('#quiet', '#other', '#chan'):
+        bot.dispatch(Message(':bot!bot@example.com JOIN {}'.format(channel)))
+    assert bot.router.routes['#quiet'].plugins == [isupport]
+
+    for channel in ('#quiet', '#other', '#chan', 'bot'):
+        bot.dispatch(privmsg(channel, 'hi'))
+
+    assert record.seen == [('#chan', 'hi'), ('bot', 'hi')]
+    assert other.seen == [('#other', 'hi')]
+
+    # After leaving, the channel falls back to the network rules.
+    bot.dispatch(Message(':bot!bot@example.com PART #other'))
+    bot.dispatch(privmsg('#other', 'again'))
+    assert other.seen == [('#other', 'hi')]
+    assert record.seen[-1] == ('#other', 'again')
+
+
+def test_command_rules(loop):
+    bot = make_bot(
+        loop,
+        COMMAND_DENY=['ping'],
+        CHANNEL_RULES={'#pings': {'command_allow': ['ping']}},
+    )
+    bot.load_plugin(EchoPlugin)
+    bot.dispatch(Message(':bot!bot@example.com JOIN #pings'))
+
+    bot.dispatch(privmsg('#chan', '!ping'))
+    bot.dispatch(privmsg('#chan', '!echo hi'))
+    bot.dispatch(privmsg('#pings', '!echo hi'))
+    bot.dispatch(privmsg('#pings', '!PING'))
+
+    assert bot._transport.lines == ['PRIVMSG #chan hi', 'PRIVMSG #pings pong']
+
+
+def test_rules_rebuilt(loop):
+    bot = make_bot(loop, PLUGIN_DENY=['RecordPlugin'])
+    bot.dispatch(Message(':bot!bot@example.com JOIN #chan'))
+    record = bot.load_plugin(RecordPlugin)
+
+    bot.dispatch(privmsg('#chan', 'one'))
+    bot.config['PLUGIN_DENY'] = []
+    bot.update_routes()
+    bot.dispatch(privmsg('#chan', 'two'))
+
+    assert record.seen == [('#chan', 'two')]
+
+
+def test_channel_case(loop):
+    bot = make_bot(loop, CHANNEL_RULES={'#chan': {'plugin_deny': ['RecordPlugin']}})
+    record = bot.load_plugin(RecordPlugin)
+    bot.dispatch(Message(':bot!bot@example.com JOIN #Chan'))
+
+    bot.dispatch(privmsg('#chan', 'one'))
+    bot.dispatch(privmsg('#CHAN', 'two'))
+    assert record.seen == []
+
+    bot.dispatch(Message(':bot!bot@example.com PART #cHaN'))
+    assert not bot.router.routes
+
+
+def test_batch_routing(loop):
+    bot = make_bot(loop, CHANNEL_RULES={'#quiet': {'plugin_deny': ['RecordPlugin']}})
+    record = bot.load_plugin(RecordPlugin)
+    other = bot.load_plugin(OtherPlugin)
+    for channel in ('#quiet', '#chan'):
+        bot.dispatch(Message(':bot!bot@example.com JOIN {}'.format(channel)))
+
+    batch = Batch('ref', 'example', [])
+    batch.messages = [privmsg('#quiet', 'one'), privmsg('#chan', 'two')]
+    bot.dispatch_batch(batch)
+
+    assert record.seen == [('#chan', 'two')]
+    assert other.seen == [('#quiet', 'one'), ('#chan', 'two')]
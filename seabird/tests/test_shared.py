@@ -0,0 +1,91 @@
+import asyncio
+
+from ircserver import IRCServer
+
+from seabird.bot import Bot, network_configs, run_networks
+from seabird.config import Config
+from seabird.modules.upstream import UpstreamPlugin
+from seabird.shared import SharedResources
+
+
+def test_network_configs():
+    config = Config(
+        NICK='bot', PREFIX='!',
+        NETWORKS={'a': {'HOST': 'irc.a.net'}, 'b': {'HOST': 'irc.b.net', 'NICK': 'b'}},
+    )
+
+    networks = network_configs(config)
+    assert networks['a'] == {'NICK': 'bot', 'PREFIX': '!', 'HOST': 'irc.a.net'}
+    assert networks['b'] == {'NICK': 'b', 'PREFIX': '!', 'HOST': 'irc.b.net'}
+
+    single = Config(NICK='bot', HOST='irc.example.com')
+    assert network_configs(single) == {'irc.example.com': single}
+
+
+def test_shared_resources():
+    closed = []
+
+    async def close(value):
+        closed.append(value)
+
+    shared = SharedResources()
+    first = shared.get('key', list, close=close)
+    assert shared.get('key', list) is first
+    assert 'key' in shared
+
+    assert shared.executor.submit(int, '4').result() == 4
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(shared.close())
+    loop.close()
+
+    assert closed == [first]
+    assert 'key' not in shared
+
+
+def test_shared_plugins():
+    loop = asyncio.new_event_loop()
+    shared = SharedResources()
+
+    bots = [
+        Bot(Config(NICK=nick), loop=loop, shared=shared, name=nick)
+        for nick in ('a', 'b')
+    ]
+    upstreams = [bot.load_plugin(UpstreamPlugin) for bot in bots]
+
+    # Each network gets its own plugin, but they share upstreams
+    assert upstreams[0] is not upstreams[1]
+    assert upstreams[0].registry is upstreams[1].registry
+
+    loop.close()
+
+
+def test_run_networks():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    servers = [loop.run_until_complete(IRCServer().start()) for _ in range(2)]
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', SSL=False,
+        PLUGIN_CLASSES=[], RECONNECT_ON_FAILURE=False,
+        NETWORKS={
+            'a': {'PORT': servers[0].port},
+            'b': {'PORT': servers[1].port, 'NICK': 'other'},
+        },
+    )
+
+    async def drop():
+        for server in servers:
+            await server.registered.wait()
+            server.drop()
+
+    loop.create_task(drop())
+    run_networks(config, loop=loop)
+
+    assert 'NICK bot' in servers[0].lines
+    assert 'NICK other' in servers[1].lines
+
+    for server in servers:
+        loop.run_until_complete(server.stop())
+    loop.close()
+    asyncio.set_event_loop(None)
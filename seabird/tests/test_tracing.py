@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+from ircserver import IRCServer
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.plugin import Plugin, CommandMixin
+from seabird.tracing import Tracer, span
+
+
+async def until(cond, timeout=5):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not cond():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+class SlowPlugin(Plugin, CommandMixin):
+    def cmd_slow(self, msg):
+        self.create_task(self.slow(msg))
+
+    async def slow(self, msg):
+        with span('fetch', url='http://example.com'):
+            await asyncio.sleep(0.01)
+        self.bot.reply(msg, 'all done')
+
+
+def read_traces(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_trace(tmpdir):
+    path = str(tmpdir.join('traces.jsonl'))
+
+    async def test():
+        server = await IRCServer().start()
+        config = Config(
+            NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=server.port,
+            SSL=False, PREFIX='!', CMDS=['JOIN #chan'], TRACE_FILE=path,
+            TRACE_SAMPLE=1, PLUGIN_CLASSES=[
+                'seabird.modules.math.MathPlugin',
+                'test_tracing.SlowPlugin',
+            ],
+        )
+        bot = Bot(config, loop=asyncio.get_event_loop())
+        bot.load_plugins()
+        task = asyncio.ensure_future(bot.connect())
+
+        await until(lambda: 'bot' in server.channels.get('#chan', ()))
+        server.privmsg('alice', '#chan', '!math 1+1')
+        server.privmsg('alice', '#chan', '!slow')
+        await until(lambda: 'PRIVMSG #chan :all done' in server.lines)
+        await asyncio.sleep(0.05)
+
+        bot.stop()
+        await asyncio.wait_for(task, 5)
+        bot.close()
+        await bot.shared.close()
+        await server.stop()
+
+    run(test())
+
+    traces = read_traces(path)
+    privmsgs = [trace for trace in traces if trace['event'] == 'PRIVMSG']
+    assert len(privmsgs) == 2
+    assert len({trace['trace'] for trace in traces}) == len(traces)
+
+    math, slow = privmsgs
+    assert math['target'] == '#chan'
+    names = [s['name'] for s in math['spans']]
+    assert names[:2] == ['frame', 'parse']
+    assert 'handler' in names
+    sends = [s for s in math['spans'] if s['name'] == 'send']
+    assert [s['line'] for s in sends] == ['PRIVMSG #chan :alice: 1+1 = 2']
+
+    # The reply was sent from a task, after dispatch was done
+    spans = {s['name']: s for s in slow['spans']}
+    assert spans['fetch']['url'] == 'http://example.com'
+    assert spans['fetch']['duration'] >= 10
+    assert spans['task']['task'] == 'SlowPlugin.slow'
+    assert spans['send']['line'] == 'PRIVMSG #chan :all done'
+    assert 'incomplete' not in slow
+
+
+def test_trace_sample_and_timeout(tmpdir):
+    path = str(tmpdir.join('traces.jsonl'))
+    tracer = Tracer(path, sample=0.5, timeout=0.01)
+
+    samples = iter([0.7, 0.2])
+    tracer.random = lambda: next(samples)
+    assert tracer.maybe_trace(0) is None
+    trace = tracer.maybe_trace(0)
+
+    async def test():
+        task = asyncio.ensure_future(asyncio.sleep(1))
+        trace.add_task(task)
+        trace.dispatch_done()
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0)
+
+    run(test())
+    tracer.close()
+
+    # The task ended after the trace was written, so it isn't added.
+    assert trace.spans == []
+
+    traces = read_traces(path)
+    assert len(traces) == 1
+    assert traces[0]['trace'] == trace.id
+    assert traces[0]['incomplete'] is True
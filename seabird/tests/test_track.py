@@ -0,0 +1,206 @@
+import asyncio
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Message
+from seabird.modules.track import MembershipIndex, UserTrack
+
+
+class FakeTransport:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode('utf-8').splitlines())
+
+    def close(self):
+        pass
+
+
+def test_membership_index():
+    index = MembershipIndex()
+    index.join('bot', '#a')
+    index.join('bot', '#b')
+    index.join('alice', '#a', 0b01)
+    index.join('alice', '#b')
+    index.join('bob', '#a')
+
+    assert set(index.get_channel('#a').members) == {'bot', 'alice', 'bob'}
+    assert index.get_user('alice').channels == {'#a': 0b01, '#b': 0}
+
+    # Parting the last channel forgets the user
+    assert index.part('bob', '#a')
+    assert index.get_user('bob') is None
+    assert not index.part('bob', '#a')
+
+    index.set_modes('alice', '#b', 0b10, True)
+    index.set_modes('alice', '#a', 0b01, False)
+    assert index.get_user('alice').channels == {'#a': 0, '#b': 0b10}
+
+    index.rename('alice', 'carol')
+    assert index.get_user('alice') is None
+    assert 'carol' in index.get_channel('#a').members
+    assert 'carol' in index.get_channel('#b').members
+
+    # When we leave a channel, only users who aren't in any other channels
+    # are forgotten, and we never forget ourselves.
+    index.drop_channel('#a', keep='bot')
+    assert index.get_channel('#a') is None
+    assert index.get_user('carol').channels == {'#b': 0b10}
+
+    index.drop_channel('#b', keep='bot')
+    assert index.get_user('carol') is None
+    assert index.get_user('bot').channels == {}
+    assert not index.channels
+
+    index.join('dave', '#c')
+    index.remove_user('dave')
+    assert not index.channels
+
+
+def test_whox_sync():
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False,
+        TRACK_WHO_DELAY=0,
+    )
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bot = Bot(config, loop=loop)
+    track = bot.load_plugin(UserTrack)
+
+    transport = FakeTransport()
+    bot.connection_made(transport)
+
+    def feed(*lines):
+        for line in lines:
+            bot.dispatch(Message(line))
+
+    async def run():
+        feed(
+            ':irc.example.com 001 bot :Welcome',
+            ':irc.example.com 005 bot WHOX PREFIX=(ov)@+ :are supported by this server',
+            ':bot!bot@host JOIN #chan',
+        )
+        await asyncio.sleep(0)
+        assert transport.lines[-1] == 'WHO #chan %tcuhnfar,152'
+
+        feed(
+            ':irc.example.com 354 bot 152 #chan bot host bot H 0 :Bot',
+            ':irc.example.com 354 bot 152 #chan ali example.com Alice G*@+ alice :Alice A',
+            ':irc.example.com 315 bot #chan :End of /WHO list.',
+        )
+        await asyncio.sleep(0)
+
+    loop.run_until_complete(run())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+    alice = track.get_user('alice')
+    assert alice.nick == 'Alice'
+    assert alice.host == 'example.com'
+    assert alice.account == 'alice'
+    assert alice.realname == 'Alice A'
+    assert track.modes('Alice', '#chan') == {'o', 'v'}
+    assert track.get_user('bot').account is None
+
+    assert '#chan' in track.sync_times
+    assert not track.syncing
+    assert track.sync_task is None
+
+
+def test_reload_keeps_state():
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False
+    )
+    bot = Bot(config, loop=asyncio.new_event_loop())
+    track = bot.load_plugin(UserTrack)
+    bot.connection_made(FakeTransport())
+
+    for line in (
+        ':irc.example.com 001 bot :Welcome',
+        ':irc.example.com 005 bot PREFIX=(qov)~@+ :are supported by this server',
+        ':bot!bot@host JOIN #chan',
+        ':irc.example.com 353 bot = #chan :bot ~alice +bob',
+    ):
+        bot.dispatch(Message(line))
+
+    isupport, = bot.reload_plugin(track.isupport)
+    assert track.isupport is isupport
+    assert isupport.supported['PREFIX'] == '(qov)~@+'
+
+    new, = bot.reload_plugin(track)
+    assert new is not track
+    assert new.isupport is isupport
+    assert set(new.members('#chan')) == {'bot', 'alice', 'bob'}
+    assert new.modes('alice', '#chan') == {'q'}
+
+    bot.dispatch(Message(':bob!b@host PART #chan'))
+    assert set(new.members('#chan')) == {'bot', 'alice'}
+
+    # The channel never finished syncing, so the new instance picks it up.
+    assert list(new.sync_queue) == ['#chan']
+    bot.loop.run_until_complete(asyncio.sleep(0))
+    bot.loop.close()
+
+
+def test_whox_sync_timeout():
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False,
+        TRACK_WHO_DELAY=0, TRACK_WHO_OUTSTANDING=1, TRACK_WHO_TIMEOUT=0.05,
+    )
+    bot = Bot(config, loop=asyncio.new_event_loop())
+    track = bot.load_plugin(UserTrack)
+    transport = FakeTransport()
+    bot.connection_made(transport)
+
+    for line in (
+        ':irc.example.com 001 bot :Welcome',
+        ':irc.example.com 005 bot WHOX :are supported by this server',
+        ':bot!bot@host JOIN #a',
+        ':bot!bot@host JOIN #b',
+    ):
+        bot.dispatch(Message(line))
+
+    async def wait():
+        while transport.lines[-1] != 'WHO #b %tcuhnfar,152':
+            await asyncio.sleep(0.001)
+
+    # #a never answers, so #b is synced after the timeout and #a is forgotten.
+    bot.loop.run_until_complete(asyncio.wait_for(wait(), 5))
+    assert list(track.syncing) == ['#b']
+
+    bot.dispatch(Message(':irc.example.com 315 bot #a :End of /WHO list.'))
+    assert '#a' not in track.sync_times
+
+    track.connection_lost(None)
+    bot.loop.run_until_complete(asyncio.sleep(0))
+    bot.loop.close()
+
+
+def test_whox_sync_last_timeout():
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False,
+        TRACK_WHO_DELAY=0, TRACK_WHO_OUTSTANDING=5, TRACK_WHO_TIMEOUT=0.05,
+    )
+    bot = Bot(config, loop=asyncio.new_event_loop())
+    track = bot.load_plugin(UserTrack)
+    bot.connection_made(FakeTransport())
+
+    for line in (
+        ':irc.example.com 001 bot :Welcome',
+        ':irc.example.com 005 bot WHOX :are supported by this server',
+        ':bot!bot@host JOIN #a',
+    ):
+        bot.dispatch(Message(line))
+
+    async def finished():
+        await asyncio.sleep(0)
+        while track.sync_task is not None:
+            await asyncio.sleep(0.01)
+
+    # Nothing else is queued behind #a, but it still times out rather than
+    # being left in syncing.
+    bot.loop.run_until_complete(asyncio.wait_for(finished(), 5))
+    assert not track.syncing
+
+    bot.loop.close()
@@ -0,0 +1,218 @@
+import asyncio
+
+import pytest
+
+from seabird.modules.upstream import (
+    DEFAULT_POLICY,
+    CircuitBreaker,
+    Upstream,
+    UpstreamUnavailable,
+)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+needs_aiohttp = pytest.mark.skipif(aiohttp is None, reason='aiohttp is not installed')
+
+
+def test_breaker_opens_and_recovers(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    breaker = CircuitBreaker(0.5, min_requests=4, window=10, cooldown=30)
+
+    # Not enough requests to trip the breaker yet
+    for success in (True, False, False):
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # After the cooldown, a single trial request is let through
+    now[0] = 31.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_on_failed_trial(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    breaker = CircuitBreaker(0.5, min_requests=1, window=10, cooldown=30)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 31.0
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_disabled():
+    breaker = CircuitBreaker(None, min_requests=1, window=10, cooldown=30)
+    for _ in range(10):
+        breaker.record(False)
+        assert breaker.allow()
+
+
+class FakeResponse:
+    def __init__(self, status=200, data=None):
+        self.status = status
+        self.data = data
+
+    def release(self):
+        pass
+
+    async def json(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+    async def text(self):
+        return str(self.data)
+
+
+class FakeSession:
+    """Answers requests from a list of responses and exceptions"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, asyncio.Future):
+            result = await result
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+def make_upstream(session, **policy):
+    settings = dict(DEFAULT_POLICY, backoff=0.001, max_backoff=0.01)
+    settings.update(policy)
+    return Upstream('test', lambda: session, **settings)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@needs_aiohttp
+def test_retry_with_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr('random.uniform', lambda low, high: delays.append(high) or 0)
+
+    session = FakeSession(
+        aiohttp.ClientError(), FakeResponse(503), FakeResponse(data={'ok': True})
+    )
+    upstream = make_upstream(session, retries=2)
+
+    assert run(upstream.fetch_json('http://example.com')) == {'ok': True}
+    assert session.calls == 3
+    assert delays == [0.001, 0.002]
+    assert upstream.requests == 3
+    assert upstream.failures == 2
+
+    # The breaker only counts the request once.
+    assert list(upstream.breaker.results) == [True]
+
+
+@needs_aiohttp
+def test_failed_trial_is_not_retried(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    monkeypatch.setattr('random.uniform', lambda low, high: 0)
+
+    session = FakeSession(aiohttp.ClientError(), FakeResponse(data='ok'))
+    upstream = make_upstream(session, retries=2, min_requests=1)
+    upstream.breaker.trip()
+
+    now[0] = 31.0
+    with pytest.raises(UpstreamUnavailable):
+        run(upstream.fetch_text('http://example.com'))
+    assert session.calls == 1
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+
+
+@needs_aiohttp
+def test_retry_budget(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda low, high: 0)
+
+    session = FakeSession(*[aiohttp.ClientError()] * 3)
+    upstream = make_upstream(session, retries=2, retry_budget=1, retry_ratio=0)
+
+    # There's only one retry token, so only the first request is retried.
+    for _ in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            run(upstream.fetch_json('http://example.com'))
+    assert session.calls == 3
+    assert upstream.retry_tokens < 1
+
+
+@needs_aiohttp
+def test_stale_cache():
+    session = FakeSession(FakeResponse(data=[1]), aiohttp.ClientError())
+    upstream = make_upstream(session, retries=0)
+
+    assert run(upstream.fetch_json('http://example.com')) == [1]
+    assert run(upstream.fetch_json('http://example.com')) == [1]
+    assert upstream.failures == 1
+
+    # Other urls have nothing stale to fall back to.
+    session.results.append(aiohttp.ClientError())
+    with pytest.raises(UpstreamUnavailable):
+        run(upstream.fetch_json('http://example.com/other'))
+
+
+@needs_aiohttp
+def test_read_errors_are_failures():
+    session = FakeSession(FakeResponse(data=ValueError('bad json')))
+    upstream = make_upstream(session, retries=0)
+
+    with pytest.raises(ValueError):
+        run(upstream.fetch_json('http://example.com'))
+    assert upstream.failures == 1
+
+
+@needs_aiohttp
+def test_cancelled_trial_is_released(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    async def test():
+        hanging = asyncio.get_event_loop().create_future()
+        session = FakeSession(hanging, FakeResponse(data='ok'))
+        upstream = make_upstream(session, retries=0, min_requests=1)
+        upstream.breaker.trip()
+
+        # The trial request is cancelled before it finishes...
+        now[0] = 31.0
+        task = asyncio.ensure_future(upstream.fetch_text('http://example.com'))
+        await asyncio.sleep(0)
+        assert upstream.breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # ...so the next request gets to be the trial.
+        assert await upstream.fetch_text('http://example.com') == 'ok'
+        assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+    run(test())
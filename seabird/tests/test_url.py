@@ -0,0 +1,91 @@
+import codecs
+import re
+from urllib.parse import urlparse
+
+import pytest
+
+from seabird.modules.url import (
+    TitleParser,
+    URLMixin,
+    URLPlugin,
+    make_decoder,
+    sniff_charset,
+)
+
+
+def feed_chunks(data, size):
+    parser = TitleParser()
+    decoder = make_decoder('utf-8')
+    for i in range(0, len(data), size):
+        parser.feed(decoder.decode(data[i:i + size]))
+        if parser.done:
+            break
+
+    return parser
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 4096])
+def test_title_parser_chunks(size):
+    data = '<html><head><title>Hello &amp; wörld</title></head>'.encode('utf-8')
+    parser = feed_chunks(data, size)
+
+    assert parser.done
+    assert parser.title == 'Hello & wörld'
+
+
+def test_title_parser_stops_at_body():
+    parser = feed_chunks(b'<html><head></head><body><title>nope</title>', 4096)
+
+    assert parser.done
+    assert parser.title is None
+
+
+def test_sniff_charset():
+    assert sniff_charset(b'<meta charset="iso-8859-1">') == 'iso-8859-1'
+    assert sniff_charset(
+        b'<meta http-equiv="Content-Type" content="text/html; charset=Shift_JIS">'
+    ) == 'Shift_JIS'
+    assert sniff_charset(b'<title>nothing here</title>') is None
+
+
+def test_make_decoder_fallback():
+    decoder = make_decoder(None, 'not-a-charset')
+    assert isinstance(decoder, codecs.getincrementaldecoder('utf-8'))
+
+    decoder = make_decoder('latin-1', 'utf-8')
+    assert decoder.decode(b'\xe9', final=True) == 'é'
+
+
+class FakeBot:
+    def load_plugin(self, _):
+        return None
+
+
+class FakeURLPlugin(URLMixin):
+    url_patterns = {'example.com': re.compile(r'/match'), 'any.example.com': None}
+
+    def __init__(self):
+        self.matched = []
+
+    def url_match(self, msg, url):
+        self.matched.append(url.geturl())
+        return True
+
+
+def test_url_routing():
+    url_plugin = URLPlugin(FakeBot())
+    plugin = FakeURLPlugin()
+    url_plugin.register(plugin)
+
+    assert url_plugin.route(None, urlparse('https://EXAMPLE.com:443/match'))
+    assert url_plugin.route(None, urlparse('https://any.example.com/whatever'))
+    assert not url_plugin.route(None, urlparse('https://example.com/other'))
+    assert not url_plugin.route(None, urlparse('https://other.com/match'))
+
+    assert plugin.matched == [
+        'https://EXAMPLE.com:443/match',
+        'https://any.example.com/whatever',
+    ]
+
+    with pytest.raises(ValueError):
+        url_plugin.register(FakeURLPlugin())
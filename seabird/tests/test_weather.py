@@ -0,0 +1,43 @@
+import asyncio
+
+from seabird.modules.weather import ForecastCache
+
+
+class FakeUpstream:
+    def __init__(self):
+        self.urls = []
+
+    async def fetch_json(self, url, **kwargs):
+        self.urls.append(url)
+        await asyncio.sleep(0)
+        return {'url': url}
+
+
+def test_forecast_cache_shares_cells():
+    upstream = FakeUpstream()
+    cache = ForecastCache(upstream, 'key', grid=0.05, ttl=600)
+
+    async def run():
+        # These are all in the same grid cell, so they should share a single
+        # in-flight request.
+        first = await asyncio.gather(
+            cache.get(40.001, -105.002),
+            cache.get(40.012, -104.991),
+            cache.get(39.990, -105.010),
+        )
+
+        # A later lookup in the same cell should come from the cache, while a
+        # different cell needs its own request.
+        second = await cache.get(40.0, -105.0)
+        third = await cache.get(41.0, -105.0)
+
+        return first, second, third
+
+    loop = asyncio.new_event_loop()
+    first, second, third = loop.run_until_complete(run())
+    loop.close()
+
+    assert len(upstream.urls) == 2
+    assert first[0] is first[1] is first[2] is second
+    assert third is not second
+    assert not cache.inflight
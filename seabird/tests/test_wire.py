@@ -0,0 +1,91 @@
+import io
+
+import pytest
+
+from seabird.irc import CaseMapping, Message
+from seabird.wire import Decoder, Encoder, Reader, WireError, Writer, read_file
+
+LINES = [
+    '@time=2020-01-01T00:00:00.000Z;+draft/reply=a\\sb :alice!a@host PRIVMSG #chan :hi',
+    ':alice!a@host PRIVMSG #chan :hello there',
+    ':irc.example.com 005 bot CHANTYPES=# PREFIX=(ov)@+ :are supported',
+    'PING :irc.example.com',
+    '@account :bob!b@host JOIN #chan',
+    ':bob!b@host CUSTOMVERB a b ::)',
+    ':alice!a@host PRIVMSG #chan :',
+]
+
+
+def messages():
+    casemap = CaseMapping('ascii')
+    return [Message(line, current_nick='bot', casemap=casemap) for line in LINES]
+
+
+def check(decoded, timestamps):
+    for (timestamp, msg), orig, expected in zip(decoded, messages(), timestamps):
+        assert timestamp == pytest.approx(expected)
+        assert msg.tags == orig.tags
+        assert msg.hostmask == orig.hostmask
+        assert msg.event == orig.event
+        assert msg.args == orig.args
+        assert msg.current_nick == 'bot'
+
+        # The rebuilt line should parse to the same message
+        again = Message(msg.line)
+        assert (again.tags, again.event, again.args) == (orig.tags, orig.event, orig.args)
+
+
+def test_round_trip():
+    timestamps = [1600000000.5 + i for i in range(len(LINES))]
+    encoder = Encoder()
+    data = encoder.encode_many(zip(timestamps, messages()))
+
+    casemap = CaseMapping()
+    decoded = list(Decoder(casemap).decode(data))
+    assert len(decoded) == len(LINES)
+    assert casemap.name == 'ascii'
+    check(decoded, timestamps)
+
+    # Strings are only written once per stream.
+    more = encoder.encode_many([(timestamps[-1], messages()[1])])
+    assert b'alice' not in more
+
+
+def test_partial_records():
+    data = Encoder().encode_many((1.0, msg) for msg in messages())
+
+    decoder = Decoder()
+    decoded = list(decoder.decode(data[:-3]))
+    assert len(decoded) == len(LINES) - 1
+
+    decoded.extend(decoder.decode(data[decoder.consumed:]))
+    check(decoded, [1.0] * len(LINES))
+
+
+def test_reset():
+    encoder = Encoder()
+    encoder.max_strings = len(encoder.strings) + 2
+
+    items = [(float(i), msg) for i, msg in enumerate(messages())]
+    decoded = list(Decoder().decode(encoder.encode_many(items)))
+    check(decoded, [float(i) for i in range(len(LINES))])
+
+
+def test_files(tmpdir):
+    path = str(tmpdir.join('capture.sbw'))
+    with open(path, 'wb') as f:
+        writer = Writer(f)
+        for i, msg in enumerate(messages()):
+            writer.write(msg, 10.0 + i)
+
+    timestamps = [10.0 + i for i in range(len(LINES))]
+
+    check(list(read_file(path)), timestamps)
+
+    with open(path, 'rb') as f:
+        reader = Reader(f)
+        reader.chunk_size = 7
+        check(list(reader), timestamps)
+
+    with pytest.raises(WireError):
+        Reader(io.BytesIO(b'nope'))
@@ -0,0 +1,246 @@
+import asyncio
+import multiprocessing
+import os
+import pickle
+import time
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Batch, Message
+from seabird.modules.math import MathPlugin
+from seabird.modules.track import UserTrack
+from seabird.workers import Pipe, WorkerPool, handled_events
+
+
+class FakeTransport:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode('utf-8').splitlines())
+
+    def close(self):
+        pass
+
+
+class PausableTransport(FakeTransport):
+    def __init__(self):
+        super().__init__()
+        self.paused = False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+def make_bot(**settings):
+    config = Config(
+        NICK='bot', USER='bot', NAME='Bot', HOST='127.0.0.1', PORT=6667, SSL=False,
+        PREFIX='!', PLUGIN_CLASSES=[],
+    )
+    config.update(settings)
+    return Bot(config, loop=asyncio.new_event_loop())
+
+
+def test_handled_events():
+    assert handled_events([MathPlugin]) == {'PRIVMSG'}
+    assert {'JOIN', 'PART', '354'} <= handled_events([UserTrack])
+
+
+def test_shard():
+    bot = make_bot()
+    pool = WorkerPool(bot, ['seabird.modules.math.MathPlugin'], count=4)
+
+    def shard(line):
+        return pool.shard(Message(line))
+
+    # Messages for a channel always go to the same worker, no matter who sent
+    # them or how the channel name was capitalized.
+    assert shard(':a!a@h PRIVMSG #chan :hi') == shard(':b!b@h PRIVMSG #CHAN :hi')
+    assert shard(':a!a@h PRIVMSG bot :hi') == shard(':a!a@h QUIT :bye')
+
+    bot.loop.close()
+
+
+def test_worker_pool():
+    bot = make_bot(WORKER_PLUGINS=['seabird.modules.math.MathPlugin'], WORKER_COUNT=2)
+    bot.load_plugins()
+    assert bot.plugins == []
+
+    transport = FakeTransport()
+    bot.connection_made(transport)
+    bot.dispatch(Message(':irc.example.com 001 bot :Welcome'))
+    transport.lines.clear()
+
+    for i in range(20):
+        bot.dispatch(Message(':alice!a@h PRIVMSG #chan{} :!math {}+1'.format(i % 5, i)))
+
+    async def wait():
+        deadline = time.monotonic() + 30
+        while len(transport.lines) < 20 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    try:
+        bot.loop.run_until_complete(wait())
+    finally:
+        bot.close()
+        bot.loop.close()
+
+    assert sorted(transport.lines) == sorted(
+        'PRIVMSG #chan{} :alice: {}+1 = {}'.format(i % 5, i, i + 1) for i in range(20)
+    )
+
+    # Order is kept within each channel
+    chan0 = [line for line in transport.lines if line.startswith('PRIVMSG #chan0 ')]
+    assert chan0 == [
+        'PRIVMSG #chan0 :alice: {}+1 = {}'.format(i, i + 1) for i in range(0, 20, 5)
+    ]
+
+
+def test_worker_routes():
+    bot = make_bot(
+        WORKER_PLUGINS=['seabird.modules.math.MathPlugin'],
+        WORKER_COUNT=2,
+        CHANNEL_RULES={'#quiet': {'plugin_deny': ['MathPlugin']}},
+    )
+    bot.load_plugins()
+
+    transport = FakeTransport()
+    bot.connection_made(transport)
+    bot.dispatch(Message(':irc.example.com 001 bot :Welcome'))
+    bot.dispatch(Message(':bot!bot@h JOIN #quiet'))
+    bot.dispatch(Message(':bot!bot@h JOIN #chan'))
+    transport.lines.clear()
+
+    bot.dispatch(Message(':alice!a@h PRIVMSG #quiet :!math 1+1'))
+    bot.dispatch(Message(':alice!a@h PRIVMSG #chan :!math 2+2'))
+
+    # Once the bot has left, the channel rules don't apply anymore.
+    bot.dispatch(Message(':bot!bot@h PART #quiet'))
+    bot.dispatch(Message(':alice!a@h PRIVMSG #quiet :!math 3+3'))
+
+    async def wait():
+        deadline = time.monotonic() + 30
+        while len(transport.lines) < 2 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        # Give a reply which shouldn't be there a chance to show up.
+        await asyncio.sleep(0.2)
+
+    try:
+        bot.loop.run_until_complete(wait())
+    finally:
+        bot.close()
+        bot.loop.close()
+
+    assert sorted(transport.lines) == [
+        'PRIVMSG #chan :alice: 2+2 = 4',
+        'PRIVMSG #quiet :alice: 3+3 = 6',
+    ]
+
+
+def test_workers_leave_process_files_alone(tmp_path):
+    path = str(tmp_path / 'capture.log')
+    bot = make_bot(
+        CAPTURE_FILE=path,
+        TRACE_FILE=str(tmp_path / 'trace.log'),
+        WORKER_PLUGINS=['seabird.modules.math.MathPlugin'],
+        WORKER_COUNT=2,
+    )
+    bot.capture.write(Message(':irc.example.com 001 bot :Welcome'))
+    bot.capture.f.flush()
+    size = os.path.getsize(path)
+
+    bot.load_plugins()
+    assert 'CAPTURE_FILE' not in bot.workers.worker_config()
+    assert 'TRACE_FILE' not in bot.workers.worker_config()
+    try:
+        bot.loop.run_until_complete(asyncio.wait_for(bot.workers.wait_ready(), 30))
+    finally:
+        bot.close()
+        bot.loop.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == ['capture.log', 'trace.log']
+    assert os.path.getsize(path) == size
+
+
+class FakePipe:
+    def __init__(self, index):
+        self.index = index
+        self.frames = []
+
+    def encode(self, messages):
+        return [msg.args[0] for msg in messages]
+
+    def send(self, frame):
+        self.frames.append(frame)
+
+
+def test_batch_split_by_shard():
+    bot = make_bot()
+    pool = WorkerPool(bot, ['seabird.modules.track.UserTrack'], count=4)
+    pool.pipes = [FakePipe(index) for index in range(4)]
+
+    batch = Batch('ref', 'netsplit', [])
+    batch.messages = [
+        Message(':a!a@h PART #chan{} :split'.format(i)) for i in range(8)
+    ]
+    pool.dispatch_batch(batch)
+
+    # Every channel's part of the batch goes to the worker for that channel.
+    for pipe in pool.pipes:
+        for frame in pipe.frames:
+            assert frame[:4] == ('batch', 'ref', 'netsplit', [])
+            assert all(pool.shard(Message('PART ' + chan)) == pipe.index for chan in frame[4])
+
+    sent = [chan for pipe in pool.pipes for frame in pipe.frames for chan in frame[4]]
+    assert sorted(sent) == ['#chan{}'.format(i) for i in range(8)]
+
+    bot.loop.close()
+
+
+def test_pipe_backpressure():
+    bot = make_bot()
+    bot.connection_made(PausableTransport())
+    conn, other = multiprocessing.Pipe()
+    pipe = Pipe(conn, bot.loop, name='worker 0', bot=bot)
+    pipe.high_water = 64 * 1024
+    pipe.low_water = 16 * 1024
+
+    # Nobody is reading, so this can't all be written, but it mustn't block.
+    for i in range(64):
+        pipe.send(('line', 'x' * 16 * 1024))
+        pipe.flush()
+    assert pipe.writing
+    assert bot.paused_by == {pipe}
+    assert bot._transport.paused
+
+    received = []
+
+    # The other end reads from a thread, like a worker would from its own
+    # process.
+    def read():
+        while len(received) < 64:
+            received.extend(pickle.loads(other.recv_bytes()))
+
+    async def wait():
+        await bot.loop.run_in_executor(None, read)
+        while pipe.writing:
+            await asyncio.sleep(0.001)
+
+    try:
+        bot.loop.run_until_complete(asyncio.wait_for(wait(), 10))
+    finally:
+        pipe.close()
+        other.close()
+        bot.loop.close()
+
+    assert received == [('line', 'x' * 16 * 1024)] * 64
+    assert not pipe.writing
+    assert not bot.paused_by
+    assert not bot._transport.paused
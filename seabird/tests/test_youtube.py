@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+
+from seabird.bot import Bot
+from seabird.config import Config
+from seabird.irc import Message
+from seabird.modules.upstream import UpstreamError
+from seabird.modules.url.youtube import YoutubeURLPlugin
+
+
+class FakeTransport:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.extend(data.decode('utf-8').splitlines())
+
+
+class FakeUpstream:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.requests = []
+
+    async def fetch_json(self, url, params):
+        video_ids = params['id'].split(',')
+        self.requests.append(video_ids)
+        await asyncio.sleep(0)
+
+        if self.fail:
+            raise UpstreamError('youtube is down')
+
+        return {
+            'items': [
+                {
+                    'id': video_id,
+                    'snippet': {'title': 'Video ' + video_id},
+                    'contentDetails': {'duration': 'PT1M'},
+                }
+                for video_id in video_ids
+            ]
+        }
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def make_plugin(loop, upstream=None):
+    config = Config(NICK='bot', PREFIX='!', YOUTUBE_KEY='key', YOUTUBE_CACHE_SIZE=2)
+    bot = Bot(config, loop=loop)
+    bot._transport = FakeTransport()
+
+    plugin = bot.load_plugin(YoutubeURLPlugin)
+    plugin.upstreams = {'youtube': upstream or FakeUpstream()}
+    return plugin
+
+
+def privmsg(nick):
+    return Message(
+        ':{0}!{0}@example.com PRIVMSG #chan :look at this'.format(nick), current_nick='bot'
+    )
+
+
+def wait(plugin):
+    plugin.bot.loop.run_until_complete(asyncio.sleep(plugin.batch_delay * 2))
+
+
+def reply(video_id):
+    return 'PRIVMSG #chan :[YouTube] Video {} ~ 0:01:00'.format(video_id)
+
+
+def test_flush_on_batch_size(loop):
+    plugin = make_plugin(loop)
+    plugin.batch_size = 2
+    upstream = plugin.upstreams['youtube']
+
+    for video_id in 'abc':
+        plugin.lookup(privmsg('alice'), video_id)
+
+    # The first two went out without waiting, the third is waiting for more.
+    assert list(plugin.inflight) == ['a', 'b']
+    assert list(plugin.pending) == ['c']
+    assert plugin.flush_handle is not None
+
+    wait(plugin)
+    assert upstream.requests == [['a', 'b'], ['c']]
+    assert sorted(plugin.bot._transport.lines) == [reply('a'), reply('b'), reply('c')]
+
+
+def test_flush_after_delay(loop):
+    plugin = make_plugin(loop)
+    upstream = plugin.upstreams['youtube']
+
+    plugin.lookup(privmsg('alice'), 'a')
+    plugin.lookup(privmsg('bob'), 'b')
+    loop.run_until_complete(asyncio.sleep(0))
+    assert upstream.requests == []
+
+    wait(plugin)
+    assert upstream.requests == [['a', 'b']]
+    assert plugin.flush_handle is None
+
+
+def test_same_video_shares_request(loop):
+    plugin = make_plugin(loop)
+    upstream = plugin.upstreams['youtube']
+
+    # One lookup waiting to be sent and one while the request is in flight
+    plugin.lookup(privmsg('alice'), 'a')
+    plugin.lookup(privmsg('bob'), 'a')
+    plugin.flush()
+    plugin.lookup(privmsg('carol'), 'a')
+
+    wait(plugin)
+    assert upstream.requests == [['a']]
+    assert plugin.bot._transport.lines == [reply('a')] * 3
+    assert plugin.cache_counts == [0, 3]
+
+
+def test_failure_clears_inflight(loop):
+    plugin = make_plugin(loop, FakeUpstream(fail=True))
+    upstream = plugin.upstreams['youtube']
+
+    plugin.lookup(privmsg('alice'), 'a')
+    wait(plugin)
+    assert plugin.inflight == {}
+    assert plugin.bot._transport.lines == []
+
+    # The video can still be looked up once youtube is back.
+    upstream.fail = False
+    plugin.lookup(privmsg('alice'), 'a')
+    wait(plugin)
+    assert upstream.requests == [['a'], ['a']]
+    assert plugin.bot._transport.lines == [reply('a')]
+
+
+def test_cache_eviction(loop):
+    plugin = make_plugin(loop)
+    upstream = plugin.upstreams['youtube']
+
+    plugin.lookup(privmsg('alice'), 'a')
+    plugin.lookup(privmsg('alice'), 'b')
+    wait(plugin)
+
+    # Using a keeps it around, so b is the least recently used.
+    plugin.lookup(privmsg('alice'), 'a')
+    plugin.lookup(privmsg('alice'), 'c')
+    wait(plugin)
+    assert list(plugin.cache) == ['a', 'c']
+
+    plugin.lookup(privmsg('alice'), 'b')
+    wait(plugin)
+    assert upstream.requests == [['a', 'b'], ['c'], ['b']]
+
+
+def test_unload_cancels_flush(loop):
+    plugin = make_plugin(loop)
+    upstream = plugin.upstreams['youtube']
+
+    plugin.lookup(privmsg('alice'), 'a')
+    plugin.bot.unload_plugin(plugin)
+    assert plugin.flush_handle is None
+    assert not plugin.pending
+
+    wait(plugin)
+    assert upstream.requests == []
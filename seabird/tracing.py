@@ -0,0 +1,194 @@
+"""Follow single messages through the bot
+
+When TRACE_FILE is set, a sample of incoming lines (TRACE_SAMPLE, 1% by
+default) get a Trace. It records how long framing and parsing took, how
+long each plugin's handler ran, any tasks the handlers started (and what
+those did, like upstream requests or database sessions) and every line
+sent while handling it. Once everything is done, the trace is written as a
+line of JSON to a rotating file. Like the normal log, writing (and encoding
+the JSON) happens on a listener thread so the loop never waits on the disk.
+
+The current trace is kept in a context variable. asyncio copies the context
+into tasks when they're created, so anything started while handling a
+message, and anything it sends, is tied back to that message without
+having to pass the trace around. Plugins can time their own work in the
+current trace with span().
+"""
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+from logging.handlers import QueueListener, RotatingFileHandler
+import os
+import random
+import time
+
+current_trace = ContextVar("seabird_trace", default=None)
+
+
+class Trace:
+    def __init__(self, tracer, start):
+        self.tracer = tracer
+        self.id = os.urandom(8).hex()
+        self.start = start
+        self.time = time.time()
+
+        self.event = None
+        self.target = None
+        self.spans = []
+
+        # The trace is written once dispatch is done and everything holding
+        # it (tasks and plugin queues) has let go, or after the tracer's
+        # timeout.
+        self.dispatched = False
+        self.pending = 0
+        self.finished = False
+
+    def add_span(self, name, start, end, **attrs):
+        # Once finished, the trace may already be on its way to the file.
+        if self.finished:
+            return
+
+        entry = {
+            "name": name,
+            "start": round((start - self.start) * 1000, 3),
+            "duration": round((end - start) * 1000, 3),
+        }
+        entry.update(attrs)
+        self.spans.append(entry)
+
+    def hold(self):
+        """Keep the trace open until release is called"""
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+        if self.dispatched and not self.pending:
+            self.finish()
+
+    def add_task(self, task):
+        self.hold()
+        start = time.perf_counter()
+        name = task.get_coro().__qualname__
+
+        def done(_):
+            self.add_span("task", start, time.perf_counter(), task=name)
+            self.release()
+
+        task.add_done_callback(done)
+
+    def dispatch_done(self):
+        self.dispatched = True
+        if not self.pending:
+            self.finish()
+        else:
+            asyncio.get_event_loop().call_later(self.tracer.timeout, self.finish, True)
+
+    def finish(self, incomplete=False):
+        if self.finished:
+            return
+
+        self.finished = True
+        self.tracer.write(self, incomplete)
+
+    def as_dict(self):
+        return {
+            "trace": self.id,
+            "time": self.time,
+            "event": self.event,
+            "target": self.target,
+            "spans": self.spans,
+        }
+
+
+class TraceFormatter(logging.Formatter):
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            return json.dumps(record.msg)
+
+        # Anything else is from the queue handler, like a count of dropped
+        # traces.
+        return json.dumps({"warning": record.getMessage()})
+
+
+class Tracer:
+    def __init__(self, path, sample=0.01, max_bytes=16 * 1024 * 1024, backups=5, timeout=30):
+        # seabird.log imports seabird.irc, which imports this module.
+        from .log import DroppingQueueHandler  # pylint: disable=import-outside-toplevel
+
+        self.sample = sample
+        self.timeout = timeout
+
+        # The traces go through their own logger so we get rotation for free.
+        # It doesn't propagate, so traces never end up in the normal log.
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        self.handler.setFormatter(TraceFormatter())
+        self.queue_handler = DroppingQueueHandler()
+        self.listener = QueueListener(self.queue_handler.queue, self.handler)
+        self.logger = logging.getLogger("seabird.traces.{}".format(path))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+        self.random = random.random
+
+    @classmethod
+    def from_config(cls, config):
+        path = config.get("TRACE_FILE")
+        if path is None:
+            return None
+
+        return cls(
+            path,
+            sample=config.get("TRACE_SAMPLE", 0.01),
+            max_bytes=config.get("TRACE_MAX_BYTES", 16 * 1024 * 1024),
+            backups=config.get("TRACE_BACKUPS", 5),
+        )
+
+    def maybe_trace(self, start):
+        """Return a new Trace for a sample of calls, None for the rest"""
+        if self.random() >= self.sample:
+            return None
+
+        return Trace(self, start)
+
+    def write(self, trace, incomplete=False):
+        data = trace.as_dict()
+        if incomplete:
+            data["incomplete"] = True
+
+        self.logger.info(data)
+
+    def close(self):
+        # Stopping the listener writes out anything still queued.
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.handler.close()
+
+
+@contextmanager
+def use_trace(trace):
+    """Make trace the current trace until the block exits"""
+    token = current_trace.set(trace)
+    try:
+        yield
+    finally:
+        current_trace.reset(token)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Record a span in the current trace, if there is one"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), **attrs)
@@ -0,0 +1,402 @@
+"""Compact binary encoding for parsed messages
+
+This is used for traffic captures, replays and for sending messages to
+worker processes, so nobody has to parse the raw lines again.
+
+A stream is a series of records, each prefixed with its length as a varint
+so readers can skip or split them without decoding. Files start with MAGIC
+and a version byte. Records are one of:
+
+- STRING: adds a string to the string table. Verbs, sources and tag keys
+  are written as references into this table, which starts out with the
+  common verbs in VERBS.
+- STATE: sets the current nick and casemapping for the messages which
+  follow.
+- MESSAGE: receive time (microseconds, as a delta from the last message),
+  verb, source, tags and params. Tag values and params are length prefixed
+  utf-8.
+- RESET: clears the string table back to VERBS. Writers do this when the
+  table gets too big so long running streams don't grow without bound.
+
+All integers are unsigned LEB128 varints. Signed values are zigzag encoded.
+"""
+
+import mmap
+
+from .irc import Message
+
+MAGIC = b"SBW"
+VERSION = 1
+
+STRING = 1
+STATE = 2
+MESSAGE = 3
+RESET = 4
+
+# These are always in the string table, so the most common verbs never need
+# to be written out.
+VERBS = (
+    "PRIVMSG",
+    "NOTICE",
+    "JOIN",
+    "PART",
+    "QUIT",
+    "NICK",
+    "MODE",
+    "KICK",
+    "TOPIC",
+    "PING",
+    "PONG",
+    "CAP",
+    "BATCH",
+    "AWAY",
+    "ACCOUNT",
+    "CHGHOST",
+    "INVITE",
+    "ERROR",
+    "001",
+    "002",
+    "003",
+    "004",
+    "005",
+    "315",
+    "332",
+    "333",
+    "352",
+    "353",
+    "354",
+    "366",
+    "372",
+    "375",
+    "376",
+    "433",
+)
+
+
+class WireError(Exception):
+    pass
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+class Encoder:
+    """Turn messages into records
+
+    The encoder keeps the string table, so a stream must be written by a
+    single encoder and read by a single decoder from the start.
+    """
+
+    max_strings = 65536
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.strings = {verb: index for index, verb in enumerate(VERBS)}
+        self.current_nick = None
+        self.casemap = None
+        self.last_time = 0
+
+    def _record(self, out, kind, payload):
+        _write_varint(out, len(payload) + 1)
+        out.append(kind)
+        out += payload
+
+    def _ref(self, out, value):
+        """Write a reference to a string, defining it first if needed"""
+        index = self.strings.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings[value] = index
+
+            data = value.encode("utf-8")
+            payload = bytearray()
+            _write_varint(payload, len(data))
+            payload += data
+            self._record(out, STRING, payload)
+
+        return index
+
+    def encode(self, msg, timestamp, out):
+        """Append the records for a message to out"""
+        if len(self.strings) >= self.max_strings:
+            self._record(out, RESET, b"")
+            self.reset()
+
+        casemap = msg.casemap.name if msg.casemap is not None else None
+        if msg.current_nick != self.current_nick or casemap != self.casemap:
+            self.current_nick = msg.current_nick
+            self.casemap = casemap
+
+            payload = bytearray()
+            for value in (msg.current_nick, casemap):
+                _write_varint(payload, 0 if value is None else self._ref(out, value) + 1)
+            self._record(out, STATE, payload)
+
+        # References need to be defined before the message record starts, so
+        # we look them all up first.
+        verb = self._ref(out, msg.event)
+        source = 0 if msg.hostmask is None else self._ref(out, msg.hostmask) + 1
+        tags = [(self._ref(out, key), value) for key, value in msg.tags.items()]
+
+        micros = int(timestamp * 1000000)
+        payload = bytearray()
+        _write_varint(payload, _zigzag(micros - self.last_time))
+        self.last_time = micros
+
+        _write_varint(payload, verb)
+        _write_varint(payload, source)
+
+        _write_varint(payload, len(tags))
+        for key, value in tags:
+            _write_varint(payload, key)
+            if value is None:
+                payload.append(0)
+            else:
+                data = value.encode("utf-8")
+                _write_varint(payload, len(data) + 1)
+                payload += data
+
+        _write_varint(payload, len(msg.args))
+        for arg in msg.args:
+            data = arg.encode("utf-8")
+            _write_varint(payload, len(data))
+            payload += data
+
+        self._record(out, MESSAGE, payload)
+
+    def encode_many(self, items):
+        """Return the records for an iterable of (timestamp, message)"""
+        out = bytearray()
+        for timestamp, msg in items:
+            self.encode(msg, timestamp, out)
+        return bytes(out)
+
+
+class Decoder:
+    """Turn records back into messages
+
+    If a CaseMapping is passed in, it's switched to whatever mapping the
+    messages were written with and attached to every message.
+    """
+
+    def __init__(self, casemap=None):
+        self.casemap = casemap
+        self.reset()
+
+        # Number of bytes used by the last call to decode
+        self.consumed = 0
+
+    def reset(self):
+        self.strings = list(VERBS)
+        self.current_nick = None
+        self.last_time = 0
+
+    def _string(self, data, pos):
+        length, pos = _read_varint(data, pos)
+        return str(data[pos : pos + length], "utf-8"), pos + length
+
+    def _message(self, data, pos):
+        strings = self.strings
+
+        # Almost every varint in a message fits in a single byte, so that case
+        # is handled inline.
+        delta, pos = _read_varint(data, pos)
+        self.last_time += _unzigzag(delta)
+
+        verb = data[pos]
+        pos += 1
+        if verb & 0x80:
+            verb, pos = _read_varint(data, pos - 1)
+
+        source = data[pos]
+        pos += 1
+        if source & 0x80:
+            source, pos = _read_varint(data, pos - 1)
+
+        count = data[pos]
+        pos += 1
+        if count & 0x80:
+            count, pos = _read_varint(data, pos - 1)
+        tags = {}
+        for _ in range(count):
+            key = data[pos]
+            pos += 1
+            if key & 0x80:
+                key, pos = _read_varint(data, pos - 1)
+
+            length = data[pos]
+            pos += 1
+            if length & 0x80:
+                length, pos = _read_varint(data, pos - 1)
+
+            if length:
+                tags[strings[key]] = str(data[pos : pos + length - 1], "utf-8")
+                pos += length - 1
+            else:
+                tags[strings[key]] = None
+
+        count = data[pos]
+        pos += 1
+        if count & 0x80:
+            count, pos = _read_varint(data, pos - 1)
+        args = []
+        for _ in range(count):
+            length = data[pos]
+            pos += 1
+            if length & 0x80:
+                length, pos = _read_varint(data, pos - 1)
+
+            args.append(str(data[pos : pos + length], "utf-8"))
+            pos += length
+        return self.last_time / 1000000, Message.from_parts(
+            strings[verb],
+            args,
+            tags=tags,
+            hostmask=strings[source - 1] if source else None,
+            current_nick=self.current_nick,
+            casemap=self.casemap,
+        )
+
+    def decode(self, data):
+        """Yield (timestamp, message) for every complete record in data
+
+        data can be anything supporting the buffer protocol. Only complete
+        records are read; self.consumed is set to the number of bytes used so
+        callers can keep the rest around until more data arrives.
+        """
+        data = memoryview(data)
+        strings = self.strings
+        pos = 0
+        end = len(data)
+        self.consumed = 0
+
+        while pos < end:
+            # Stop if the length or the record itself is incomplete.
+            try:
+                length, start = _read_varint(data, pos)
+            except IndexError:
+                break
+            if start + length > end:
+                break
+
+            kind = data[start]
+            pos = start + 1
+            record_end = start + length
+
+            if kind == MESSAGE:
+                yield self._message(data, pos)
+            elif kind == STRING:
+                value, pos = self._string(data, pos)
+                strings.append(value)
+            elif kind == STATE:
+                nick, pos = _read_varint(data, pos)
+                casemap, pos = _read_varint(data, pos)
+                self.current_nick = strings[nick - 1] if nick else None
+                if casemap and self.casemap is not None:
+                    name = strings[casemap - 1]
+                    if name != self.casemap.name:
+                        self.casemap.set_mapping(name)
+            elif kind == RESET:
+                self.reset()
+                strings = self.strings
+            else:
+                raise WireError("Unknown record type {}".format(kind))
+
+            pos = record_end
+            self.consumed = pos
+
+
+class Writer:
+    """Write messages to a file"""
+
+    def __init__(self, f):
+        self.f = f
+        self.encoder = Encoder()
+
+        self.f.write(MAGIC + bytes([VERSION]))
+
+    def write(self, msg, timestamp):
+        out = bytearray()
+        self.encoder.encode(msg, timestamp, out)
+        self.f.write(out)
+
+
+def _check_header(header):
+    if len(header) < len(MAGIC) + 1 or bytes(header[: len(MAGIC)]) != MAGIC:
+        raise WireError("Not a message capture")
+
+    if header[len(MAGIC)] != VERSION:
+        raise WireError("Unsupported capture version {}".format(header[len(MAGIC)]))
+
+
+class Reader:
+    """Read messages from a file as it's being written or streamed"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, f, casemap=None):
+        self.f = f
+        self.decoder = Decoder(casemap)
+
+        _check_header(self.f.read(len(MAGIC) + 1))
+
+    def __iter__(self):
+        buf = bytearray()
+        while True:
+            chunk = self.f.read(self.chunk_size)
+            if not chunk:
+                break
+
+            buf += chunk
+            yield from self.decoder.decode(buf)
+            del buf[: self.decoder.consumed]
+
+        if buf:
+            raise WireError("Capture ends with a partial record")
+
+
+def read_file(path, casemap=None):
+    """Yield (timestamp, message) from a capture file
+
+    The file is memory mapped and decoded in place, so the only copies made
+    are the strings in the messages themselves.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                header = len(MAGIC) + 1
+                _check_header(view[:header])
+
+                decoder = Decoder(casemap)
+                yield from decoder.decode(view[header:])
+                if decoder.consumed != len(view) - header:
+                    raise WireError("Capture ends with a partial record")
+            finally:
+                view.release()
@@ -0,0 +1,470 @@
+"""Run selected plugins in a pool of worker processes
+
+The main process keeps the connection and every plugin which isn't listed in
+WORKER_PLUGINS. Messages those plugins care about are sent to one of
+WORKER_COUNT worker processes, chosen by channel (or by nick for anything
+which isn't in a channel) so messages for a channel are always handled in
+order. Anything the plugins write is sent back to the main process over the
+same pipe.
+
+Worker plugins see the connection through a stand-in bot, so they can reply
+and use config and shared resources as normal, but they can't see plugins in
+the main process or request capabilities.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import struct
+import time
+from zlib import crc32
+
+from .bot import Bot
+from .config import Config
+from .irc import TRAFFIC_LOG, Batch
+from .plugin import CommandMixin, Plugin
+from .wire import Decoder, Encoder
+
+LOG = logging.getLogger(__name__)
+
+# Used to tell if a message is for a channel before ISUPPORT is available.
+CHANNEL_PREFIXES = "#&!+"
+
+# Settings for things the main process owns. Workers don't get these, so they
+# don't open the same files or try to listen on the same address.
+PROCESS_SETTINGS = (
+    "CAPTURE_FILE",
+    "METRICS_PORT",
+    "METRICS_SOCKET",
+    "TRACE_FILE",
+    "WORKER_PLUGINS",
+)
+
+
+def handled_events(plugin_classes):
+    """Return the set of events the given plugins handle
+
+    None means every event should be sent, because at least one plugin does
+    its own dispatching.
+    """
+    events = set()
+    for plugin_class in plugin_classes:
+        if plugin_class.dispatch_event is not Plugin.dispatch_event:
+            return None
+
+        if issubclass(plugin_class, CommandMixin):
+            events.add("PRIVMSG")
+
+        for name in dir(plugin_class):
+            if name.startswith("irc_"):
+                events.add(name[4:].upper())
+
+    return events
+
+
+class Pipe:
+    """One end of a pipe which sends frames in batches
+
+    Frames are collected until the loop gets a chance to run, then sent with
+    a single write. This keeps the number of syscalls (and pickles) down when
+    a lot of lines come in at once.
+
+    Writes never block the loop. Whatever the other end isn't ready for is
+    buffered and written when the pipe is writable again. If a bot is given,
+    it stops reading from the server while more than high_water bytes are
+    waiting, until the buffer is down to low_water.
+
+    Messages are sent in the wire format. Each end keeps the string table for
+    its direction, so frames have to be read in the order they were sent.
+    """
+
+    high_water = 4 * 1024 * 1024
+    low_water = 1024 * 1024
+
+    def __init__(self, conn, loop, casemap=None, name="pipe", bot=None):
+        self.conn = conn
+        self.loop = loop
+        self.name = name
+        self.bot = bot
+
+        # Writes go through a socket on the same fd so they can be
+        # non-blocking without changing how the Connection reads.
+        self.sock = socket.fromfd(conn.fileno(), socket.AF_UNIX, socket.SOCK_STREAM)
+
+        self.encoder = Encoder()
+        self.decoder = Decoder(casemap)
+
+        self.outgoing = []
+        self.flush_handle = None
+        self.buffer = bytearray()
+        self.writing = False
+
+    def encode(self, messages):
+        out = bytearray()
+        now = time.time()
+        for msg in messages:
+            self.encoder.encode(msg, now, out)
+        return out
+
+    def decode(self, data):
+        return [msg for _, msg in self.decoder.decode(data)]
+
+    def send_message(self, msg):
+        # Consecutive messages share a single frame.
+        if not self.outgoing or self.outgoing[-1][0] != "wire":
+            self.send(("wire", bytearray()))
+
+        self.encoder.encode(msg, time.time(), self.outgoing[-1][1])
+
+    def send(self, frame):
+        self.outgoing.append(frame)
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if not self.outgoing:
+            return
+
+        frames, self.outgoing = self.outgoing, []
+        data = pickle.dumps(frames, pickle.HIGHEST_PROTOCOL)
+
+        # This is the same framing Connection.send_bytes uses, so the other
+        # end can read it with recv_bytes.
+        if len(data) > 0x7FFFFFFF:
+            self.buffer += struct.pack("!iQ", -1, len(data))
+        else:
+            self.buffer += struct.pack("!i", len(data))
+        self.buffer += data
+
+        self.write()
+
+    def write(self):
+        while self.buffer:
+            try:
+                sent = self.sock.send(self.buffer, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # The other end is gone. That's noticed (and reported) when
+                # reading, so there's nothing more to do here.
+                LOG.debug("Dropping %d bytes for %s", len(self.buffer), self.name)
+                self.buffer.clear()
+                break
+
+            del self.buffer[:sent]
+
+        if self.buffer and not self.writing:
+            self.writing = True
+            self.loop.add_writer(self.sock.fileno(), self.write)
+        elif not self.buffer and self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.sock.fileno())
+
+        if self.bot is not None:
+            if len(self.buffer) > self.high_water:
+                self.bot.pause_reading(self)
+            elif len(self.buffer) <= self.low_water:
+                self.bot.resume_reading(self)
+
+    def drain(self):
+        """Send everything which is waiting, blocking if needed"""
+        self.flush()
+        if self.buffer:
+            self.sock.sendall(self.buffer)
+            self.buffer.clear()
+            self.write()
+
+    def receive(self):
+        """Yield every frame which is waiting to be read
+
+        EOFError is raised when the other end goes away.
+        """
+        while self.conn.poll():
+            yield from pickle.loads(self.conn.recv_bytes())
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.sock.fileno())
+
+        if self.bot is not None:
+            self.bot.resume_reading(self)
+
+        self.sock.close()
+        self.conn.close()
+
+
+class WorkerBot(Bot):
+    """Stand-in for the bot inside a worker process"""
+
+    def __init__(self, config, conn, loop):
+        super().__init__(config, loop=loop)
+
+        self.pipe = Pipe(conn, loop, self.casemap)
+        self.stopped = loop.create_future()
+
+    def write_line(self, line):
+        TRAFFIC_LOG.debug("--> %s", line)
+
+        self.pipe.send(("line", line))
+
+    def read(self):
+        try:
+            frames = list(self.pipe.receive())
+        except EOFError:
+            frames = [("stop",)]
+
+        for kind, *args in frames:
+            if kind == "wire":
+                for msg in self.pipe.decode(*args):
+                    self.handle_message(msg)
+            elif kind == "batch":
+                self.handle_batch_frame(*args)
+            elif kind == "event":
+                self.handle_event(*args)
+            elif kind == "route":
+                self.handle_route(*args)
+            elif kind == "stop":
+                if not self.stopped.done():
+                    self.stopped.set_result(None)
+                return
+
+    def handle_message(self, msg):
+        self.current_nick = msg.current_nick
+
+        plugins = self.plugins
+        if self.router is not None:
+            plugins = self.router.route(msg).plugins
+
+        for plugin in plugins:
+            try:
+                result = plugin.dispatch_event(msg)
+                if result is not None:
+                    plugin.schedule(result)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Plugin %s failed to handle %s", plugin, msg.line)
+
+    def handle_batch_frame(self, ref, batch_type, params, messages):
+        batch = Batch(ref, batch_type, params)
+        batch.messages = self.pipe.decode(messages)
+        if batch.messages:
+            self.current_nick = batch.messages[-1].current_nick
+
+        if self.router is None:
+            routed = [(plugin, batch) for plugin in self.plugins]
+        else:
+            routed = self.router.route_batch(batch)
+
+        for plugin, plugin_batch in routed:
+            try:
+                result = plugin.dispatch_batch(plugin_batch)
+                if result is not None:
+                    plugin.schedule(result)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("Plugin %s failed to handle batch %s", plugin, ref)
+
+    def handle_route(self, change, channel):
+        if self.router is not None:
+            getattr(self.router, change)(channel)
+
+    def handle_event(self, name):
+        if name == "connection_made" and self.router is not None:
+            self.router.clear()
+
+        for plugin in self.plugins:
+            if name == "connection_made":
+                plugin.connection_made(None)
+            elif name == "connection_lost":
+                plugin.connection_lost(None)
+            elif name == "reconnected":
+                plugin.reconnected()
+
+
+def worker_main(conn, config, plugin_names):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    bot = WorkerBot(Config(config), conn, loop)
+    for name in plugin_names:
+        bot.load_plugin(name)
+
+    loop.add_reader(conn.fileno(), bot.read)
+    bot.pipe.send(("ready",))
+    try:
+        loop.run_until_complete(bot.stopped)
+
+        # Make sure anything written while handling the last messages makes
+        # it out.
+        bot.pipe.drain()
+    finally:
+        loop.remove_reader(conn.fileno())
+        loop.run_until_complete(bot.shared.close())
+        bot.pipe.close()
+        loop.close()
+
+
+class WorkerPool:
+    def __init__(self, bot, plugin_names, count=None):
+        self.bot = bot
+        self.plugin_names = list(plugin_names)
+        self.count = count or os.cpu_count() or 1
+
+        # Import the classes here so mistakes show up at startup rather than
+        # in a worker, and so we know which events to send.
+        self.events = handled_events(
+            [self._import(name) for name in self.plugin_names]
+        )
+
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.pipes = []
+        self.ready = []
+
+    @staticmethod
+    def _import(name):
+        module, _, class_name = name.rpartition(".")
+        plugin_class = getattr(__import__(module, fromlist=[class_name]), class_name)
+        if not issubclass(plugin_class, Plugin):
+            raise TypeError("Class {} is not a valid Plugin".format(name))
+
+        return plugin_class
+
+    def worker_config(self):
+        return {
+            key: value
+            for key, value in self.bot.config.items()
+            if key not in PROCESS_SETTINGS
+        }
+
+    def start(self):
+        config = self.worker_config()
+        for index in range(self.count):
+            conn, child_conn = self.context.Pipe()
+            process = self.context.Process(
+                target=worker_main,
+                args=(child_conn, config, self.plugin_names),
+                name="seabird-worker-{}".format(index),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+
+            pipe = Pipe(conn, self.bot.loop, name="worker {}".format(index), bot=self.bot)
+            self.bot.loop.add_reader(conn.fileno(), self.read, index)
+
+            self.processes.append(process)
+            self.pipes.append(pipe)
+            self.ready.append(self.bot.loop.create_future())
+
+        LOG.info(
+            "Started %d workers for %s", self.count, ", ".join(self.plugin_names)
+        )
+
+    def stop(self, timeout=5):
+        for pipe in self.pipes:
+            try:
+                self.bot.loop.remove_reader(pipe.conn.fileno())
+                pipe.send(("stop",))
+                pipe.drain()
+            except OSError:
+                pass
+
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+        for pipe in self.pipes:
+            pipe.close()
+
+        self.processes = []
+        self.pipes = []
+        self.ready = []
+
+    async def wait_ready(self):
+        """Wait until every worker has loaded its plugins"""
+        await asyncio.gather(*self.ready)
+
+    def read(self, index):
+        pipe = self.pipes[index]
+        try:
+            for frame in pipe.receive():
+                if frame[0] == "line":
+                    self.write_line(frame[1])
+                elif frame[0] == "ready" and not self.ready[index].done():
+                    self.ready[index].set_result(None)
+        except EOFError:
+            LOG.error("Worker %d exited", index)
+            self.bot.loop.remove_reader(pipe.conn.fileno())
+
+    def write_line(self, line):
+        # Replies which come back after we've been disconnected have nowhere
+        # to go.
+        if self.bot._transport is None:  # pylint: disable=protected-access
+            LOG.debug("Dropping line from worker: %s", line)
+            return
+
+        self.bot.write_line(line)
+
+    def shard(self, msg):
+        """Return the index of the worker which should handle a message"""
+        if msg.args and msg.args[0][:1] in CHANNEL_PREFIXES:
+            key = msg.args[0]
+        elif msg.hostmask is not None:
+            key = msg.identity.name
+        else:
+            key = ""
+
+        key = self.bot.casemap.fold(key)
+        return crc32(key.encode("utf-8")) % self.count
+
+    def wants(self, msg):
+        return self.events is None or msg.event in self.events
+
+    def dispatch(self, msg):
+        if not self.pipes or not self.wants(msg):
+            return
+
+        self.pipes[self.shard(msg)].send_message(msg)
+
+    def dispatch_batch(self, batch):
+        if not self.pipes:
+            return
+
+        # A batch (like a netsplit) can cover a lot of channels. Each worker
+        # gets the part of it for the channels it handles, so it's still
+        # handled in order with everything else for those channels.
+        shards = {}
+        for msg in batch.messages:
+            if self.wants(msg):
+                shards.setdefault(self.shard(msg), []).append(msg)
+
+        for index, messages in shards.items():
+            pipe = self.pipes[index]
+            pipe.send(
+                ("batch", batch.ref, batch.type, batch.params, pipe.encode(messages))
+            )
+
+    def broadcast_event(self, name):
+        for pipe in self.pipes:
+            pipe.send(("event", name))
+
+    def broadcast_route(self, change, channel):
+        """Tell workers the bot joined or left a channel
+
+        Workers never see most JOINs and PARTs, so this is how their routers
+        know which channels have a route.
+        """
+        for pipe in self.pipes:
+            pipe.send(("route", change, channel))